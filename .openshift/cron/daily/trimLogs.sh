@@ -1,3 +0,0 @@
-#!/bin/bash
-# Trim the log files
-python $OPENSHIFT_REPO_DIR/utils/trimLogs.py
@@ -16,11 +16,12 @@ import subprocess
 from datetime import datetime
 import gevent
 from gevent import Greenlet
-import logging
+from gevent import subprocess as gevent_subprocess
 
 # custom imports
 from dcmetrometrics.common.globals import DATA_DIR, REPO_DIR, DATA_DIR
-from dcmetrometrics.common.restartingGreenlet import RestartingGreenlet
+from dcmetrometrics.common.restartingGreenlet import RestartingGreenlet, TickingGreenlet
+from dcmetrometrics.common import logging_utils
 from dcmetrometrics.eles.ELESApp import ELESApp
 from dcmetrometrics.keys.keys import MetroEscalatorKeys, MetroElevatorKeys
 
@@ -34,42 +35,57 @@ else:
     SCRIPT_DIR = os.path.join(REPO_DIR, 'scripts')
 
 ###############################################################
-# Log the ELES App to a file.
+# Log the ELES App to a rotating file, through a queue.
 LOG_FILE_NAME = os.path.join(DATA_DIR, 'ELESApp.log')
-fh = logging.FileHandler(LOG_FILE_NAME)
-sh = logging.StreamHandler(sys.stderr)
-
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-sh.setFormatter(formatter)
-
-logger = logging.getLogger('ELESApp')
-logger.addHandler(fh)
-logger.addHandler(sh)
+logger = logging_utils.create_queued_logger('ELESApp', LOG_FILE_NAME)
 #################################################################
 
 SLEEP = 30
 
 ##########################################
 # Run the Twitter App as a Greenlet.
-class App(RestartingGreenlet):
+class App(TickingGreenlet):
+
+    logger = logger
 
     def __init__(self, SLEEP=SLEEP, LIVE=False):
-        RestartingGreenlet.__init__(self, SLEEP=SLEEP, LIVE=LIVE)
+        TickingGreenlet.__init__(self, SLEEP=SLEEP, LIVE=LIVE)
         self.LIVE = LIVE # Tweet only if Live
-        self.SLEEP = SLEEP # Sleep time after each tick
-        self.app = ELESApp(LIVE, MetroEscalatorKeys, MetroElevatorKeys)
+        self.SLEEP = SLEEP # Time between the starts of ticks
+        self.PERIOD = SLEEP
+        # The periodic jobs are run by the JobRunner worker process.
+        self.app = ELESApp(LIVE, MetroEscalatorKeys, MetroElevatorKeys, run_jobs = False)
+
+    def tick(self):
+        self.app.tick(tickDelta = self.tickDelta)
+
+
+##########################################
+# Run the heavy periodic ELES jobs in a worker process,
+# so that they do not block the app. Restart the worker if it exits.
+# The worker logs to ELESJobs.log itself. Its output, e.g. a traceback
+# when it crashes, goes to the rotating file ELESJobs.out.
+JOB_OUT_FILE_NAME = os.path.join(DATA_DIR, 'ELESJobs.out')
+jobOutputLogger = logging_utils.create_queued_logger('ELESJobsOutput', JOB_OUT_FILE_NAME,
+                                                     stream = None, rate = None)
+JOB_RESTART_SLEEP = 60
+
+class JobRunner(RestartingGreenlet):
+
+    def __init__(self, SLEEP=JOB_RESTART_SLEEP):
+        RestartingGreenlet.__init__(self, SLEEP=SLEEP)
+        self.SLEEP = SLEEP
 
     def _run(self):
+        cwd = REPO_DIR if REPO_DIR is not None else os.getcwd()
         while True:
-            try:
-                self.app.tick()
-            except Exception as e:
-                import traceback
-                logger.error('ElevatorApp caught Exception: %s\n'%(str(e)))
-                tb = traceback.format_exc()
-                logger.error('Traceback:\n%s\n\n'%tb)
-            logger.info("sleeping...")
+            worker = gevent_subprocess.Popen([sys.executable, '-m', 'dcmetrometrics.eles.jobs'],
+                cwd = cwd, stdout = gevent_subprocess.PIPE, stderr = gevent_subprocess.STDOUT)
+            logger.info('Started ELES job worker with pid %i'%worker.pid)
+            for line in worker.stdout:
+                jobOutputLogger.info(line.rstrip('\n'))
+            ret = worker.wait()
+            logger.error('ELES job worker exited with code %i'%ret)
             gevent.sleep(self.SLEEP)
 
 
@@ -77,4 +93,6 @@ if __name__ == "__main__":
     print 'Running the ELES app locally....'
     a = App()
     a.start()
+    j = JobRunner()
+    j.start()
     a.join()
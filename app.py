@@ -23,20 +23,44 @@ SCRIPT_DIR = os.path.join(REPO_DIR, 'scripts')
 DATA_DIR = os.environ['DATA_DIR']
 
 # Import application modules
-from ELESAppRunner import App as ELESAppRunner
+from ELESAppRunner import App as ELESAppRunner, JobRunner as ELESJobRunner
 
 # from elevatorApp import ElevatorApp
 from hotCarApp import HotCarApp
 
+from dcmetrometrics.common import instrumentation, logging_utils
+from dcmetrometrics.common.metrics_server import MetricsServer, log_metrics_forever
+from dcmetrometrics.common.globals import METRICS_IP, METRICS_PORT, METRICS_LOG_INTERVAL
+
 HOT_CAR_TWEET_LIVE = 'HOT_CAR_TWEET_LIVE' in os.environ
 ELES_TWEET_LIVE = 'ELES_TWEET_LIVE' in os.environ
 
+def run_metrics():
+   """
+   Count database operations, serve the metrics endpoint if METRICS_PORT
+   is set, and log the metrics to metrics.log.
+   """
+   instrumentation.install_mongo_monitoring()
+
+   metricsLogger = logging_utils.create_queued_logger('metrics', os.path.join(DATA_DIR, 'metrics.log'),
+                                                      stream = None, rate = None)
+   gevent.spawn(log_metrics_forever, METRICS_LOG_INTERVAL, metricsLogger)
+
+   if METRICS_PORT:
+      MetricsServer((METRICS_IP, METRICS_PORT)).start()
+
 def run():
 
+   run_metrics()
+
    # Run MetroEscalators/MetroElevators twitter App
    elesApp = ELESAppRunner(LIVE = ELES_TWEET_LIVE)
    elesApp.start()
 
+   # Run the periodic MetroEscalators jobs in a worker process
+   elesJobs = ELESJobRunner()
+   elesJobs.start()
+
    # Run HotCar twitter app
    hotCarApplication = HotCarApp(LIVE = HOT_CAR_TWEET_LIVE)
    hotCarApplication.start()
@@ -38,6 +38,10 @@ angular.module('dcmetrometricsApp')
     dailyDataPromise.then( function(data) {
       $scope.dailyCountData = data;
     });
+
+    hotCarDirectory.get_analytics().then( function(data) {
+      $scope.analytics = data;
+    });
    
 
     // Set up the hot car leaderboard
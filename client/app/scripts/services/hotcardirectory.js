@@ -11,12 +11,13 @@ angular.module('dcmetrometricsApp')
   .service('hotCarDirectory', ['$http', '$q', function hotCarDirectory($http, $q) {
     // AngularJS will instantiate a singleton by calling "new" on this function
 
-    var allReports, allSummaries, dailyCountData;
+    var allReports, allSummaries, dailyCountData, analyticsData;
     var reportsByCar = {};
     var summaryByCar = {};
 
     var reportsUrl = "/json/hotcar_reports.json";
     var dailyDataUrl = "/json/hotcars_by_day.json";
+    var analyticsUrl = "/json/hotcar_analytics.json";
 
     // Get hotcar report data
     this.get_data = function() {
@@ -153,4 +154,32 @@ angular.module('dcmetrometricsApp')
 
     };
 
+    // Get summary statistics of all hot car reports
+    this.get_analytics = function() {
+
+      var deferred = $q.defer();
+
+      if (analyticsData) {
+          deferred.resolve(analyticsData);
+          return deferred.promise;
+      }
+
+      $http.get(analyticsUrl, { cache: true })
+        .success( function(data) {
+
+          analyticsData = data;
+          deferred.resolve(analyticsData);
+
+        })
+        .error(function() {
+
+          deferred.reject();
+
+        });
+
+      // Return a promise
+      return deferred.promise;
+
+    };
+
   }]);
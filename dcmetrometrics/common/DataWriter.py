@@ -4,9 +4,17 @@ Methods to convert an object to csv
 import datetime
 from pandas import Series, DataFrame
 import os
+import shutil
+from contextlib import contextmanager
+from itertools import groupby
 from .utils import mkdir_p
+from .zip_utils import ZipEntryWriter, open_zip_for_writing
+from .partitions import PartitionManifest, month_key, day_month_key, month_range
+from .columnar import ColumnarTableWriter, TIME, FLOAT, CATEGORY
 from datetime import timedelta, datetime
 from collections import defaultdict
+from dateutil import parser as date_parser
+from bson import ObjectId
 
 from ..eles.models import (Unit, UnitStatus, KeyStatuses, Station, DailyServiceReport, SystemServiceReport)
 from ..hotcars.models import HotCarReport
@@ -33,31 +41,35 @@ class DataWriter(object):
   def __init__(self, basedir = None):
     self.basedir = os.path.abspath(basedir) if basedir else os.getcwd()
     self.outdir = os.path.join(self.basedir, 'download')
+    self._manifest = None
 
-  def write_timestamp(self):
+  @contextmanager
+  def _open_output(self, fname):
+    """Open the output file fname for writing."""
 
     # Create the directory if necessary
     outdir = self.outdir
     mkdir_p(outdir)
 
-    fname = 'timestamp'
     outpath = os.path.join(outdir, fname)
 
     with open(outpath, 'w') as fout:
+      yield fout
+
+  def write_timestamp(self):
+
+    fname = 'timestamp'
+
+    with self._open_output(fname) as fout:
       fout.write(utcnow().isoformat() + '\n')
 
   
   def write_units(self):
     fields = Unit.data_fields
 
-    # Create the directory if necessary
-    outdir = self.outdir
-    mkdir_p(outdir)
-
     fname = 'units.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
       # Write Header
       fout.write(','.join(fields) + '\n')
@@ -69,14 +81,9 @@ class DataWriter(object):
   def write_hot_cars(self):
     fields = HotCarReport.data_fields
 
-    # Create the directory if necessary
-    outdir = os.path.join(self.basedir, 'download')
-    mkdir_p(outdir)
-
     fname = 'hotcars.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
       # Write Header
       fout.write(','.join(fields) + '\n')
@@ -91,14 +98,9 @@ class DataWriter(object):
 
     fields = UnitStatus.data_fields
 
-    # Create the directory if necessary
-    outdir = self.outdir
-    mkdir_p(outdir)
-
     fname = 'unit_statuses.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
       # Write Header
       fout.write(','.join(fields) + '\n')
@@ -115,14 +117,9 @@ class DataWriter(object):
 
     fields = Station.data_fields
 
-    # Create the directory if necessary
-    outdir = self.outdir
-    mkdir_p(outdir)
-
     fname = 'stations.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
       # Write Header
       fout.write(','.join(fields) + '\n')
@@ -134,14 +131,9 @@ class DataWriter(object):
 
   def write_system_daily_service_report(self):
 
-    # Create the directory if necessary
-    outdir = self.outdir
-    mkdir_p(outdir)
-
     fname = 'daily_system_reports.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
       keys = None
       
@@ -159,29 +151,263 @@ class DataWriter(object):
 
   def write_unit_daily_service_report(self):
 
-    # Create the directory if necessary
-    outdir = self.outdir
-    mkdir_p(outdir)
+    # Same columns as the partitions of the incremental export.
+    fields = DailyServiceReport.data_fields
 
     fname = 'daily_unit_reports.csv'
-    outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
+    with self._open_output(fname) as fout:
 
-      keys = None
-      
+      # Write Header
+      fout.write(','.join(fields) + '\n')
       reports = DailyServiceReport.objects.timeout(False).order_by('day').no_cache()
       for report in reports:
         report_data = report.to_data_record()
-        if not keys:
-          keys = report_data.keys()
-          fout.write(','.join(keys) + '\n')
-        outs = ','.join(q(report_data[k]) for k in keys) + '\n'
+        outs = ','.join(q(report_data[k]) for k in fields) + '\n'
         fout.write(outs.encode('utf-8'))
 
       reports._cursor.close()
 
+  ###################################################################
+  # Incremental exports
+  #
+  # The unit statuses and the daily unit reports are also kept as monthly
+  # partitions in the 'partitions' directory of the output directory.
+  # An incremental export only regenerates the partitions which have changed
+  # since the last export, and assembles the full csv file from the partitions.
+
+  @property
+  def manifest(self):
+    if self._manifest is None:
+      self._manifest = PartitionManifest(os.path.join(self.outdir, 'partitions'))
+    return self._manifest
+
+  def _concat_partitions(self, name, fname, fields):
+    """
+    Write the csv file fname by concatenating the partitions for dataset name.
+    """
+    with self._open_output(fname) as fout:
+      fout.write(','.join(fields) + '\n')
+      for path in self.manifest.partition_paths(name):
+        with open(path) as fin:
+          shutil.copyfileobj(fin, fout)
+
+  def _write_status_partition(self, key, statuses, open_ids):
+    """
+    Write the partition of unit statuses for month key.
+    Statuses which do not have an end_time are added to open_ids.
+    """
+    fields = UnitStatus.data_fields
 
+    with self.manifest.open_partition('unit_statuses', key) as fout:
+      for status in statuses:
+        status.clean()
+        if status.end_time is None:
+          open_ids[str(status.pk)] = key
+        status_data = status.to_data_record()
+        outs = ','.join(q(status_data[k]) for k in fields) + '\n'
+        fout.write(outs.encode('utf-8'))
+
+  def write_unit_statuses_incremental(self, full = False):
+    """
+    Write unit_statuses.csv, regenerating only the monthly partitions
+    which have changed since the last export.
+
+    A partition has changed if statuses have been added to it, or if it has
+    a status which was open (no end_time) at the last export and has since been closed.
+    The partition for the current month is always regenerated.
+
+    If full is True, or there is no previous export, all partitions are written.
+    """
+    name = 'unit_statuses'
+    manifest = self.manifest
+    state = manifest.state(name)
+
+    if full or not state.get('last_id'):
+      state = manifest.reset(name)
+
+    # Take the high-water mark before reading any statuses. Statuses saved
+    # during the export will be picked up again by the next export.
+    latest = UnitStatus.objects.order_by('-id').only('id', 'time').first()
+
+    if not state.get('last_id'):
+
+      # Write every partition in a single pass over the statuses.
+      open_ids = {}
+      statuses = UnitStatus.objects.timeout(False).order_by('time').no_cache()
+      for key, group in groupby(statuses, key = lambda s: month_key(s.time)):
+        self._write_status_partition(key, group, open_ids)
+      statuses._cursor.close()
+
+    else:
+
+      last_id = ObjectId(state['last_id'])
+      open_ids = state.get('open', {})
+      dirty = set([month_key(utcnow())])
+
+      # Partitions with new statuses
+      new_statuses = UnitStatus.objects(id__gt = last_id).only('time').no_cache()
+      dirty.update(month_key(s.time) for s in new_statuses)
+
+      # Partitions with statuses which have been closed
+      closed = UnitStatus.objects(id__in = [ObjectId(i) for i in open_ids],
+                                  end_time__ne = None).only('id').no_cache()
+      dirty.update(open_ids[str(s.pk)] for s in closed)
+
+      # Open statuses in dirty partitions are recorded again as they are written.
+      open_ids = dict((i, k) for i, k in open_ids.iteritems() if k not in dirty)
+
+      for key in sorted(dirty):
+        start, end = month_range(key)
+        statuses = UnitStatus.objects(time__gte = start, time__lt = end).order_by('time').no_cache()
+        self._write_status_partition(key, statuses, open_ids)
+
+    if latest is not None:
+      state['last_id'] = str(latest.pk)
+      state['last_time'] = toUtc(latest.time, allow_naive = True).isoformat()
+    state['open'] = open_ids
+    manifest.save()
+
+    self._concat_partitions(name, 'unit_statuses.csv', UnitStatus.data_fields)
+
+  def _write_daily_report_partition(self, key, reports):
+    """
+    Write the partition of daily unit reports for month key.
+    """
+    fields = DailyServiceReport.data_fields
+
+    with self.manifest.open_partition('daily_unit_reports', key) as fout:
+      for report in reports:
+        report_data = report.to_data_record()
+        outs = ','.join(q(report_data[k]) for k in fields) + '\n'
+        fout.write(outs.encode('utf-8'))
+
+  def write_unit_daily_service_report_incremental(self, full = False):
+    """
+    Write daily_unit_reports.csv, regenerating only the monthly partitions
+    with daily service reports that have been created since the last export.
+
+    Daily service reports are replaced when they are recomputed, so a report
+    with a newer created time marks its month as changed.
+
+    If full is True, or there is no previous export, all partitions are written.
+    """
+    name = 'daily_unit_reports'
+    manifest = self.manifest
+    state = manifest.state(name)
+
+    if full or not state.get('last_created'):
+      state = manifest.reset(name)
+
+    # Take the high-water mark before reading any reports.
+    latest = DailyServiceReport.objects.order_by('-created').only('created').first()
+
+    if not state.get('last_created'):
+
+      # Write every partition in a single pass over the reports.
+      reports = DailyServiceReport.objects.timeout(False).order_by('day').no_cache()
+      for key, group in groupby(reports, key = lambda r: day_month_key(r.day)):
+        self._write_daily_report_partition(key, group)
+      reports._cursor.close()
+
+    else:
+
+      last_created = date_parser.parse(state['last_created'])
+      changed = DailyServiceReport.objects(created__gt = last_created).only('day').no_cache()
+      dirty = set(day_month_key(r.day) for r in changed)
 
+      for key in sorted(dirty):
+        start, end = month_range(key)
+        reports = DailyServiceReport.objects(day__gte = start.strftime('%Y-%m-%d'),
+                                             day__lt = end.strftime('%Y-%m-%d')).order_by('day').no_cache()
+        self._write_daily_report_partition(key, reports)
 
+    if latest is not None:
+      state['last_created'] = toUtc(latest.created, allow_naive = True).isoformat()
+    manifest.save()
+
+    self._concat_partitions(name, 'daily_unit_reports.csv', DailyServiceReport.data_fields)
+
+  ###################################################################
+  # Columnar exports
+
+  def write_unit_statuses_columnar(self):
+    """
+    Write the unit status history as a columnar table in columnar/unit_statuses,
+    for fast loading into numpy or pandas. See common.columnar.
+    """
+    columns = [('unit_id', CATEGORY),
+               ('time', TIME),
+               ('end_time', TIME),
+               ('metro_open_time', FLOAT),
+               ('update_type', CATEGORY),
+               ('symptom_description', CATEGORY),
+               ('symptom_category', CATEGORY)]
+
+    writer = ColumnarTableWriter(columns)
+
+    # Read raw documents with a projection. Building UnitStatus documents is
+    # not needed here and is much slower.
+    collection = UnitStatus._get_collection()
+    cursor = collection.find({}, [name for name, kind in columns], timeout = False).sort('time', 1)
+    for doc in cursor:
+      writer.append(doc)
+    cursor.close()
+
+    writer.save(os.path.join(self.outdir, 'columnar', 'unit_statuses'))
+
+
+class ZipDataWriter(DataWriter):
+  """Write csv files directly into a zip archive, without writing them to disk.
+
+  Rows are compressed into the archive as they are written. The archive is
+  built in a temporary file in the output directory and moved into place
+  with an atomic rename on close, so the published zip is never partial.
+
+  Use as a context manager:
+
+    with ZipDataWriter(WWW_DIR) as dwriter:
+      dwriter.write_units()
+      ...
+  """
 
+  def __init__(self, basedir = None, zip_name = 'dcmetrometrics.zip', root_dir = 'dcmetrometrics'):
+    super(ZipDataWriter, self).__init__(basedir)
+    self.root_dir = root_dir
+    self.zip_path = os.path.join(self.outdir, zip_name)
+    self.tmp_path = self.zip_path + '.tmp'
+
+    mkdir_p(self.outdir)
+    self.zf = open_zip_for_writing(self.tmp_path)
+
+  def _arcname(self, fname):
+    return '%s/%s'%(self.root_dir, fname)
+
+  @contextmanager
+  def _open_output(self, fname):
+    """Open a new entry in the archive for writing."""
+    with ZipEntryWriter(self.zf, self._arcname(fname)) as fout:
+      yield fout
+
+  def add_file(self, path, fname):
+    """Add the file at path to the archive as fname."""
+    self.zf.write(path, self._arcname(fname))
+
+  def close(self):
+    """Finish the archive and publish it."""
+    self.zf.close()
+    os.rename(self.tmp_path, self.zip_path)
+
+  def abort(self):
+    """Discard the partially written archive."""
+    self.zf.close()
+    os.unlink(self.tmp_path)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if exc_type is None:
+      self.close()
+    else:
+      self.abort()
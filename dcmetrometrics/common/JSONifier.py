@@ -5,14 +5,12 @@ from json import JSONEncoder, dumps
 import datetime
 import os
 from .utils import mkdir_p
-from datetime import timedelta
-from collections import defaultdict
 
 
 from ..eles.models import (Unit, UnitStatus, KeyStatuses, Station, DailyServiceReport, SystemServiceReport)
-from ..hotcars.models import (HotCarReport, Temperature)
+from ..hotcars.models import (HotCarReport, HotCarDailyCount)
 from ..common.WebJSONMixin import WebJSONMixin
-from ..common.metroTimes import tzutc, isNaive, toUtc
+from ..common.metroTimes import isNaive, toUtc
 
 class WebJSONEncoder(JSONEncoder):
   """JSON Encoder for DC Metro Metrics data types.
@@ -38,6 +36,18 @@ class WebJSONEncoder(JSONEncoder):
     return JSONEncoder.default(self, o)
 
 
+def write_file(path, data):
+  """
+  Write data to path. The data is written to a temporary file, which is
+  renamed into place, so that readers never see a partly written file when
+  the app and the job worker write the same file.
+  """
+  tmp_path = '%s.%i.tmp'%(path, os.getpid())
+  with open(tmp_path, 'w') as fout:
+    fout.write(data)
+  os.rename(tmp_path, path)
+
+
 class JSONWriter(object):
   """Write Unit and Station JSON static files.
   """
@@ -61,8 +71,7 @@ class JSONWriter(object):
     fname = '%s.json'%(unit.unit_id)
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
   def write_station_directory(self):
 
@@ -76,8 +85,7 @@ class JSONWriter(object):
     fname = '%s.json'%('station_directory')
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
 
   def write_recent_updates(self):
@@ -95,8 +103,7 @@ class JSONWriter(object):
     fname = 'recent_updates.json'
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
   def write_hotcars(self):
     """
@@ -112,37 +119,30 @@ class JSONWriter(object):
     fname = 'hotcar_reports.json'
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
-  def write_hotcars_by_day(self):
+  def write_hotcar_analytics(self):
     """
-    Write hot car counts by day.
+    Write summary statistics of all hot car reports.
     """
-    all_reports = list(HotCarReport.objects.order_by('time').select_related())
-    day_to_count = defaultdict(int)
+    from ..hotcars.analytics import summarize_reports
+    summary = summarize_reports()
+    jdata = dumps(summary, cls = WebJSONEncoder)
 
-    for r in all_reports:
-      r.time.replace(tzinfo=tzutc)
-      day_to_count[r.time.date()] += 1
-
-    day_to_temp = dict((t.date.date(), t.max_temp) for t in Temperature.objects.order_by('date'))
+    # Create the directory if necessary
+    outdir = os.path.join(self.basedir, 'json')
+    mkdir_p(outdir)
 
-    # Create time series for both temperate and counts
-    first_day = all_reports[0].time.date()
-    last_day = all_reports[-1].time.date()
+    fname = 'hotcar_analytics.json'
+    outpath = os.path.join(outdir, fname)
 
-    def gen_days(s, e):
-      d = s
-      while d < e:
-        yield d
-        d = d + timedelta(days = 1)
+    write_file(outpath, jdata)
 
-    days = gen_days(first_day, last_day + timedelta(days = 1))
-    daily_series = [{'day': d,
-                     'count' : day_to_count.get(d, 0),
-                     'temp' : day_to_temp.get(d, None)} for d in days]
-    # temp_series = [{'day':t.date.date(), 'temp': t.max_temp} for t in Temperature.objects.order_by('date')]
+  def write_hotcars_by_day(self):
+    """
+    Write hot car counts by day.
+    """
+    daily_series = HotCarDailyCount.get_daily_series()
 
     ret = {'daily_series' : daily_series}
 
@@ -155,8 +155,7 @@ class JSONWriter(object):
     fname = 'hotcars_by_day.json'
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
   def write_daily_system_service_report(self, day = None, report = None):
 
@@ -182,8 +181,7 @@ class JSONWriter(object):
     fname = '%s.json'%(day_string.replace('-', '_'))
     outpath = os.path.join(outdir, fname)
 
-    with open(outpath, 'w') as fout:
-      fout.write(jdata)
+    write_file(outpath, jdata)
 
 
 
@@ -0,0 +1,186 @@
+"""
+common.columnar
+
+Write and read typed columnar exports of the status history.
+
+A columnar table is a directory with one .npy file per column, which
+numpy can memory-map, and a meta.json file which describes the columns:
+
+  - time columns are int64 seconds since the epoch (UTC). Missing
+    values are stored as MISSING_TIME.
+  - float columns are float64. Missing values are stored as NaN.
+  - category columns are dictionary encoded: the .npy file holds int32
+    codes into the list of categories stored in meta.json. Missing values
+    are stored as code -1.
+
+If pyarrow is installed, the table is also written as a Parquet file.
+
+Example:
+
+  from dcmetrometrics.common.columnar import load_table_frame
+  df = load_table_frame('/path/to/www/download/columnar/unit_statuses')
+"""
+
+import os
+import json
+import shutil
+import calendar
+
+import numpy as np
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+from .utils import mkdir_p
+
+MISSING_TIME = -1
+
+TIME = 'time'
+FLOAT = 'float'
+CATEGORY = 'category'
+
+def to_epoch(dt):
+  """
+  Convert a datetime to integer seconds since the epoch.
+  Naive datetimes are assumed to be in UTC.
+  """
+  if dt is None:
+    return MISSING_TIME
+  return calendar.timegm(dt.utctimetuple())
+
+class ColumnarTableWriter(object):
+  """
+  Accumulate records column by column and save them as a columnar table.
+
+  columns: list of (name, kind) tuples, where kind is TIME, FLOAT or CATEGORY.
+  """
+
+  def __init__(self, columns):
+    self.columns = list(columns)
+    self._values = dict((name, []) for name, kind in self.columns)
+    self._categories = dict((name, {}) for name, kind in self.columns if kind == CATEGORY)
+    self.num_rows = 0
+
+  def _encode(self, name, kind, v):
+    if kind == TIME:
+      return to_epoch(v)
+    elif kind == FLOAT:
+      return np.nan if v is None else float(v)
+    elif kind == CATEGORY:
+      if v is None:
+        return -1
+      categories = self._categories[name]
+      code = categories.get(v)
+      if code is None:
+        code = categories[v] = len(categories)
+      return code
+    raise ValueError('Unknown column kind: %s'%kind)
+
+  def append(self, record):
+    """
+    Append a record. Columns which are missing from the record are missing values.
+    """
+    for name, kind in self.columns:
+      self._values[name].append(self._encode(name, kind, record.get(name)))
+    self.num_rows += 1
+
+  def _arrays(self):
+    dtypes = {TIME : np.int64, FLOAT : np.float64, CATEGORY : np.int32}
+    return dict((name, np.array(self._values[name], dtype = dtypes[kind])) \
+      for name, kind in self.columns)
+
+  def _category_list(self, name):
+    categories = self._categories[name]
+    return sorted(categories, key = categories.get)
+
+  def save(self, outdir):
+    """
+    Write the table to the directory outdir, replacing any existing table.
+    The table is written to a temporary directory first so that readers never see a partial table.
+    """
+    outdir = os.path.abspath(outdir)
+    tmp_dir = outdir + '.tmp'
+    old_dir = outdir + '.old'
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    mkdir_p(tmp_dir)
+
+    arrays = self._arrays()
+    meta = {'num_rows' : self.num_rows, 'columns' : []}
+    for name, kind in self.columns:
+      np.save(os.path.join(tmp_dir, '%s.npy'%name), arrays[name])
+      col = {'name' : name, 'kind' : kind}
+      if kind == CATEGORY:
+        col['categories'] = self._category_list(name)
+      meta['columns'].append(col)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fout:
+      json.dump(meta, fout, indent = 2)
+
+    if pyarrow is not None:
+      self._save_parquet(arrays, os.path.join(tmp_dir, 'table.parquet'))
+
+    shutil.rmtree(old_dir, ignore_errors = True)
+    if os.path.exists(outdir):
+      os.rename(outdir, old_dir)
+    os.rename(tmp_dir, outdir)
+    shutil.rmtree(old_dir, ignore_errors = True)
+
+  def _save_parquet(self, arrays, path):
+    names = []
+    cols = []
+    for name, kind in self.columns:
+      values = arrays[name]
+      if kind == TIME:
+        col = pyarrow.array(values, mask = values == MISSING_TIME).cast(pyarrow.timestamp('s'))
+      elif kind == CATEGORY:
+        indices = pyarrow.array(values, mask = values < 0)
+        col = pyarrow.DictionaryArray.from_arrays(indices, pyarrow.array(self._category_list(name)))
+      else:
+        col = pyarrow.array(values, from_pandas = True)
+      names.append(name)
+      cols.append(col)
+    table = pyarrow.Table.from_arrays(cols, names = names)
+    pyarrow.parquet.write_table(table, path)
+
+def load_table(path, mmap_mode = 'r'):
+  """
+  Load a columnar table written by ColumnarTableWriter.
+
+  Return a tuple (meta, arrays) where arrays is a dictionary of column name
+  to numpy array. By default, the arrays are memory-mapped read-only.
+  """
+  with open(os.path.join(path, 'meta.json')) as fin:
+    meta = json.load(fin)
+
+  arrays = {}
+  for col in meta['columns']:
+    arrays[col['name']] = np.load(os.path.join(path, '%s.npy'%col['name']), mmap_mode = mmap_mode)
+
+  return (meta, arrays)
+
+def load_table_frame(path, mmap_mode = 'r'):
+  """
+  Load a columnar table as a pandas DataFrame, with datetime columns (UTC)
+  and categorical columns.
+  """
+  from pandas import DataFrame, Categorical
+
+  meta, arrays = load_table(path, mmap_mode)
+
+  data = {}
+  for col in meta['columns']:
+    name, kind = col['name'], col['kind']
+    values = arrays[name]
+    if kind == TIME:
+      times = values.astype('datetime64[s]')
+      times[values == MISSING_TIME] = np.datetime64('NaT')
+      data[name] = times
+    elif kind == CATEGORY:
+      data[name] = Categorical.from_codes(values, col['categories'])
+    else:
+      data[name] = values
+
+  return DataFrame(data, columns = [col['name'] for col in meta['columns']])
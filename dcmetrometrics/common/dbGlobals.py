@@ -7,6 +7,12 @@ and symptom codes.
 
 The global variables should only update if an escalator, elevator
 or symptom code is seen for the first time.
+
+The module also owns the database connection of the process. connect()
+creates one pooled MongoClient, which mongoengine and getDB() share.
+connect() is cheap after the first call, so it can be called at the start
+of every tick. In a process forked from a connected process, connect()
+replaces the inherited client with a new one.
 """
 
 import pymongo
@@ -16,7 +22,9 @@ from mongoengine import DoesNotExist
 from ..eles.defs import OPERATIONAL_CODE as OP_CODE, symptomToCategory
 
 
-from .globals import MONGODB_HOST, MONGODB_PORT, MONGODB_USERNAME, MONGODB_PASSWORD
+from .globals import MONGODB_HOST, MONGODB_PORT, MONGODB_USERNAME, MONGODB_PASSWORD, MONGODB_DATABASE, \
+    MONGODB_MAX_POOL_SIZE, MONGODB_CONNECT_TIMEOUT_MS, MONGODB_SOCKET_TIMEOUT_MS, \
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS, MONGODB_READ_PREFERENCE
 
 invert_dict = lambda d: dict((v,k) for k,v in d.iteritems())
 
@@ -105,28 +113,75 @@ class _DBGlobals(object):
         """
         Get the Mongo Database, using pymongo
         """
-        if self.db is None:
-            self.db = getDB()
-        return self.db
+        return getDB()
 
-def getDB():
+# Process id of the process which created the connection.
+_pid = None
+
+def connectionSettings():
     """
-    Return the db via pymongo
+    Return the keyword arguments of the MongoClient of the process.
     """
-    client = pymongo.MongoClient(MONGODB_HOST, MONGODB_PORT)
-    
-    db = client.MetroEscalators
-    if MONGODB_USERNAME and MONGODB_PASSWORD:
-        res = db.authenticate(MONGODB_USERNAME, MONGODB_PASSWORD)
-
-    return db
+    settings = dict(max_pool_size = MONGODB_MAX_POOL_SIZE,
+                    connectTimeoutMS = MONGODB_CONNECT_TIMEOUT_MS,
+                    read_preference = getattr(pymongo.ReadPreference, MONGODB_READ_PREFERENCE.upper()))
+    if MONGODB_SOCKET_TIMEOUT_MS:
+        settings['socketTimeoutMS'] = MONGODB_SOCKET_TIMEOUT_MS
+    if MONGODB_WAIT_QUEUE_TIMEOUT_MS:
+        settings['waitQueueTimeoutMS'] = MONGODB_WAIT_QUEUE_TIMEOUT_MS
+    return settings
 
 def connect():
     """
-    Connect to the database via mongoengine
+    Connect to the database via mongoengine, if this process is not connected yet.
+    """
+    global _pid
+    from mongoengine import connection
+
+    pid = os.getpid()
+    if _pid == pid:
+        return
+    if _pid is not None:
+        # This process was forked from a connected process. Forget the
+        # inherited client without closing its sockets, which the parent
+        # process is still using.
+        connection._connections.pop(connection.DEFAULT_CONNECTION_NAME, None)
+        connection._dbs.pop(connection.DEFAULT_CONNECTION_NAME, None)
+        # The document classes cache the collection of the inherited client.
+        from mongoengine.base.common import _document_registry
+        for cls in _document_registry.itervalues():
+            if getattr(cls, '_collection', None) is not None:
+                cls._collection = None
+
+    connection.connect(MONGODB_DATABASE, host=MONGODB_HOST, port=MONGODB_PORT,
+        username=MONGODB_USERNAME, password=MONGODB_PASSWORD, **connectionSettings())
+    _pid = pid
+
+def disconnect():
+    """
+    Close the connection of this process.
+    """
+    global _pid
+    from mongoengine import connection
+    if _pid == os.getpid():
+        connection.disconnect()
+    _pid = None
+
+def getClient():
+    """
+    Return the pooled MongoClient of this process.
+    """
+    from mongoengine.connection import get_connection
+    connect()
+    return get_connection()
+
+def getDB():
+    """
+    Return the db via pymongo, from the pooled client of this process.
     """
-    from mongoengine import connect
-    connect('MetroEscalators', host=MONGODB_HOST, port=MONGODB_PORT, username=MONGODB_USERNAME, password=MONGODB_PASSWORD)
+    from mongoengine.connection import get_db
+    connect()
+    return get_db()
 
 _G = None # Global object
 def G():
@@ -139,7 +194,6 @@ def G():
         return _G
     
     _G = _DBGlobals()
-    _G.update()
     return _G
 
 
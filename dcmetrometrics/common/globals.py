@@ -14,6 +14,26 @@ MONGODB_HOST = os.environ["MONGODB_HOST"]
 MONGODB_PORT = int(os.environ["MONGODB_PORT"])
 MONGODB_USERNAME = os.environ.get("MONGODB_USERNAME", None)
 MONGODB_PASSWORD = os.environ.get("MONGODB_PASSWORD", None)
+MONGODB_DATABASE = os.environ.get("MONGODB_DATABASE", "MetroEscalators")
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 20)) # Sockets in the connection pool of a process.
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGODB_CONNECT_TIMEOUT_MS", 20000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGODB_SOCKET_TIMEOUT_MS", 0)) or None # No timeout if unset.
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 0)) or None # Wait for a free socket forever if unset.
+MONGODB_READ_PREFERENCE = os.environ.get("MONGODB_READ_PREFERENCE", "PRIMARY") # A pymongo.ReadPreference name.
 
 INTERNAL_SERVE_IP = os.environ["INTERNAL_SERVE_IP"] # Internal IP Address to serve app through.
-INTERNAL_SERVE_PORT = os.environ["INTERNAL_SERVE_PORT"] # Internal Port to serve app through.
\ No newline at end of file
+INTERNAL_SERVE_PORT = os.environ["INTERNAL_SERVE_PORT"] # Internal Port to serve app through.
+METRICS_IP = os.environ.get("METRICS_IP", "127.0.0.1") # Address of the metrics endpoint.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0)) or None # Port of the metrics endpoint. Not served if unset.
+METRICS_LOG_INTERVAL = int(os.environ.get("METRICS_LOG_INTERVAL", 300)) # Seconds between metrics log lines.
+PROFILE_TICKS = os.environ.get("PROFILE_TICKS") # 'sample' or 'cprofile' to profile slow ticks. Off if unset.
+PROFILE_THRESHOLD = float(os.environ.get("PROFILE_THRESHOLD", 20.0)) # Seconds after which a tick is profiled.
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.01)) # Seconds between stack samples.
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20)) # Number of profile dumps kept for each app.
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", 512)) # Resident set size above which garbage is collected.
+MEMORY_BUDGET_STEP_MB = int(os.environ.get("MEMORY_BUDGET_STEP_MB", 64)) # Growth after which a process over budget collects again.
+MEMORY_REPORT_CHECKS = int(os.environ.get("MEMORY_REPORT_CHECKS", 100)) # Memory checks between reports of the growing types.
+LOG_MAX_MB = int(os.environ.get("LOG_MAX_MB", 20)) # Size at which an app log is rotated.
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5)) # Number of compressed log backups kept.
+LOG_INFO_RATE = float(os.environ.get("LOG_INFO_RATE", 20)) # INFO records per second of each logger.
+LOG_INFO_BURST = int(os.environ.get("LOG_INFO_BURST", 200)) # Bursts of INFO records allowed above the rate.
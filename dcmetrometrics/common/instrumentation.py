@@ -0,0 +1,426 @@
+"""
+common.instrumentation
+
+Record the time spent in the named phases of an app tick, and other
+timers and counters of the apps.
+
+Code marks its phases with the phase context manager:
+
+  with phase('search'):
+    ...
+
+and the tick of an app with the app_tick decorator:
+
+  @app_tick('hotcars')
+  def tick():
+    ...
+
+The time of every tick and phase is added to REGISTRY, labelled with the app,
+together with the timers and counters recorded with timer and counter, which
+are context managers and decorators:
+
+  with timer('json_write', kind = 'unit'):
+    ...
+
+  @counter('tweets_posted')
+  def post(...):
+    ...
+
+install_mongo_monitoring adds the number and time of the MongoDB operations,
+by collection. The registry is exported in the Prometheus text format by
+REGISTRY.to_prometheus, which common.metrics_server serves over HTTP.
+
+A PhaseRecorder, installed with set_recorder, additionally receives the
+phase timings, for example in a replay.
+"""
+
+import time
+import json
+import struct
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class MetricsRegistry(object):
+  """
+  Counters and timers, keyed by name and labels.
+
+  A timer keeps the number, total seconds, and maximum seconds of its observations.
+  """
+
+  def __init__(self, prefix = 'dcmetrometrics_'):
+    self.prefix = prefix
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.counters = {}
+    self.timers = {}
+
+  @staticmethod
+  def _key(name, labels):
+    return (name, tuple(sorted(labels.iteritems())))
+
+  def inc(self, name, n = 1, **labels):
+    key = self._key(name, labels)
+    with self._lock:
+      self.counters[key] = self.counters.get(key, 0) + n
+
+  def observe(self, name, seconds, **labels):
+    key = self._key(name, labels)
+    with self._lock:
+      rec = self.timers.get(key)
+      if rec is None:
+        rec = self.timers[key] = [0, 0.0, 0.0]
+      rec[0] += 1
+      rec[1] += seconds
+      rec[2] = max(rec[2], seconds)
+
+  def snapshot(self):
+    """
+    Return the counters and timers as a dictionary which can be written as JSON.
+    """
+    def fmt(name, labels):
+      if not labels:
+        return name
+      return '%s{%s}'%(name, ','.join('%s=%s'%(k, v) for k, v in labels))
+
+    with self._lock:
+      counters = dict((fmt(*k), v) for k, v in self.counters.iteritems())
+      timers = dict((fmt(*k), {'count' : v[0], 'sum' : round(v[1], 6), 'max' : round(v[2], 6)}) \
+                    for k, v in self.timers.iteritems())
+    return {'counters' : counters, 'timers' : timers}
+
+  def to_prometheus(self):
+    """
+    Return the counters and timers in the Prometheus text exposition format.
+    Timers are summaries in seconds, with a gauge of the maximum.
+    """
+    def fmt_labels(labels):
+      if not labels:
+        return ''
+      escape = lambda v: unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+      return '{%s}'%','.join('%s="%s"'%(k, escape(v)) for k, v in labels)
+
+    with self._lock:
+      counters = sorted(self.counters.iteritems())
+      timers = sorted((k, list(v)) for k, v in self.timers.iteritems())
+
+    lines = []
+    last = None
+    for (name, labels), v in counters:
+      metric = '%s%s_total'%(self.prefix, name)
+      if metric != last:
+        lines.append('# TYPE %s counter'%metric)
+        last = metric
+      lines.append('%s%s %s'%(metric, fmt_labels(labels), v))
+
+    for suffix in ['', '_max']:
+      last = None
+      for (name, labels), (n, total, longest) in timers:
+        metric = '%s%s_seconds%s'%(self.prefix, name, suffix)
+        if metric != last:
+          lines.append('# TYPE %s %s'%(metric, 'gauge' if suffix else 'summary'))
+          last = metric
+        if suffix:
+          lines.append('%s%s %.6f'%(metric, fmt_labels(labels), longest))
+        else:
+          lines.append('%s_count%s %i'%(metric, fmt_labels(labels), n))
+          lines.append('%s_sum%s %.6f'%(metric, fmt_labels(labels), total))
+
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+_local = threading.local()
+
+def current_app():
+  """
+  Return the name of the app whose tick is running, or None.
+  """
+  return getattr(_local, 'app', None)
+
+class _Instrument(object):
+  """
+  Base class of the instruments which are both context managers and
+  decorators. A decorated function uses a new instrument for each call.
+  """
+
+  def _copy(self):
+    raise NotImplementedError
+
+  def __call__(self, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with self._copy():
+        return func(*args, **kwargs)
+    return wrapper
+
+class timer(_Instrument):
+  """
+  Add the time of a block or function call to the timer name of the registry.
+  """
+
+  def __init__(self, name, registry = None, **labels):
+    self.name = name
+    self.registry = registry
+    self.labels = labels
+
+  def _copy(self):
+    return timer(self.name, self.registry, **self.labels)
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    (self.registry or REGISTRY).observe(self.name, time.time() - self.start, **self.labels)
+    return False
+
+class counter(_Instrument):
+  """
+  Count the entries into a block or the calls of a function, and the
+  exceptions raised by them, in name and name_errors.
+  """
+
+  def __init__(self, name, registry = None, **labels):
+    self.name = name
+    self.registry = registry
+    self.labels = labels
+
+  def _copy(self):
+    return self
+
+  def __enter__(self):
+    (self.registry or REGISTRY).inc(self.name, **self.labels)
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if exc_type is not None:
+      (self.registry or REGISTRY).inc(self.name + '_errors', **self.labels)
+    return False
+
+def count(name, n = 1, **labels):
+  """
+  Add n to the counter name of the registry, labelled with the current app.
+  """
+  app = current_app()
+  if app is not None:
+    labels.setdefault('app', app)
+  REGISTRY.inc(name, n, **labels)
+
+class app_tick(_Instrument):
+  """
+  Mark the tick of an app. The tick time is added to the tick timer, and the
+  phases and counts during the tick are labelled with the app.
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  def _copy(self):
+    return app_tick(self.app)
+
+  def __enter__(self):
+    self.prev = current_app()
+    _local.app = self.app
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    REGISTRY.observe('tick', time.time() - self.start, app = self.app)
+    if exc_type is not None:
+      REGISTRY.inc('tick_errors', app = self.app)
+    _local.app = self.prev
+    return False
+
+def log_metrics(logger, registry = None):
+  """
+  Log the counters and timers of the registry as a single JSON line.
+  """
+  logger.info('metrics %s'%json.dumps((registry or REGISTRY).snapshot(), sort_keys = True))
+
+#####################################################
+# MongoDB operations
+
+# Operation codes of the MongoDB wire protocol.
+_OP_CODES = {2001 : 'update', 2002 : 'insert', 2004 : 'query',
+             2005 : 'getmore', 2006 : 'delete', 2007 : 'killcursors'}
+
+def _read_cstring(data, offset):
+  end = data.index('\x00', offset)
+  return data[offset:end], end + 1
+
+def parse_wire_message(data):
+  """
+  Return (operation, collection) of a MongoDB wire protocol message.
+  Commands are reported as operation 'command' on the collection they
+  name, or on '$cmd'.
+  """
+  try:
+    op = _OP_CODES.get(struct.unpack('<i', data[12:16])[0], 'unknown')
+    if op == 'killcursors':
+      return (op, '')
+    # The full collection name follows the header and a 32 bit field.
+    namespace, offset = _read_cstring(data, 20)
+    db, collection = namespace.split('.', 1)
+    if op == 'query' and collection == '$cmd':
+      op = 'command'
+      # The command document follows numberToSkip and numberToReturn.
+      # Its first element names the command, and its value the collection.
+      offset += 8 + 4
+      elem_type = data[offset]
+      key, offset = _read_cstring(data, offset + 1)
+      if elem_type == '\x02':
+        n = struct.unpack('<i', data[offset:offset+4])[0]
+        collection = data[offset+4:offset+4+n-1]
+    return (op, collection)
+  except (struct.error, ValueError, IndexError):
+    return ('unknown', '')
+
+_mongo_monitoring = False
+
+def install_mongo_monitoring(registry = None):
+  """
+  Count and time the MongoDB operations of every client, by operation and
+  collection, in the mongo_ops counter and the mongo_op timer.
+
+  pymongo 2.x has no command monitoring, so the methods of MongoClient which
+  send messages to the server are wrapped, and the operation and collection
+  are read from the messages.
+  """
+  global _mongo_monitoring
+  if _mongo_monitoring:
+    return
+  registry = registry or REGISTRY
+
+  from pymongo import MongoClient
+
+  def wrap(method):
+    @functools.wraps(method)
+    def wrapper(self, message, *args, **kwargs):
+      op, collection = parse_wire_message(message[1])
+      start = time.time()
+      try:
+        return method(self, message, *args, **kwargs)
+      finally:
+        registry.inc('mongo_ops', op = op, collection = collection)
+        registry.observe('mongo_op', time.time() - start, op = op, collection = collection)
+    return wrapper
+
+  MongoClient._send_message = wrap(MongoClient._send_message)
+  MongoClient._send_message_with_response = wrap(MongoClient._send_message_with_response)
+  _mongo_monitoring = True
+
+#####################################################
+# Phases
+
+_recorder = None
+
+def set_recorder(recorder):
+  """
+  Install the recorder which receives phase timings, or None to stop recording.
+  Return the previously installed recorder.
+  """
+  global _recorder
+  prev = _recorder
+  _recorder = recorder
+  return prev
+
+def get_recorder():
+  return _recorder
+
+@contextmanager
+def phase(name):
+  """
+  Context manager which marks a phase of work. Its time is added to the phase
+  timer of the registry, and the installed recorder receives it.
+  """
+  recorder = _recorder
+  token = recorder.start_phase(name) if recorder is not None else None
+  start = time.time()
+  try:
+    yield
+  finally:
+    REGISTRY.observe('phase', time.time() - start, app = current_app() or '', phase = name)
+    if recorder is not None:
+      recorder.end_phase(name, token)
+
+class PhaseRecorder(object):
+  """
+  Accumulate the number of calls and the wall time of each phase.
+
+  snapshot: optional function which returns a dictionary of counter values,
+    such as the number of database operations. The change in each counter
+    during a phase is added to the phase's totals.
+  """
+
+  def __init__(self, snapshot = None, clock = time.time):
+    self.snapshot = snapshot
+    self.clock = clock
+    self.totals = OrderedDict()
+
+  def start_phase(self, name):
+    counters = self.snapshot() if self.snapshot else {}
+    return (self.clock(), counters)
+
+  def end_phase(self, name, token):
+    start_time, start_counters = token
+    elapsed = self.clock() - start_time
+    end_counters = self.snapshot() if self.snapshot else {}
+
+    rec = self.totals.get(name)
+    if rec is None:
+      rec = self.totals[name] = OrderedDict([('calls', 0), ('seconds', 0.0)])
+    rec['calls'] += 1
+    rec['seconds'] += elapsed
+    for k, v in end_counters.iteritems():
+      rec[k] = rec.get(k, 0) + v - start_counters.get(k, 0)
+
+  def reset(self):
+    self.totals = OrderedDict()
+
+  def format_report(self):
+    """
+    Return the totals as a text table, with one row per phase.
+    """
+    counter_names = []
+    for rec in self.totals.itervalues():
+      for k in rec:
+        if k not in ('calls', 'seconds') and k not in counter_names:
+          counter_names.append(k)
+
+    header = ['phase', 'calls', 'seconds'] + counter_names
+    rows = [header]
+    for name, rec in self.totals.iteritems():
+      row = [name, str(rec['calls']), '%.4f'%rec['seconds']]
+      row.extend(str(rec.get(k, 0)) for k in counter_names)
+      rows.append(row)
+
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    lines = ['  '.join(v.ljust(w) for v, w in zip(r, widths)) for r in rows]
+    return '\n'.join(lines)
+
+class MongoOpCounters(object):
+  """
+  Snapshot function for PhaseRecorder which returns the operation counters
+  of a MongoDB server (from the serverStatus command).
+
+  The counters are for all clients of the server, so they are only
+  meaningful against a server which is not otherwise in use. The
+  serverStatus commands run by the snapshots are not counted.
+  """
+
+  FIELDS = ['query', 'insert', 'update', 'delete', 'getmore', 'command']
+
+  def __init__(self, db):
+    self.db = db
+    self.num_snapshots = 0
+
+  def __call__(self):
+    self.num_snapshots += 1
+    counters = self.db.command('serverStatus')['opcounters']
+    ret = OrderedDict((k, int(counters.get(k, 0))) for k in self.FIELDS)
+    ret['command'] -= self.num_snapshots
+    return ret
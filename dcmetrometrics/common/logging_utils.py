@@ -1,8 +1,34 @@
 """
 Utilities for creating logger objects.
+
+create_logger logs to stderr. create_queued_logger logs to a rotating,
+compressed log file and to stderr without blocking the caller: the records
+are put on a queue, which a background thread writes out. The thread is a
+real thread even when gevent has patched the threading module, so a greenlet
+never waits on the disk.
+
+INFO and DEBUG records of each logger are rate limited, so a loop which logs
+every unit cannot flood the log. WARNING and above always pass.
 """
-import logging, sys
+import os
+import sys
+import gzip
+import time
+import atexit
+import shutil
+import logging
+import logging.handlers
+from collections import deque
+
+from .globals import LOG_MAX_MB, LOG_BACKUP_COUNT, LOG_INFO_RATE, LOG_INFO_BURST
 
+try:
+  from gevent.monkey import get_original
+except ImportError:
+  def get_original(module, item):
+    return getattr(__import__(module), item)
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 def create_logger(name):
 
@@ -16,7 +42,7 @@ def create_logger(name):
   sh = logging.StreamHandler(stream=sys.stderr)
 
   # create formatter
-  formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+  formatter = logging.Formatter(FORMAT)
 
   # add formatter to stream handler
   sh.setFormatter(formatter)
@@ -27,4 +53,278 @@ def create_logger(name):
   # set logging level
   logger.setLevel(logging.DEBUG)
 
-  return logger
\ No newline at end of file
+  return logger
+
+def compress_file(src, dst):
+  """
+  gzip src to dst, and remove src.
+  """
+  with open(src, 'rb') as fin:
+    fout = gzip.open(dst, 'wb')
+    try:
+      shutil.copyfileobj(fin, fout)
+    finally:
+      fout.close()
+  os.remove(src)
+
+def rotate_file(path, max_bytes = LOG_MAX_MB*1024*1024):
+  """
+  Compress path to path.1.gz, replacing the previous backup, if path has
+  reached max_bytes. This is for log files which are written without a
+  logging handler. Return True if the file was rotated.
+  """
+  try:
+    if os.path.getsize(path) < max_bytes:
+      return False
+  except OSError:
+    return False
+  compress_file(path, path + '.1.gz')
+  return True
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+  """
+  A RotatingFileHandler which keeps the backups gzipped, as
+  file.log.1.gz, file.log.2.gz, ...
+  """
+
+  def doRollover(self):
+    if self.stream:
+      self.stream.close()
+      self.stream = None
+    if self.backupCount > 0:
+      for i in range(self.backupCount - 1, 0, -1):
+        sfn = '%s.%i.gz'%(self.baseFilename, i)
+        dfn = '%s.%i.gz'%(self.baseFilename, i + 1)
+        if os.path.exists(sfn):
+          if os.path.exists(dfn):
+            os.remove(dfn)
+          os.rename(sfn, dfn)
+      if os.path.exists(self.baseFilename):
+        compress_file(self.baseFilename, self.baseFilename + '.1.gz')
+    self.mode = 'w'
+    self.stream = self._open()
+
+class CompressingTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+  """
+  A TimedRotatingFileHandler which keeps the backups gzipped, as
+  file.log.<date>.gz
+  """
+
+  def _backups(self):
+    dirName, baseName = os.path.split(self.baseFilename)
+    prefix = baseName + '.'
+    ret = []
+    for fileName in os.listdir(dirName):
+      if not fileName.startswith(prefix):
+        continue
+      suffix = fileName[len(prefix):]
+      if suffix.endswith('.gz'):
+        suffix = suffix[:-3]
+      if self.extMatch.match(suffix):
+        ret.append((suffix, os.path.join(dirName, fileName)))
+    ret.sort()
+    return ret
+
+  def getFilesToDelete(self):
+    backups = self._backups()
+    if len(backups) <= self.backupCount:
+      return []
+    return [path for suffix, path in backups[:len(backups) - self.backupCount]]
+
+  def doRollover(self):
+    logging.handlers.TimedRotatingFileHandler.doRollover(self)
+    for suffix, path in self._backups():
+      if not path.endswith('.gz'):
+        compress_file(path, path + '.gz')
+
+class RateLimitFilter(logging.Filter):
+  """
+  Pass at most rate records per second of each logger at or below level,
+  with bursts of up to burst records. The next record which passes after
+  records were dropped notes how many were dropped.
+  """
+
+  def __init__(self, rate = LOG_INFO_RATE, burst = LOG_INFO_BURST, level = logging.INFO,
+               clock = time.time):
+    logging.Filter.__init__(self)
+    self.rate = float(rate)
+    self.burst = float(burst)
+    self.level = level
+    self.clock = clock
+    self.buckets = {} # logger name -> [tokens, last time, number dropped]
+
+  def filter(self, record):
+    if record.levelno > self.level:
+      return True
+    now = self.clock()
+    bucket = self.buckets.get(record.name)
+    if bucket is None:
+      bucket = self.buckets[record.name] = [self.burst, now, 0]
+    bucket[0] = min(self.burst, bucket[0] + (now - bucket[1])*self.rate)
+    bucket[1] = now
+    if bucket[0] < 1.0:
+      bucket[2] += 1
+      return False
+    bucket[0] -= 1.0
+    if bucket[2]:
+      record.msg = '%s (%i messages dropped by the rate limit)'%(record.getMessage(), bucket[2])
+      record.args = None
+      bucket[2] = 0
+    return True
+
+class QueueHandler(logging.Handler):
+  """
+  Put records on a queue, for a QueueListener to handle. If the queue holds
+  maxsize records, the record is dropped.
+  """
+
+  def __init__(self, queue, maxsize = 10000):
+    logging.Handler.__init__(self)
+    self.queue = queue
+    self.maxsize = maxsize
+    self.dropped = 0
+
+  def prepare(self, record):
+    # Merge the arguments and the traceback into the message, so that the
+    # record can be formatted in another thread.
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+    return record
+
+  def emit(self, record):
+    if len(self.queue) >= self.maxsize:
+      self.dropped += 1
+      return
+    try:
+      self.queue.append(self.prepare(record))
+    except Exception:
+      self.handleError(record)
+
+class RealRLock(object):
+  """
+  A reentrant lock of the real threads, for when the threading module is
+  patched by gevent.
+  """
+
+  def __init__(self):
+    self._lock = get_original('thread', 'allocate_lock')()
+    self._get_ident = get_original('thread', 'get_ident')
+    self._owner = None
+    self._count = 0
+
+  def acquire(self):
+    me = self._get_ident()
+    if self._owner != me:
+      self._lock.acquire()
+      self._owner = me
+    self._count += 1
+    return True
+
+  def release(self):
+    self._count -= 1
+    if not self._count:
+      self._owner = None
+      self._lock.release()
+
+class QueueListener(object):
+  """
+  Handle the records of a queue with handlers, in a background thread.
+  """
+
+  _sentinel = None
+
+  def __init__(self, queue, *handlers, **kwargs):
+    self.queue = queue
+    self.handlers = handlers
+    self.interval = kwargs.get('interval', 0.1)
+    self._thread = None
+    self._stopped = None
+    # The handlers are only used by the listener thread. Give them real
+    # locks, as the threading module may be patched by gevent.
+    for h in handlers:
+      h.lock = RealRLock()
+
+  def start(self):
+    start_new_thread = get_original('thread', 'start_new_thread')
+    self._stopped = get_original('thread', 'allocate_lock')()
+    self._stopped.acquire()
+    self._thread = start_new_thread(self._monitor, ())
+
+  def handle(self, record):
+    for h in self.handlers:
+      if record.levelno >= h.level:
+        h.handle(record)
+
+  def _drain(self):
+    while self.queue:
+      record = self.queue.popleft()
+      if record is self._sentinel:
+        return False
+      self.handle(record)
+    return True
+
+  def _monitor(self):
+    sleep = get_original('time', 'sleep')
+    try:
+      while self._drain():
+        sleep(self.interval)
+    finally:
+      for h in self.handlers:
+        h.flush()
+      self._stopped.release()
+
+  def stop(self):
+    """
+    Write out the queued records and stop the thread.
+    """
+    if self._thread is None:
+      return
+    self.queue.append(self._sentinel)
+    self._stopped.acquire()
+    self._thread = None
+
+def create_queued_logger(name, filename = None, stream = sys.stderr,
+                         max_bytes = LOG_MAX_MB*1024*1024, backup_count = LOG_BACKUP_COUNT,
+                         when = None, rate = LOG_INFO_RATE, burst = LOG_INFO_BURST):
+  """
+  Create a logger which logs to filename and stream through a queue.
+
+  The log file is rotated when it reaches max_bytes, or if when is given, at
+  the interval when of TimedRotatingFileHandler, e.g. 'midnight'. backup_count
+  compressed backups are kept. INFO and DEBUG records are limited to rate per
+  second, with bursts of up to burst records. rate = None turns the limit off.
+  """
+  logger = logging.getLogger(name)
+  for h in logger.handlers:
+    listener = getattr(h, 'listener', None)
+    if listener is not None:
+      listener.stop()
+  logger.handlers = []
+
+  formatter = logging.Formatter(FORMAT)
+  handlers = []
+  if filename is not None:
+    if when is not None:
+      fh = CompressingTimedRotatingFileHandler(filename, when = when, backupCount = backup_count, delay = True)
+    else:
+      fh = CompressingRotatingFileHandler(filename, maxBytes = max_bytes, backupCount = backup_count, delay = True)
+    handlers.append(fh)
+  if stream is not None:
+    handlers.append(logging.StreamHandler(stream = stream))
+  for h in handlers:
+    h.setFormatter(formatter)
+
+  queue = deque()
+  qh = QueueHandler(queue)
+  if rate is not None:
+    qh.addFilter(RateLimitFilter(rate, burst))
+  qh.listener = QueueListener(queue, *handlers)
+  qh.listener.start()
+  atexit.register(qh.listener.stop)
+
+  logger.addHandler(qh)
+  logger.setLevel(logging.DEBUG)
+  return logger
@@ -0,0 +1,134 @@
+"""
+common.memory
+
+Track the memory of a long running app or batch job, and run the garbage
+collector only when the resident set size crosses a budget.
+
+The apps call MemoryBudget.check once per tick, and the batch jobs once per
+unit. A check reads the resident set size, which is cheap. If it is over the
+budget, check runs a full collection. If the collection does not bring the
+process back under the budget, the memory is held by live objects rather than
+by garbage, so the budget is raised by MEMORY_BUDGET_STEP_MB above the current
+size, and the object types which grew since the last report are logged.
+Every MEMORY_REPORT_CHECKS checks, the growing types are logged as well.
+
+The growing types point at the leaks, for example reference cycles through
+mongoengine documents. Python's generational collector still collects
+cycles on its own between the checks.
+
+Python 2 has no tracemalloc, so the growth is measured in objects tracked by
+the garbage collector, by type name.
+"""
+
+import os
+import gc
+import time
+from collections import defaultdict
+
+from . import instrumentation
+from .globals import MEMORY_BUDGET_MB, MEMORY_BUDGET_STEP_MB, MEMORY_REPORT_CHECKS
+
+import logging
+logger = logging.getLogger('memory')
+
+MB = 1024*1024
+
+def rss():
+  """
+  Return the resident set size of the process in bytes.
+  """
+  try:
+    with open('/proc/self/statm') as fin:
+      return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError):
+    # Peak resident set size, in kilobytes on Linux.
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def type_counts():
+  """
+  Return a dictionary of type name to the number of objects of the type
+  tracked by the garbage collector.
+  """
+  counts = defaultdict(int)
+  for o in gc.get_objects():
+    counts[type(o).__name__] += 1
+  return counts
+
+def type_growth(before, after, top = 10):
+  """
+  Return the top types which grew from the type counts before to after, as
+  (type name, count, increase) tuples sorted by decreasing increase.
+  """
+  growth = [(name, n, n - before.get(name, 0)) for name, n in after.iteritems()
+            if n > before.get(name, 0)]
+  growth.sort(key = lambda g: (-g[2], g[0]))
+  return growth[:top]
+
+class MemoryBudget(object):
+  """
+  Run the garbage collector when the resident set size crosses budget bytes.
+
+  report_checks: log the growing types every this many checks. 0 to only
+    log them when a collection does not help.
+  """
+
+  def __init__(self, budget = MEMORY_BUDGET_MB*MB, step = MEMORY_BUDGET_STEP_MB*MB,
+               report_checks = MEMORY_REPORT_CHECKS, log = logger, get_rss = rss):
+    self.budget = budget
+    self.limit = budget
+    self.step = step
+    self.report_checks = report_checks
+    self.log = log
+    self.get_rss = get_rss
+    self.checks = 0
+    self.collections = 0
+    self.lastRss = None
+    self.lastTypeCounts = None
+
+  def check(self):
+    """
+    Collect garbage if the process is over its budget. Return the number of
+    objects collected, or None if there was no collection.
+    """
+    self.checks += 1
+    size = self.lastRss = self.get_rss()
+    collected = None
+
+    if size > self.limit:
+      start = time.time()
+      collected = gc.collect()
+      self.collections += 1
+      instrumentation.count('gc_collections')
+      before, size = size, self.get_rss()
+      self.lastRss = size
+      self.log.info('Memory %.1f MB over limit %.1f MB. Garbage collect returned %i in %.2f s. Memory now %.1f MB.'%\
+        (before/float(MB), self.limit/float(MB), collected, time.time() - start, size/float(MB)))
+
+      if size > self.limit:
+        # The memory is held by live objects. Wait for it to grow by another step.
+        self.limit = size + self.step
+        self.log.warning('Memory is still over budget. Raised the limit to %.1f MB.'%(self.limit/float(MB)))
+        self.report()
+      elif self.limit > self.budget:
+        self.limit = max(self.budget, size + self.step)
+
+    elif self.report_checks and self.checks % self.report_checks == 0:
+      self.report()
+
+    return collected
+
+  def report(self, top = 10):
+    """
+    Log the object types which grew since the last report, and return them
+    as (type name, count, increase) tuples.
+    """
+    counts = type_counts()
+    growth = []
+    if self.lastTypeCounts is not None:
+      growth = type_growth(self.lastTypeCounts, counts, top = top)
+      if growth:
+        self.log.info('Memory %.1f MB. Growing types: %s'%(rss()/float(MB),
+          ', '.join('%s: %i (+%i)'%g for g in growth)))
+    self.lastTypeCounts = counts
+    return growth
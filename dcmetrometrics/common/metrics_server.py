@@ -0,0 +1,48 @@
+"""
+common.metrics_server
+
+Serve the instrumentation registry over HTTP in the Prometheus text format,
+and log it periodically as structured JSON lines.
+
+  server = MetricsServer(('127.0.0.1', 9100))
+  server.start()
+
+  GET /metrics
+"""
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from . import instrumentation
+
+import logging
+logger = logging.getLogger('metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def metrics_app(environ, start_response):
+  """
+  WSGI app which serves the registry at /metrics.
+  """
+  if environ.get('PATH_INFO') != '/metrics':
+    start_response('404 Not Found', [('Content-Type', 'text/plain')])
+    return ['Not Found\n']
+  body = instrumentation.REGISTRY.to_prometheus().encode('utf-8')
+  start_response('200 OK', [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(body)))])
+  return [body]
+
+class MetricsServer(WSGIServer):
+  """
+  HTTP server for the metrics endpoint. It runs in the gevent loop of the app.
+  """
+
+  def __init__(self, listener):
+    WSGIServer.__init__(self, listener, metrics_app, log = None)
+
+def log_metrics_forever(interval, log = logger):
+  """
+  Log the registry every interval seconds. Run in a greenlet.
+  """
+  while True:
+    gevent.sleep(interval)
+    instrumentation.log_metrics(log)
@@ -82,6 +82,15 @@ def getLastOpenTime(t):
         return o
     raise RuntimeError('Something wrong in getLastOpenTime')
 
+#########################################################
+# Get the local date of the Metro service day containing time t.
+# A service day starts when Metro opens, so a time after midnight
+# but before opening belongs to the previous day.
+# If t is naive, treat timezone as UTC
+def getServiceDate(t):
+    t = UTCToLocalTime(t)
+    return getLastOpenTime(t).date()
+
 ################################################
 # Get the next close time (greater than the current time)
 def getNextCloseTime(t):
@@ -325,3 +334,17 @@ def parse_iso_time(s):
     dt = parser.parse(s)
     dt = dt.replace(tzinfo = tzny)
     return dt
+
+def parse_wmata_time(s):
+    """Parse a time string from the WMATA API, in the format
+    "2014-08-10T09:59:55", and return as a datetime object with
+    local timezone. Strings in other formats are parsed with
+    parse_iso_time.
+    """
+    if len(s) == 19 and s[10] == 'T':
+        try:
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                            int(s[11:13]), int(s[14:16]), int(s[17:19]), tzinfo = tzny)
+        except ValueError:
+            pass
+    return parse_iso_time(s)
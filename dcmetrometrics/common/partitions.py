@@ -0,0 +1,108 @@
+"""
+common.partitions
+
+Monthly csv partitions for incremental data exports.
+
+A partitioned export keeps one csv file per month of data in a
+partition directory, along with a manifest that records the
+high-water mark of the previous export. On the next export only
+the partitions that have changed need to be regenerated.
+"""
+
+import os
+import json
+from datetime import datetime
+from contextlib import contextmanager
+
+from .utils import mkdir_p
+
+def month_key(t):
+  """
+  Return the partition key for a date or datetime, as "yyyy_mm".
+  """
+  return '%04i_%02i'%(t.year, t.month)
+
+def day_month_key(day):
+  """
+  Return the partition key for a day string "yyyy-mm-dd".
+  """
+  return day[:7].replace('-', '_')
+
+def month_range(key):
+  """
+  Return the (start, end) naive UTC datetimes for partition key "yyyy_mm".
+  end is exclusive.
+  """
+  year, month = (int(v) for v in key.split('_'))
+  start = datetime(year, month, 1)
+  if month == 12:
+    end = datetime(year + 1, 1, 1)
+  else:
+    end = datetime(year, month + 1, 1)
+  return (start, end)
+
+class PartitionManifest(object):
+  """
+  Track the partitions and the export state for each partitioned dataset
+  in a directory.
+  """
+
+  fname = 'manifest.json'
+
+  def __init__(self, partition_dir):
+    self.partition_dir = partition_dir
+    self.path = os.path.join(partition_dir, self.fname)
+    self.data = {}
+    if os.path.exists(self.path):
+      with open(self.path) as fin:
+        self.data = json.load(fin)
+
+  def state(self, name):
+    """
+    Return the mutable export state for the dataset name.
+    """
+    return self.data.setdefault(name, {})
+
+  def reset(self, name):
+    """
+    Forget the export state for the dataset name.
+    """
+    self.data[name] = {}
+    return self.data[name]
+
+  def save(self):
+    mkdir_p(self.partition_dir)
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as fout:
+      json.dump(self.data, fout, indent = 2, sort_keys = True)
+    os.rename(tmp_path, self.path)
+
+  def partition_path(self, name, key):
+    return os.path.join(self.partition_dir, name, '%s_%s.csv'%(name, key))
+
+  def partition_paths(self, name):
+    """
+    Return the paths to all partitions for the dataset name, in order.
+    """
+    keys = sorted(self.state(name).get('partitions', []))
+    return [self.partition_path(name, k) for k in keys]
+
+  @contextmanager
+  def open_partition(self, name, key):
+    """
+    Open a partition for writing. The partition replaces any existing
+    partition for the same key when it is closed.
+    """
+    path = self.partition_path(name, key)
+    mkdir_p(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as fout:
+      yield fout
+
+    os.rename(tmp_path, path)
+
+    partitions = self.state(name).setdefault('partitions', [])
+    if key not in partitions:
+      partitions.append(key)
+      partitions.sort()
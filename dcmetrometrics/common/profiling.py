@@ -0,0 +1,283 @@
+"""
+common.profiling
+
+Profile the ticks of a TickingGreenlet which take longer than a threshold,
+and keep the profiles of the slow ticks in DATA_DIR/profiles.
+
+Profiling is off unless PROFILE_TICKS is set to one of:
+
+  sample:   A wall clock stack sampler. A timer signal interrupts the process
+            every PROFILE_INTERVAL seconds, starting PROFILE_THRESHOLD seconds
+            into the tick, and records the stack of the ticking greenlet, also
+            while it waits on the database or the network. The samples are
+            written as collapsed stacks, one "frame;frame;frame count" line per
+            stack, which flame graph tools read. Ticks shorter than the
+            threshold cost nothing.
+  cprofile: cProfile runs during every tick, and the pstats file is kept only
+            if the tick took longer than PROFILE_THRESHOLD seconds. cProfile
+            slows the tick down, and also counts the calls of the greenlets
+            which run while the tick waits.
+
+Only the newest PROFILE_KEEP dumps of each app are kept.
+utils/profile_summary.py prints the hot spots of recent dumps.
+"""
+
+import os
+import time
+import signal
+import pstats
+import cProfile
+from datetime import datetime
+from collections import defaultdict
+
+import gevent
+
+from .globals import DATA_DIR, PROFILE_TICKS, PROFILE_THRESHOLD, PROFILE_INTERVAL, PROFILE_KEEP
+
+import logging
+logger = logging.getLogger('profiling')
+
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+MODES = ('sample', 'cprofile')
+EXTENSIONS = {'sample' : 'collapsed', 'cprofile' : 'pstats'}
+
+def frame_name(frame):
+  code = frame.f_code
+  return '%s:%s:%i'%(os.path.basename(code.co_filename), code.co_name, code.co_firstlineno)
+
+def collapse_stack(frame):
+  """
+  Return the stack of frame as a string of frame names, outermost first,
+  separated by semicolons.
+  """
+  names = []
+  while frame is not None:
+    names.append(frame_name(frame))
+    frame = frame.f_back
+  names.reverse()
+  return ';'.join(names)
+
+class StackSampler(object):
+  """
+  Sample the stacks of greenlets on SIGALRM.
+
+  There is one timer signal per process, so the sampler is shared by the apps:
+  each app adds its ticking greenlet with a time from which to record samples,
+  and the timer runs while any greenlet is added.
+  """
+
+  def __init__(self, interval = 0.01, clock = time.time):
+    self.interval = interval
+    self.clock = clock
+    self.targets = {} # greenlet -> [start time, stack counts]
+    self._saved_handler = None
+
+  def add(self, greenlet, delay):
+    if not self.targets:
+      self._arm(delay)
+    self.targets[greenlet] = [self.clock() + delay, defaultdict(int)]
+
+  def remove(self, greenlet):
+    """
+    Stop sampling greenlet, and return its stack counts.
+    """
+    start, counts = self.targets.pop(greenlet)
+    if not self.targets:
+      self._disarm()
+    return counts
+
+  def _arm(self, delay):
+    self._saved_handler = signal.signal(signal.SIGALRM, self._handle)
+    # Restart system calls interrupted by the signal instead of failing with EINTR.
+    signal.siginterrupt(signal.SIGALRM, False)
+    signal.setitimer(signal.ITIMER_REAL, max(delay, self.interval), self.interval)
+
+  def _disarm(self):
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, self._saved_handler or signal.SIG_DFL)
+    self._saved_handler = None
+
+  def _handle(self, signum, frame):
+    now = self.clock()
+    current = gevent.getcurrent()
+    for g, (start, counts) in self.targets.items():
+      if now < start:
+        continue
+      # A greenlet which is not running is suspended in gr_frame.
+      f = frame if g is current else g.gr_frame
+      if f is not None:
+        counts[collapse_stack(f)] += 1
+
+_sampler = None
+_cprofile_active = False
+
+def getSampler(interval):
+  global _sampler
+  if _sampler is None:
+    _sampler = StackSampler(interval)
+  return _sampler
+
+def write_collapsed(counts, path):
+  with open(path, 'w') as fout:
+    for stack, n in sorted(counts.items(), key = lambda kv: -kv[1]):
+      fout.write('%s %i\n'%(stack, n))
+
+def read_collapsed(path):
+  counts = defaultdict(int)
+  with open(path) as fin:
+    for line in fin:
+      line = line.rstrip('\n')
+      if not line:
+        continue
+      stack, n = line.rsplit(' ', 1)
+      counts[stack] += int(n)
+  return counts
+
+def list_dumps(dump_dir, name = None):
+  """
+  Return the paths of the dumps in dump_dir, optionally only those of the app
+  name, oldest first.
+  """
+  if not os.path.isdir(dump_dir):
+    return []
+  exts = tuple('.' + e for e in EXTENSIONS.values())
+  fnames = [f for f in os.listdir(dump_dir) if f.endswith(exts)]
+  if name is not None:
+    fnames = [f for f in fnames if f.startswith(name + '-')]
+  paths = [os.path.join(dump_dir, f) for f in fnames]
+  paths.sort(key = lambda p: (os.path.getmtime(p), p))
+  return paths
+
+def rotate_dumps(dump_dir, name, keep):
+  """
+  Remove all but the newest keep dumps of the app name.
+  """
+  paths = list_dumps(dump_dir, name)
+  for path in paths[:max(0, len(paths) - keep)]:
+    os.remove(path)
+
+class TickProfiler(object):
+  """
+  Run the ticks of the app name, and dump a profile of each tick which takes
+  at least threshold seconds into dump_dir. The dumps are noted in log.
+  """
+
+  def __init__(self, name, mode = 'sample', threshold = 20.0, interval = 0.01,
+               dump_dir = PROFILE_DIR, keep = 20, clock = time.time, log = logger):
+    if mode not in MODES:
+      raise ValueError('Unknown profiling mode %r. Use one of %s.'%(mode, ', '.join(MODES)))
+    self.name = name
+    self.mode = mode
+    self.threshold = threshold
+    self.interval = interval
+    self.dump_dir = dump_dir
+    self.keep = keep
+    self.clock = clock
+    self.log = log
+    self.lastDump = None
+
+  def dump_path(self, start):
+    stamp = datetime.utcfromtimestamp(start).strftime('%Y%m%dT%H%M%S')
+    return os.path.join(self.dump_dir, '%s-%s.%s'%(self.name, stamp, EXTENSIONS[self.mode]))
+
+  def _dumped(self, path, elapsed):
+    self.lastDump = path
+    self.log.warning('%s tick took %.2f seconds. Wrote profile %s'%(self.name, elapsed, path))
+    rotate_dumps(self.dump_dir, self.name, self.keep)
+
+  def _makedirs(self):
+    if not os.path.isdir(self.dump_dir):
+      os.makedirs(self.dump_dir)
+
+  def run(self, func, *args, **kwargs):
+    if self.mode == 'sample':
+      return self._run_sampled(func, *args, **kwargs)
+    return self._run_cprofile(func, *args, **kwargs)
+
+  def _run_sampled(self, func, *args, **kwargs):
+    sampler = getSampler(self.interval)
+    g = gevent.getcurrent()
+    start = self.clock()
+    sampler.add(g, self.threshold)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      counts = sampler.remove(g)
+      elapsed = self.clock() - start
+      if counts and elapsed >= self.threshold:
+        self._makedirs()
+        path = self.dump_path(start)
+        write_collapsed(counts, path)
+        self._dumped(path, elapsed)
+
+  def _run_cprofile(self, func, *args, **kwargs):
+    global _cprofile_active
+    if _cprofile_active:
+      # cProfile has one profiler per thread, which another app is using.
+      return func(*args, **kwargs)
+
+    prof = cProfile.Profile()
+    start = self.clock()
+    _cprofile_active = True
+    prof.enable()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      prof.disable()
+      _cprofile_active = False
+      elapsed = self.clock() - start
+      if elapsed >= self.threshold:
+        self._makedirs()
+        path = self.dump_path(start)
+        prof.dump_stats(path)
+        self._dumped(path, elapsed)
+
+def tick_profiler(name, log = logger):
+  """
+  Return a TickProfiler for the app name configured by the PROFILE_*
+  environment variables, or None if profiling is off.
+  """
+  if not PROFILE_TICKS:
+    return None
+  return TickProfiler(name, mode = PROFILE_TICKS, threshold = PROFILE_THRESHOLD,
+                      interval = PROFILE_INTERVAL, keep = PROFILE_KEEP, log = log)
+
+def summarize_collapsed(paths, top = 20):
+  """
+  Return the top frames of the collapsed stack dumps, by the number of samples
+  in which each frame is running (self) and on the stack (total), as
+  (frame, self, total) tuples sorted by total, with the number of samples.
+  """
+  self_counts = defaultdict(int)
+  total_counts = defaultdict(int)
+  num_samples = 0
+  for path in paths:
+    for stack, n in read_collapsed(path).iteritems():
+      frames = stack.split(';')
+      num_samples += n
+      self_counts[frames[-1]] += n
+      for f in set(frames):
+        total_counts[f] += n
+  rows = [(f, self_counts.get(f, 0), t) for f, t in total_counts.iteritems()]
+  rows.sort(key = lambda r: (-r[2], -r[1], r[0]))
+  return rows[:top], num_samples
+
+def format_collapsed_summary(paths, top = 20, sort = 'total'):
+  rows, num_samples = summarize_collapsed(paths, top = None)
+  if sort == 'self':
+    rows.sort(key = lambda r: (-r[1], -r[2], r[0]))
+  rows = rows[:top]
+  lines = ['%i samples in %i dumps'%(num_samples, len(paths)),
+           '%7s %7s  %s'%('self%', 'total%', 'frame')]
+  for f, s, t in rows:
+    lines.append('%6.1f%% %6.1f%%  %s'%(100.0*s/num_samples, 100.0*t/num_samples, f))
+  return '\n'.join(lines)
+
+def format_pstats_summary(paths, top = 20, sort = 'cumulative'):
+  from StringIO import StringIO
+  out = StringIO()
+  stats = pstats.Stats(paths[0], stream = out)
+  for path in paths[1:]:
+    stats.add(path)
+  stats.sort_stats(sort).print_stats(top)
+  return out.getvalue()
@@ -2,12 +2,30 @@
 common.restartingGreenlet
 
 Extend the gevent Greenlet class so that the Greenlet restarts whenever it finishes.
+
+TickingGreenlet is a RestartingGreenlet which calls its tick method on fixed
+wall clock deadlines. A TickingGreenlet profiles its slow ticks if
+PROFILE_TICKS is set. See common.profiling.
 """
 
 import sys
+import time
+import logging
 from gevent import Greenlet, sleep
 from datetime import datetime
 
+from .profiling import tick_profiler
+
+# Restarts sleep for RESTART_BACKOFF seconds, doubled for each consecutive
+# restart, up to MAX_RESTART_BACKOFF seconds. A greenlet which ran for at
+# least RESTART_RESET_TIME seconds before it finished resets the backoff.
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 300.0
+RESTART_RESET_TIME = 600.0
+
+def restartBackoff(consecutiveRestarts):
+    return min(MAX_RESTART_BACKOFF, RESTART_BACKOFF * 2**(consecutiveRestarts - 1))
+
 def makeNewGreenlet(g):
     args = g.rsargs
     kwargs = g.rskwargs
@@ -15,12 +33,22 @@ def makeNewGreenlet(g):
     t = type(newg)
     gid = str(newg)
     dateStr = str(datetime.now())
-    sys.stderr.write('%s: Making new greenlet %s of type %s\n'%(dateStr, gid, str(t)))
 
-    # Impose a short sleep. This is to prevent a buggy RestartingGreenlet 
+    # Carry the restart accounting over to the new greenlet.
+    ranFor = time.time() - g.createdTime
+    newg.restarts = g.restarts + 1
+    newg.consecutiveRestarts = 1 if ranFor >= RESTART_RESET_TIME else g.consecutiveRestarts + 1
+    if getattr(g, 'metrics', None) is not None:
+        newg.metrics = g.metrics
+        newg.metrics.restarts = newg.restarts
+
+    backoff = restartBackoff(newg.consecutiveRestarts)
+    sys.stderr.write('%s: Making new greenlet %s of type %s (restart %i) in %.1f seconds\n'%\
+        (dateStr, gid, str(t), newg.restarts, backoff))
+
+    # Back off before restarting. This is to prevent a buggy RestartingGreenlet
     # from perpetually throwing an exception and continually restarting
-    # TO DO: Consider a max restarts parameter
-    sleep(1)
+    sleep(backoff)
     return newg
 
 class RestartingGreenlet(Greenlet):
@@ -33,6 +61,11 @@ class RestartingGreenlet(Greenlet):
         self.rsargs = args
         self.rskwargs = kwargs
 
+        # Restart accounting
+        self.createdTime = time.time()
+        self.restarts = 0
+        self.consecutiveRestarts = 0
+
         # Set up this Greenlet to use the restarter
         self.link(self.restart)
 
@@ -40,3 +73,112 @@ class RestartingGreenlet(Greenlet):
     def restart(g):
         newg = makeNewGreenlet(g)
         newg.start()
+
+class TickMetrics(object):
+    """
+    Tick statistics of a TickingGreenlet.
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.errors = 0
+        self.overruns = 0 # Ticks which ended after the next deadline
+        self.skipped = 0 # Deadlines which were skipped after an overrun
+        self.restarts = 0
+        self.lastTickTime = None
+        self.maxTickTime = 0.0
+        self.totalTickTime = 0.0
+
+    def record(self, tickTime):
+        self.ticks += 1
+        self.lastTickTime = tickTime
+        self.maxTickTime = max(self.maxTickTime, tickTime)
+        self.totalTickTime += tickTime
+
+    def summary(self):
+        meanTickTime = self.totalTickTime/self.ticks if self.ticks else 0.0
+        return 'ticks: %i, errors: %i, mean tick: %.2f s, max tick: %.2f s, '\
+               'overruns: %i, skipped: %i, restarts: %i'%\
+               (self.ticks, self.errors, meanTickTime, self.maxTickTime,
+                self.overruns, self.skipped, self.restarts)
+
+class TickingGreenlet(RestartingGreenlet):
+    """
+    A RestartingGreenlet which calls tick every PERIOD seconds, on fixed wall
+    clock deadlines, so that the period does not drift by the tick time.
+
+    A tick which ends after the next deadline is an overrun. The deadlines
+    which passed during the tick are skipped, and the next tick runs
+    immediately, after which the ticks are back on the original deadlines.
+
+    Subclasses define tick. The tick may read tickDelta, the number of seconds
+    since the start of the previous tick.
+
+    profiler is the TickProfiler which runs the ticks, or None.
+    """
+
+    PERIOD = 30.0
+
+    # Log the tick metrics every this many ticks.
+    SUMMARY_TICKS = 100
+
+    logger = logging.getLogger(__name__)
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, *args, **kwargs):
+        RestartingGreenlet.__init__(self, *args, **kwargs)
+        self.metrics = TickMetrics()
+        self.tickDelta = None
+        # The slow tick dumps are noted in the app's log.
+        self.profiler = tick_profiler(type(self).__name__, log = self.logger)
+
+    def tick(self):
+        raise NotImplementedError
+
+    def nextDeadline(self, deadline, now):
+        """
+        Return the deadline of the next tick, after a tick with the given
+        deadline which ended at time now.
+        """
+        period = self.PERIOD
+        deadline += period
+        if now > deadline:
+            # Coalesce the missed ticks into one, which runs now.
+            overrun = now - deadline
+            missed = int(overrun//period)
+            self.metrics.overruns += 1
+            self.metrics.skipped += missed
+            deadline += missed*period
+            self.logger.warning('Tick overran by %.2f seconds. Skipped %i ticks.'%(overrun, missed))
+        elif deadline - now > period:
+            # The clock went back. Start again from now.
+            deadline = now + period
+        return deadline
+
+    def _run(self):
+        deadline = self.clock()
+        lastStart = None
+        while True:
+            start = self.clock()
+            self.tickDelta = start - lastStart if lastStart is not None else None
+            lastStart = start
+
+            try:
+                if self.profiler is not None:
+                    self.profiler.run(self.tick)
+                else:
+                    self.tick()
+            except Exception as e:
+                import traceback
+                self.metrics.errors += 1
+                self.logger.error('%s caught Exception: %s\nTraceback:\n%s\n'%\
+                    (type(self).__name__, str(e), traceback.format_exc()))
+
+            end = self.clock()
+            self.metrics.record(end - start)
+            if self.metrics.ticks % self.SUMMARY_TICKS == 0:
+                self.logger.info('Tick metrics: %s'%self.metrics.summary())
+
+            deadline = self.nextDeadline(deadline, end)
+            sleep(max(0.0, deadline - self.clock()))
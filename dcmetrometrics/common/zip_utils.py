@@ -0,0 +1,211 @@
+"""
+common.zip_utils
+
+Write entries into a zip archive incrementally, without first writing
+them to disk.
+
+zipfile.ZipFile in Python 2.7 can only add an entry from a file on disk
+(ZipFile.write) or from a string held in memory (ZipFile.writestr).
+ZipEntryWriter is a file-like object that compresses data into the
+archive as it is written, and patches the local file header with the
+CRC and sizes when it is closed, exactly as ZipFile.write does.
+
+DeflateSpool compresses an entry into a file of its own, so that several
+entries can be compressed concurrently. add_spool then copies the
+compressed bytes into an archive without recompressing them.
+"""
+
+import time
+import zlib
+import shutil
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT, crc32
+
+class ZipEntryWriter(object):
+  """
+  File-like object which streams data into a single entry of an open ZipFile.
+
+  Only one entry may be written at a time, and nothing else should be
+  written to the ZipFile until the entry is closed.
+  """
+
+  def __init__(self, zf, arcname, compress_type = None):
+
+    if not zf.fp:
+      raise RuntimeError("Attempt to write to ZIP archive that was already closed")
+
+    zinfo = ZipInfo(arcname, time.localtime(time.time())[0:6])
+    zinfo.external_attr = 0644 << 16L # -rw-r--r--
+    zinfo.compress_type = zf.compression if compress_type is None else compress_type
+    zinfo.flag_bits = 0x00
+    zinfo.header_offset = zf.fp.tell()
+    zinfo.file_size = 0
+    zinfo.compress_size = 0
+    zinfo.CRC = 0
+
+    zf._writecheck(zinfo)
+    zf._didModify = True
+
+    # The size of the entry is not known ahead of time, so write a zip64 header
+    # whenever the archive allows it. The header is rewritten with the same
+    # layout on close.
+    self._zip64 = zf._allowZip64
+    zf.fp.write(zinfo.FileHeader(self._zip64))
+
+    self._zf = zf
+    self._zinfo = zinfo
+    self._crc = 0
+    self._file_size = 0
+    self._compress_size = 0
+    self._cmpr = None
+    if zinfo.compress_type == ZIP_DEFLATED:
+      self._cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    self.closed = False
+
+  def write(self, data):
+
+    if self.closed:
+      raise ValueError("I/O operation on closed zip entry")
+
+    if isinstance(data, unicode):
+      data = data.encode('utf-8')
+
+    if not data:
+      return
+
+    self._file_size += len(data)
+    self._crc = crc32(data, self._crc) & 0xffffffff
+
+    if self._cmpr:
+      data = self._cmpr.compress(data)
+      self._compress_size += len(data)
+
+    self._zf.fp.write(data)
+
+  def flush(self):
+    pass
+
+  def close(self):
+
+    if self.closed:
+      return
+
+    self.closed = True
+    zf = self._zf
+    zinfo = self._zinfo
+
+    if self._cmpr:
+      buf = self._cmpr.flush()
+      self._compress_size += len(buf)
+      zf.fp.write(buf)
+    else:
+      self._compress_size = self._file_size
+
+    if not self._zip64 and \
+      (self._file_size > ZIP64_LIMIT or self._compress_size > ZIP64_LIMIT):
+      raise RuntimeError("Zip entry %s requires zip64 extensions"%zinfo.filename)
+
+    zinfo.CRC = self._crc
+    zinfo.file_size = self._file_size
+    zinfo.compress_size = self._compress_size
+
+    # Seek backwards and rewrite the local file header with the correct CRC and sizes.
+    position = zf.fp.tell()
+    zf.fp.seek(zinfo.header_offset, 0)
+    zf.fp.write(zinfo.FileHeader(self._zip64))
+    zf.fp.seek(position, 0)
+
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    self.close()
+
+def open_zip_for_writing(path):
+  """
+  Open a new deflated zip archive at path, allowing zip64 extensions.
+  """
+  return ZipFile(path, 'w', ZIP_DEFLATED, allowZip64 = True)
+
+class DeflateSpool(object):
+  """
+  File-like object which deflates data into the file object fp, keeping the
+  CRC and sizes needed to add the data to a zip archive with add_spool.
+  """
+
+  def __init__(self, fp):
+    self.fp = fp
+    self.CRC = 0
+    self.file_size = 0
+    self.compress_size = 0
+    self._cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    self.closed = False
+
+  def write(self, data):
+
+    if self.closed:
+      raise ValueError("I/O operation on closed spool")
+
+    if isinstance(data, unicode):
+      data = data.encode('utf-8')
+
+    self.file_size += len(data)
+    self.CRC = crc32(data, self.CRC) & 0xffffffff
+    data = self._cmpr.compress(data)
+    self.compress_size += len(data)
+    self.fp.write(data)
+
+  def flush(self):
+    pass
+
+  def close(self):
+    """
+    Finish compressing. The underlying file is left open.
+    """
+    if self.closed:
+      return
+    self.closed = True
+    buf = self._cmpr.flush()
+    self.compress_size += len(buf)
+    self.fp.write(buf)
+    self.fp.flush()
+
+  def info(self):
+    """
+    Return the CRC and sizes as a dictionary.
+    """
+    return {'CRC' : self.CRC,
+            'file_size' : self.file_size,
+            'compress_size' : self.compress_size}
+
+def add_spool(zf, arcname, fp, info):
+  """
+  Add deflated data to the ZipFile zf as the entry arcname.
+
+  fp: file object with the raw deflated data, as written by a DeflateSpool.
+  info: dictionary with the CRC, file_size and compress_size of the data,
+    as returned by DeflateSpool.info.
+  """
+  if not zf.fp:
+    raise RuntimeError("Attempt to write to ZIP archive that was already closed")
+
+  zinfo = ZipInfo(arcname, time.localtime(time.time())[0:6])
+  zinfo.external_attr = 0644 << 16L # -rw-r--r--
+  zinfo.compress_type = ZIP_DEFLATED
+  zinfo.flag_bits = 0x00
+  zinfo.header_offset = zf.fp.tell()
+  zinfo.CRC = info['CRC']
+  zinfo.file_size = info['file_size']
+  zinfo.compress_size = info['compress_size']
+
+  zf._writecheck(zinfo)
+  zf._didModify = True
+
+  zf.fp.write(zinfo.FileHeader())
+  fp.seek(0)
+  shutil.copyfileobj(fp, zf.fp)
+
+  zf.filelist.append(zinfo)
+  zf.NameToInfo[zinfo.filename] = zinfo
@@ -8,10 +8,9 @@ drive MetroEscalators and MetroElevators
 # python modules
 import os, sys
 from time import sleep
-from datetime import datetime, date, time, timedelta
+from datetime import date, time
 from collections import defaultdict
-import gc
-# gc.set_debug(gc.DEBUG_STATS)
+import hashlib
 
 ##########################################
 # Set up logging
@@ -29,6 +28,9 @@ from ..common import dbGlobals, twitterUtils, utils, stations
 from ..common.metroTimes import utcnow, tzutc, metroIsOpen, toLocalTime, isNaive
 from ..common.globals import DATA_DIR, WWW_DIR
 from ..common.JSONifier import JSONWriter
+from ..common.memory import MemoryBudget
+from ..common import instrumentation
+from ..common.instrumentation import phase, app_tick
 import dbUtils
 from .dbUtils import invert_dict, update_db_from_incident
 from .models import KeyStatuses, UnitStatus, SymptomCode, Unit, EscalatorAppState
@@ -37,6 +39,7 @@ from twitter import TwitterError
 from .Incident import Incident
 from .WMATA_API import WMATA_API_ERROR, WMATA_API
 from .defs import symptomToCategory, OPERATIONAL_CODE as OP_CODE
+from .jobs import JobWorker, default_jobs
 
 TWEET_LEN = 140
 
@@ -47,8 +50,6 @@ SILENCE_GAP = 60*20
 # the tick is silenced
 MAX_TICK_TWEETS = 10
 
-PERFORMANCE_SUMMARY_INTERVAL = timedelta(hours = 4)
-
 def url_maker(unit_id):
     url = "http://www.dcmetrometrics.com/unit/{unit_id}"
     return url.format(unit_id = unit_id)
@@ -79,17 +80,36 @@ def daily_stats():
     For each escalator, compute the statistics for the last 24 hours
     """
 
-def getELESIncidents():
+def incidentsFingerprint(unitToSymptom):
+    """
+    Return a canonical fingerprint of a set of outages, given as a dictionary
+    of unit id to symptom description.
+    """
+    lines = sorted(u'%s\t%s'%(k, v) for k, v in unitToSymptom.iteritems())
+    return hashlib.sha1(u'\n'.join(lines).encode('utf-8')).hexdigest()
+
+W = None
+def getWMATAAPI():
+    """
+    Return the shared WMATA API client, which reuses its connections
+    between ticks. This requires a valid WMATA API key
     """
-    Get all escalator/elevator incidents from the WMATA API.
+    global W
+    if W is None:
+        checkWMATAKey()
+        W = WMATA_API(key=WMATA_API_KEY)
+    return W
+
+def getELESIncidents(res = None):
+    """
+    Get all escalator/elevator incidents from the WMATA API, or from
+    the response res of an earlier request, as a dictionary of unit id
+    to Incident.
     This requires a valid WMATA API key
     """
-    checkWMATAKey()
-    api = WMATA_API(key=WMATA_API_KEY)
-    res = api.getEscalator()
-    incidents = res.json()['ElevatorIncidents']
-    incidents = [Incident(i) for i in incidents]
-    return incidents
+    if res is None:
+        res = getWMATAAPI().getEscalator()
+    return Incident.from_payload(res.json()['ElevatorIncidents'])
 
 #############################################
 class ELESApp(object):
@@ -100,7 +120,8 @@ class ELESApp(object):
     def __init__(self,
         LIVE=True,
         escTwitterKeys = None,
-        eleTwitterKeys = None):
+        eleTwitterKeys = None,
+        run_jobs = True):
 
         self.LIVE = LIVE
 
@@ -123,6 +144,19 @@ class ELESApp(object):
 
         self.json_writer = JSONWriter(WWW_DIR)
 
+        # Fingerprint of the last WMATA response which was processed.
+        self.lastFingerprint = None
+
+        # Unit id to symptom description of the last outages which were processed.
+        self.lastIncidents = None
+
+        # Run the periodic jobs at the end of the tick, unless they
+        # are run by a worker process.
+        self.jobWorker = JobWorker(default_jobs(self.json_writer)) if run_jobs else None
+
+        # Collect garbage only when the app is over its memory budget.
+        self.memoryBudget = MemoryBudget(log = logger)
+
     def getTwitterApi(self):
 
         if not self.LIVE:
@@ -144,95 +178,105 @@ class ELESApp(object):
     def checkWMATAKey(self):
         checkWMATAKey()
 
-    def tick(self):
+    @app_tick('eles')
+    def tick(self, tickDelta = None):
+        """
+        tickDelta: seconds since the start of the previous tick. By default,
+          the time since the end of the last tick recorded in the app state.
+        """
 
         curTime = utcnow()
         start_tick_time = curTime
         INFO("Start tick.")
 
-        DEBUG("Running garbage collector at start of tick.")
-        count = gc.collect()
-        DEBUG("Garbage collect returned %i"%count)
-
         appState = EscalatorAppState.get()
 
-        time_since_last_tick = None
-        if appState.lastRunTime:
-            time_since_last_tick = (curTime - appState.lastRunTime).total_seconds()
+        if tickDelta is None and appState.lastRunTime:
+            tickDelta = (curTime - appState.lastRunTime).total_seconds()
 
         # Get the current list of WMATA Incidents
         INFO("Getting ELES incidents from WMATA API.")
-        incidents = getELESIncidents()
+        with phase('incidents'):
+            res = getWMATAAPI().getEscalator()
+        fingerprint = getattr(res, 'fingerprint', None)
+
+        changed_units = []
+        unitToSymptom = None
+
+        if fingerprint is not None and fingerprint == self.lastFingerprint:
+            # The incidents are identical to the last processed incidents,
+            # so no unit can have changed status.
+            INFO("Incidents are unchanged since the last tick.")
+            instrumentation.count('unchanged_responses')
 
-        INFO("Have %i outages."%len(incidents))
+        else:
+            incidents = getELESIncidents(res)
+            INFO("Have %i outages."%len(incidents))
 
-        # Update the database with units that changed status.
-        INFO("Processing changed units.")
-        changed_units = self.processIncidents(incidents, curTime)
-        INFO("Have %i changed units"%len(changed_units))
+            unitToSymptom = dict((unit_id, i.SymptomDescription) for unit_id, i in incidents.iteritems())
+            outagesFingerprint = incidentsFingerprint(unitToSymptom)
+
+            if outagesFingerprint == appState.lastIncidentsFingerprint:
+                # The outages are the same as the last processed outages,
+                # possibly before a restart, so the database is up to date.
+                INFO("Outages are unchanged since the last tick.")
+                instrumentation.count('unchanged_outages')
+
+            else:
+                # Only units whose outage appeared, disappeared or changed
+                # since the last processed outages can have changed status.
+                unit_ids = None
+                if self.lastIncidents is not None:
+                    diff = set(self.lastIncidents.iteritems()).symmetric_difference(unitToSymptom.iteritems())
+                    unit_ids = set(unit_id for unit_id, symptom in diff)
+                    INFO("Have %i units with changed outages."%len(unit_ids))
+
+                # Update the database with units that changed status.
+                INFO("Processing changed units.")
+                with phase('process'):
+                    changed_units = self.processIncidents(incidents.values(), curTime,
+                        tickDelta = tickDelta or 0.0, unit_ids = unit_ids)
+                INFO("Have %i changed units"%len(changed_units))
+                instrumentation.count('changed_units', len(changed_units))
 
         # Make tweets, but do not send them.
         INFO("Generating Tweets")
-        tweets = self.generate_tweets(changed_units, url_maker = url_maker)
+        with phase('generate_tweets'):
+            tweets = self.generate_tweets(changed_units, url_maker = url_maker)
 
         # Update the unit's key statuses document.
         INFO("Updating key statuses.")
-        for (unit_id, unit, old_status, new_status, key_status) in changed_units:
-            # Update the Key Statuses Document.
-            unit.update(new_status)
+        with phase('key_statuses'):
+            for (unit_id, unit, old_status, new_status, key_status) in changed_units:
+                # Update the Key Statuses Document.
+                unit.update(new_status)
 
         # Update static json files.
         INFO("Updating static json files.")
-        for (unit_id, unit, old_status, new_status, key_status) in changed_units:
-            INFO("Writing json for unit: %s"%unit_id)
-            self.json_writer.write_unit(unit)
-
+        with phase('json'):
+            for (unit_id, unit, old_status, new_status, key_status) in changed_units:
+                INFO("Writing json for unit: %s"%unit_id)
+                self.json_writer.write_unit(unit)
+
+            if changed_units:
+            # if True:
+                # The station directory is rewritten by the station directory job.
+                INFO("Writing recent updates json.")
+                self.json_writer.write_recent_updates()
+
+        # Record the state of the tick, without overwriting the times
+        # of the periodic jobs.
+        state = {'lastRunTime' : curTime}
         if changed_units:
-        # if True:
-            INFO("Writing station directory json.")
-            self.json_writer.write_station_directory()
-
-            INFO("Writing recent updates json.")
-            self.json_writer.write_recent_updates()
-
-        # Periodically recompute all unit performance summaries.
-        # This takes about 2.5 minutes on my laptop, so we can
-        # afford to do it during the application tick. It just means
-        # some ticks will be long.
-        if not appState.lastPerformanceSummaryTime or \
-            (curTime - appState.lastPerformanceSummaryTime) > PERFORMANCE_SUMMARY_INTERVAL:
-
-            INFO("Recomputing all performance summaries.")
-            units = Unit.objects.no_cache()
-            n = units.count()
-            GARBAGE_COLLECT_DELTA = 20
-            for i, unit in enumerate(units):
-
-                INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
-
-                # TODO: Could get the unit statuses here and pass to unit.compute_performance_summary
-                # and to the json_writer. This way the statuses are pulled from the db only once.
-                start_time = datetime.now()
-                statuses = unit.get_statuses()
-                unit.compute_performance_summary(statuses = statuses, save = True, end_time = start_tick_time )
-                end_time=datetime.now()
-
-                self.json_writer.write_unit(unit, statuses)
-
-                if i%GARBAGE_COLLECT_DELTA == 0:
-                    DEBUG("Running garbage collector in performance summary.")
-                    count = gc.collect()
-                    DEBUG("Garbage collect returned %i"%count)
-
+            state['lastStatusChangeTime'] = curTime
+        if unitToSymptom is not None:
+            state['lastIncidentsFingerprint'] = outagesFingerprint
+        with phase('save_state'):
+            EscalatorAppState.update(**state)
 
-            INFO("Writing station directory.")
-            self.json_writer.write_station_directory()
-
-            appState.lastPerformanceSummaryTime = curTime
-
-
-        appState.lastRunTime = curTime
-        appState.save()
+        self.lastFingerprint = fingerprint
+        if unitToSymptom is not None:
+            self.lastIncidents = unitToSymptom
 
         # Print tweets to screen.
         for t in tweets:
@@ -248,13 +292,20 @@ class ELESApp(object):
          self.escTwitter is not None and \
          self.eleTwitter is not None:
             INFO("Broadcasting Tweets")
-            self.broadcast_tweets(units, tweets)
+            with phase('broadcast'):
+                self.broadcast_tweets(units, tweets)
+            instrumentation.count('tweets', len(tweets))
         else:
             INFO("Not tweeting live.")
 
-        DEBUG("Running garbage collector at end of tick.")
-        count = gc.collect()
-        DEBUG("Garbage collect returned %i"%count)
+        # Run the due jobs after the tweets are sent, so that a failing job
+        # cannot lose the tweets of this tick.
+        if self.jobWorker is not None:
+            with phase('jobs'):
+                self.jobWorker.run_once(curTime)
+
+        with phase('memory'):
+            self.memoryBudget.check()
 
         end_tick_time = utcnow()
         total_tick_time = (end_tick_time - start_tick_time).total_seconds()
@@ -263,9 +314,11 @@ class ELESApp(object):
 
     #########################
     # Execute the tick
-    def processIncidents(self, incidents, curTime, tickDelta = 0.0):
+    def processIncidents(self, incidents, curTime, tickDelta = 0.0, unit_ids = None):
         """
         - Compare the current list of ELES incidents to those we have in the database.
+          If unit_ids is given, only those units are compared, as all other units
+          are known to be unchanged.
         - Add any new units or symptom codes that we are seeing for the first time.
         - Update the database with new statuses.
         - Return a list of units that have changed status as list of tuples:
@@ -277,6 +330,9 @@ class ELESApp(object):
         # Add any units or symptom codes that we are seeing for the first time.
         # If we are seeing a unit for the first time,
         # an initial operational status will be created for the unit.
+        if unit_ids is not None:
+            incidents = [inc for inc in incidents if inc.UnitId in unit_ids]
+
         for inc in incidents:
             update_db_from_incident(inc, curTime)
 
@@ -292,12 +348,10 @@ class ELESApp(object):
         unit_to_new_symptom_desc = dict((i.UnitId, i.SymptomDescription) for i in incidents)
         outage_units = set(unit_to_new_symptom_desc.keys())
 
-        unit_id_to_old_symptom_desc = dict((unit.unit_id, unit.key_statuses.lastStatus.symptom_description) for unit in Unit.objects.no_cache())
-
-        DEBUG("Running garbage collector after iteration over units.")
-        count = gc.collect()
-        DEBUG("Garbage collect returned %i"%count)
-
+        units = Unit.objects.no_cache()
+        if unit_ids is not None:
+            units = units.filter(unit_id__in = list(unit_ids))
+        unit_id_to_old_symptom_desc = dict((unit.unit_id, unit.key_statuses.lastStatus.symptom_description) for unit in units)
 
         was_not_operationals = set(unit_id for unit_id, symptom_desc in unit_id_to_old_symptom_desc.iteritems() if \
                              symptom_desc != "OPERATIONAL")
@@ -364,12 +418,6 @@ class ELESApp(object):
 
             changed_units.append((unit_id, unit, old_status, new_status, key_status))
 
-            DEBUG("Running garbage collector after saving new status.")
-            count = gc.collect()
-            DEBUG("Garbage collect returned %i"%count)
-
-            
-
         return changed_units
 
     ############################################################
@@ -8,48 +8,55 @@ class Incident: An item on the WMATA list of escalator outages.
 from ..common.utils import *
 from ..common import utils
 from datetime import date, datetime, time
-from ..common.metroTimes import parse_iso_time
+from ..common.metroTimes import parse_wmata_time
 import pprint
 
 ###################################################################
 class Incident(object):
     """
     Repepresent an escalator/elevator outage
+
+    The fields of the WMATA data are attributes of the incident. The dates
+    DateOutOfServ and DateUpdated are parsed when they are first read.
     """
 
-    def __init__(self, data):
+    __slots__ = ['_data',
+                 'SymptomDescription',
+                 'LocationDescription',
+                 'UnitName',
+                 'UnitType',
+                 'UnitId',
+                 'StationCode',
+                 'StationName',
+                 'StationDesc',
+                 '_DateOutOfServ',
+                 '_DateUpdated']
 
-        keys = [u'SymptomDescription',
-         u'LocationDescription',
-         u'UnitName',
-         u'UnitType',
-         u'SymptomCode',
-         u'TimeOutOfService',
-         u'DateOutOfServ',
-         u'StationName',
-         u'StationCode',
-         u'DateUpdated',
-         u'UnitStatus',
-         u'DisplayOrder']
-
-        # requiredKeys = ['SymptomDescription',
-        #                 'LocationDescription',
-        #                 'UnitName',
-        #                 'UnitType',
-        #                 'SymptomCode',
-        #                 'StationName',
-        #                 'StationCode']
-
-        # for k in requiredKeys:
-        #     if k not in data:
-        #         raise RuntimeError('Key missing in incident data: %s'%k)
+    def __init__(self, data):
 
         self._data = data # Store a copy of the original data from this object was constructed
-        for k,v in data.iteritems():
-            setattr(self, k, v)
-        #self.__dict__.update(data.iteritems())
+        self.SymptomDescription = data.get('SymptomDescription')
+        self.LocationDescription = data.get('LocationDescription')
+        self.UnitName = data.get('UnitName')
+        self.UnitType = data.get('UnitType')
+        self.StationCode = data.get('StationCode')
+        self.StationName = data.get('StationName')
+        self._DateOutOfServ = None
+        self._DateUpdated = None
         self.addAttr()
 
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Make incidents from the list of ElevatorIncidents of the WMATA API.
+        Return a dictionary of UnitId to Incident.
+        """
+        ret = {}
+        for data in payload:
+            inc = cls(data)
+            ret[inc.UnitId] = inc
+        return ret
+
     def addAttr(self):
         """
         Add additional attributes that are not in the MetroAPI:
@@ -60,8 +67,6 @@ class Incident(object):
         is located.
         """
         self.UnitId = self.UnitName + self.UnitType
-        self.cleanTimes()
-
 
         self.StationDesc = ''
         stationName = self.StationName
@@ -70,18 +75,32 @@ class Incident(object):
             self.StationName = sname.strip()
             self.StationDesc = sdesc.strip()
 
-    def cleanTimes(self):
-        """
-        Convert the times from string to datetimes.
-        """
-        attrs = ['DateOutOfServ', 'DateUpdated']
-        if not all(hasattr(self, a) for a in attrs):
-            return
-
-        # Convert the DateOutOfServe and DateUpdated fields
-        self.DateOutOfServ = parse_iso_time(self.DateOutOfServ)
-        self.DateUpdated = parse_iso_time(self.DateUpdated)
-
+    def _parseTime(self, k):
+        s = self._data.get(k)
+        if s is None:
+            return None
+        return parse_wmata_time(s)
+
+    @property
+    def DateOutOfServ(self):
+        if self._DateOutOfServ is None:
+            self._DateOutOfServ = self._parseTime('DateOutOfServ')
+        return self._DateOutOfServ
+
+    @property
+    def DateUpdated(self):
+        if self._DateUpdated is None:
+            self._DateUpdated = self._parseTime('DateUpdated')
+        return self._DateUpdated
+
+    def __getattr__(self, k):
+        # Other fields of the WMATA data.
+        if k.startswith('_'):
+            raise AttributeError(k)
+        try:
+            return self._data[k]
+        except KeyError:
+            raise AttributeError(k)
 
     def isElevator(self):
         return self.UnitType == 'ELEVATOR'
@@ -108,4 +127,3 @@ class Incident(object):
 
     def __str__(self):
         return pprint.pformat(self._data)
-
@@ -4,7 +4,20 @@ eles.wmataAPI
 Request data from the WMATA API
 """
 
+import time
+import random
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes which are worth retrying.
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+def fingerprint(content):
+    """
+    Return a fingerprint of the body of a response.
+    """
+    return hashlib.sha1(content).hexdigest()
 
 class WMATA_API_ERROR(Exception):
     def __init__(self, requestObj):
@@ -17,7 +30,17 @@ class WMATA_API(object):
     (partial) implementation of the WMATA API.
     """
     
-    def __init__(self, key):
+    def __init__(self, key, session = None, max_retries = 3, backoff = 0.5,
+                 max_backoff = 8.0, sleep = time.sleep):
+        """
+        key: WMATA API key.
+        session: requests Session to use. By default a Session with a pool of
+            keep-alive connections is created, and reused for every request.
+        max_retries: number of times a request is retried after a connection
+            error, a timeout, or a response with a status in RETRY_STATUS_CODES.
+        backoff, max_backoff: a retry sleeps for a random time of up to
+            backoff*2**retry seconds, and at most max_backoff seconds.
+        """
         if not isinstance(key, str) or not key:
             raise TypeError('WMATA_API key should be str')
 
@@ -25,24 +48,89 @@ class WMATA_API(object):
         self.URL_BASE = 'http://api.wmata.com'
         self.TIMEOUT = 10 # timeout requests after 10 seconds.
 
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = 2, pool_maxsize = 4)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+        # The last response for each url, used to answer conditional requests.
+        self.lastResponse = {}
+
     # Check if a request is okay. If it isn't raise WMATA_API_ERROR
     def checkRequest(self, req):    
         if req.status_code != requests.codes.ok:
             raise WMATA_API_ERROR(req)
 
+    def backoffTime(self, retry):
+        """
+        Time to sleep before a retry, with full jitter.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**retry))
+
+    def get(self, url, params = None, headers = None):
+        """
+        Get the url with the session, retrying on connection errors, timeouts
+        and server errors.
+        """
+        retry = 0
+        while True:
+            try:
+                r = self.session.get(url, params = params, timeout = self.TIMEOUT, headers = headers)
+                if r.status_code not in RETRY_STATUS_CODES or retry >= self.max_retries:
+                    return r
+            except (requests.ConnectionError, requests.Timeout):
+                if retry >= self.max_retries:
+                    raise
+            self.sleep(self.backoffTime(retry))
+            retry += 1
+
     def request(self, url, params):
+        """
+        Request the url with the API key.
+
+        The request is conditional when the previous response for the url had an
+        ETag or Last-Modified header. If the server replies Not Modified, the
+        previous response is returned.
+
+        The returned response has a fingerprint of its body, which is
+        the same as the fingerprint of the previous response when the body has
+        not changed.
+        """
         payload = { 'api_key' : self.API_KEY }
         headers = { 'api_key' : self.API_KEY }
         if params is not None:
             payload.update(params)
-        r = requests.get(url, params=payload, timeout = self.TIMEOUT, headers = headers)
+
+        last = self.lastResponse.get(url)
+        if last is not None and last.params == payload:
+            etag = last.headers.get('ETag')
+            if etag:
+                headers['If-None-Match'] = etag
+            lastModified = last.headers.get('Last-Modified')
+            if lastModified:
+                headers['If-Modified-Since'] = lastModified
+
+        r = self.get(url, params=payload, headers = headers)
+        if r.status_code == requests.codes.not_modified and last is not None:
+            return last
+
         self.checkRequest(r)
+        r.fingerprint = fingerprint(r.content)
+        r.params = payload
+        self.lastResponse[url] = r
         return r
 
     # Request the static webpage with elevator/escalator status
     def getEscalatorWebpageStatus(self):
         url = 'http://www.wmata.com/rider_tools/metro_service_status/elevator_escalator.cfm'
-        r = requests.get(url, timeout = self.TIMEOUT)
+        r = self.get(url)
         return r
 
     def getStations(self, params = None):
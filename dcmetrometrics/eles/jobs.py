@@ -0,0 +1,250 @@
+"""
+eles.jobs
+
+Heavy periodic work of the ELES app, which is too slow to run in the
+30 second tick:
+
+  - PerformanceSummaryJob: recompute the performance summary of every unit
+  - StationDirectoryJob: rewrite the station directory json after status changes
+  - DailyServiceReportJob: compute the service reports of the last service day
+
+A JobWorker runs the jobs which are due. It holds a lease in EscalatorAppState
+while it runs them, so that only one worker runs the jobs at a time, and records
+the time of each job in EscalatorAppState.
+
+ELESAppRunner runs a JobWorker in a separate process, with its own database
+connection, so that the jobs never block the tick:
+
+  python -m dcmetrometrics.eles.jobs
+
+An ELESApp created with run_jobs = True runs the due jobs at the end of each
+tick instead.
+"""
+
+import os
+import time
+import socket
+import traceback
+from datetime import timedelta
+
+from .models import Unit, SystemServiceReport, EscalatorAppState
+from ..common.metroTimes import utcnow, getServiceDate
+from ..common.utils import gen_days
+from ..common.JSONifier import JSONWriter
+from ..common.memory import MemoryBudget
+from ..common.globals import WWW_DIR
+
+import logging
+logger = logging.getLogger('ELESApp')
+DEBUG = logger.debug
+INFO = logger.info
+
+PERFORMANCE_SUMMARY_INTERVAL = timedelta(hours = 4)
+
+# A worker renews its lease as it runs a job. A lease which has not been
+# renewed for this long belongs to a worker which has died.
+LEASE_DURATION = timedelta(minutes = 10)
+
+# Seconds between checks for due jobs in the worker process.
+WORKER_SLEEP = 60
+
+class LeaseLost(RuntimeError):
+  """
+  The worker lost the job lease while it ran a job.
+  """
+  pass
+
+class Job(object):
+  """
+  A periodic job. Subclasses define is_due and run.
+  """
+
+  name = None
+
+  def is_due(self, appState, now):
+    raise NotImplementedError
+
+  def run(self, appState, now, renew):
+    """
+    Run the job. renew is a function which the job calls regularly to renew
+    the lease of the worker.
+    """
+    raise NotImplementedError
+
+class PerformanceSummaryJob(Job):
+  """
+  Recompute the performance summaries of all units, and rewrite their json.
+  """
+
+  name = 'performance_summaries'
+
+  def __init__(self, json_writer, interval = PERFORMANCE_SUMMARY_INTERVAL):
+    self.json_writer = json_writer
+    self.interval = interval
+    self.memoryBudget = MemoryBudget(log = logger)
+
+  def is_due(self, appState, now):
+    last = appState.lastPerformanceSummaryTime
+    return last is None or now - last > self.interval
+
+  def run(self, appState, now, renew):
+    INFO("Recomputing all performance summaries.")
+    units = Unit.objects.no_cache()
+    n = units.count()
+    for i, unit in enumerate(units):
+
+      INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
+      renew()
+
+      statuses = unit.get_statuses()
+      unit.compute_performance_summary(statuses = statuses, save = True, end_time = now)
+
+      # The tick may have changed the unit's status while the summary was
+      # computed. Read the unit and its statuses again, so that the json
+      # does not overwrite the json the tick wrote with older statuses.
+      unit = Unit.objects.get(pk = unit.pk)
+      self.json_writer.write_unit(unit)
+      self.memoryBudget.check()
+
+    INFO("Writing station directory.")
+    self.json_writer.write_station_directory()
+    EscalatorAppState.update(lastPerformanceSummaryTime = now,
+                             lastStationDirectoryTime = appState.lastStatusChangeTime)
+
+class StationDirectoryJob(Job):
+  """
+  Rewrite the station directory json when a unit has changed status since it
+  was last written.
+  """
+
+  name = 'station_directory'
+
+  def __init__(self, json_writer):
+    self.json_writer = json_writer
+
+  def is_due(self, appState, now):
+    changed = appState.lastStatusChangeTime
+    written = appState.lastStationDirectoryTime
+    return changed is not None and (written is None or changed > written)
+
+  def run(self, appState, now, renew):
+    INFO("Writing station directory json.")
+    self.json_writer.write_station_directory()
+    # Record the change which the directory covers, rather than the time of
+    # the job, so that a tick which saved its changes while the directory was
+    # written makes the job due again.
+    EscalatorAppState.update(lastStationDirectoryTime = appState.lastStatusChangeTime)
+
+class DailyServiceReportJob(Job):
+  """
+  Compute the daily service reports of every unit and of the system, for the
+  service days which have ended since the job last ran.
+  """
+
+  name = 'daily_service_reports'
+
+  def __init__(self, json_writer):
+    self.json_writer = json_writer
+    self.memoryBudget = MemoryBudget(log = logger)
+
+  def is_due(self, appState, now):
+    last = appState.lastDailyStatsTime
+    return last is None or getServiceDate(last) < getServiceDate(now)
+
+  def run(self, appState, now, renew):
+    today = getServiceDate(now)
+    last = appState.lastDailyStatsTime
+    start_day = getServiceDate(last) if last is not None else today - timedelta(days = 1)
+
+    units = Unit.objects.no_cache()
+    n = units.count()
+    for i, unit in enumerate(units):
+      INFO("Computing daily service reports for unit %s: %i of %i"%(unit.unit_id, i, n))
+      renew()
+      unit.compute_daily_service_reports(start_day = start_day, last_day = today, save = True)
+      self.memoryBudget.check()
+
+    for day in gen_days(start_day, today):
+      renew()
+      report = SystemServiceReport.compute_for_day(day, save = True)
+      self.json_writer.write_daily_system_service_report(report = report)
+
+    EscalatorAppState.update(lastDailyStatsTime = now)
+
+def default_jobs(json_writer = None):
+  json_writer = json_writer or JSONWriter(WWW_DIR)
+  return [StationDirectoryJob(json_writer),
+          PerformanceSummaryJob(json_writer),
+          DailyServiceReportJob(json_writer)]
+
+class JobWorker(object):
+  """
+  Run the jobs which are due, while holding the job lease.
+
+  owner: name of the worker in the lease. The host name and process id by default.
+  """
+
+  def __init__(self, jobs, owner = None, lease_duration = LEASE_DURATION, clock = utcnow):
+    self.jobs = jobs
+    self.owner = owner or '%s:%i'%(socket.gethostname(), os.getpid())
+    self.lease_duration = lease_duration
+    self.clock = clock
+
+  def renew(self):
+    if not EscalatorAppState.acquire_lease(self.owner, self.clock(), self.lease_duration):
+      raise LeaseLost('Worker %s lost the job lease.'%self.owner)
+
+  def run_once(self, now = None):
+    """
+    Run the jobs which are due. Return the names of the jobs which ran, or
+    None if another worker holds the lease.
+
+    A job which raises is logged, and the other due jobs still run. It runs
+    again when it is next due.
+    """
+    now = now or self.clock()
+    appState = EscalatorAppState.get()
+    due = [job for job in self.jobs if job.is_due(appState, now)]
+    if not due:
+      return []
+
+    if not EscalatorAppState.acquire_lease(self.owner, self.clock(), self.lease_duration):
+      DEBUG("Job lease is held by another worker.")
+      return None
+
+    ran = []
+    try:
+      # Another worker may have run some of the jobs before it released the lease.
+      appState = EscalatorAppState.get()
+      due = [job for job in self.jobs if job.is_due(appState, now)]
+      for job in due:
+        INFO("Running job %s."%job.name)
+        try:
+          job.run(appState, now, self.renew)
+        except LeaseLost:
+          raise
+        except Exception as e:
+          logger.error('Job %s caught Exception: %s\nTraceback:\n%s\n'%(job.name, str(e), traceback.format_exc()))
+          continue
+        ran.append(job.name)
+    finally:
+      EscalatorAppState.release_lease(self.owner)
+    return ran
+
+  def run_forever(self, sleep = time.sleep, interval = WORKER_SLEEP):
+    while True:
+      try:
+        self.run_once()
+      except Exception as e:
+        logger.error('Job worker caught Exception: %s\nTraceback:\n%s\n'%(str(e), traceback.format_exc()))
+      sleep(interval)
+
+def main():
+  from ..common import dbGlobals, logging_utils
+  from ..common.globals import DATA_DIR
+  logging_utils.create_queued_logger('ELESApp', os.path.join(DATA_DIR, 'ELESJobs.log'), stream = None)
+  dbGlobals.connect()
+  JobWorker(default_jobs()).run_forever()
+
+if __name__ == '__main__':
+  main()
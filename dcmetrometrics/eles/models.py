@@ -955,7 +955,8 @@ class DailyServiceReport(WebJSONMixin, DataWriteable, Document):
 
   meta = { 'indexes' : ['unit_id',
                         'day',
-                        ('unit_id', 'day')
+                        ('unit_id', 'day'),
+                        'created' # For the high-water mark of the incremental csv export
             ]
   }
 
@@ -1109,8 +1110,16 @@ class EscalatorAppState(Document):
   lastRunTime = DateTimeField()
   lastDailyStatsTime = DateTimeField()
   lastPerformanceSummaryTime = DateTimeField()
+  lastIncidentsFingerprint = StringField() # Fingerprint of the outages in the last processed tick
+  lastStatusChangeTime = DateTimeField() # Time of the last tick in which a unit changed status
+  lastStationDirectoryTime = DateTimeField() # lastStatusChangeTime when the station directory json was last written
+  jobLeaseOwner = StringField() # Process which holds the lease to run the periodic jobs
+  jobLeaseExpires = DateTimeField()
   meta = {'collection' : 'escalator_appstate'}
 
+  time_fields = ['lastRunTime', 'lastDailyStatsTime', 'lastPerformanceSummaryTime',
+                 'lastStatusChangeTime', 'lastStationDirectoryTime', 'jobLeaseExpires']
+
   @classmethod 
   def get(cls):
     try:
@@ -1120,11 +1129,35 @@ class EscalatorAppState(Document):
       obj.save()
 
     # Add time zones
-    if obj.lastRunTime:
-      obj.lastRunTime = toUtc(obj.lastRunTime, allow_naive = True)
-    if obj.lastDailyStatsTime:
-      obj.lastDailyStatsTime = toUtc(obj.lastDailyStatsTime, allow_naive = True)
-    if obj.lastPerformanceSummaryTime:
-      obj.lastPerformanceSummaryTime = toUtc(obj.lastPerformanceSummaryTime, allow_naive = True)
-
-    return obj
\ No newline at end of file
+    for k in cls.time_fields:
+      t = getattr(obj, k)
+      if t:
+        setattr(obj, k, toUtc(t, allow_naive = True))
+
+    return obj
+
+  @classmethod
+  def update(cls, **kwargs):
+    """
+    Set the given fields of the app state, without overwriting the others.
+    The app tick and the job worker both update the app state.
+    """
+    cls.objects(pk = 1).update_one(upsert = True, **dict(('set__%s'%k, v) for k, v in kwargs.iteritems()))
+
+  @classmethod
+  def acquire_lease(cls, owner, now, duration):
+    """
+    Take or renew the lease to run the periodic jobs, if it is free, expired,
+    or already held by owner. Return True if the lease is held by owner.
+    """
+    cls.get()
+    free = Q(jobLeaseOwner = None) | Q(jobLeaseExpires = None) | \
+           Q(jobLeaseExpires__lt = now) | Q(jobLeaseOwner = owner)
+    n = cls.objects(Q(pk = 1) & free).update_one(set__jobLeaseOwner = owner,
+      set__jobLeaseExpires = now + duration)
+    return n == 1
+
+  @classmethod
+  def release_lease(cls, owner):
+    cls.objects(pk = 1, jobLeaseOwner = owner).update_one(set__jobLeaseOwner = None,
+      set__jobLeaseExpires = None)
\ No newline at end of file
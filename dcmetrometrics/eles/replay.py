@@ -0,0 +1,372 @@
+"""
+eles.replay
+
+Replay recorded or synthetic WMATA incident snapshots through ELESApp.tick,
+without WMATA or Twitter.
+
+A snapshot is the list of ElevatorIncidents returned by the WMATA API at one
+time. Snapshots are read from a directory of pickle files written by
+escalatorRequest.run, or of JSON files written by save_snapshot, or are
+generated by SyntheticIncidents.
+
+ELESReplay installs a ReplayWMATAAPI which serves the snapshots, a
+ReplayTwitterAPI which records the tweets, and a VirtualClock in place of
+utcnow, and runs ticks against the configured database. It records the time,
+database operations and memory use of each tick, and the time and database
+operations of each phase of the tick.
+
+See utils/replay_eles.py to run a replay from the command line.
+"""
+
+import os
+import gc
+import json
+import time
+import random
+import cPickle
+from datetime import datetime, timedelta
+
+from dateutil import parser
+
+from . import defs
+from .WMATA_API import fingerprint
+from ..common import stations, instrumentation, memory
+from ..common.metroTimes import tzutc, isNaive, utcnow
+from ..common.instrumentation import PhaseRecorder, MongoOpCounters
+
+# Seconds between snapshots which do not record their request time.
+# This matches the sleep of the ELES app between ticks.
+SNAPSHOT_INTERVAL = 30
+
+# Modules which import utcnow, and which use the virtual clock during a replay.
+CLOCK_MODULES = ['dcmetrometrics.eles.ELESApp',
+                 'dcmetrometrics.eles.dbUtils',
+                 'dcmetrometrics.eles.models',
+                 'dcmetrometrics.common.DataWriter']
+
+SYMPTOMS = ['MINOR REPAIR',
+            'MAJOR REPAIR',
+            'SERVICE CALL',
+            'CALLBACK/REPAIR',
+            'PREV. MAINT. INSPECTION',
+            'SAFETY INSPECTION',
+            'TURNED OFF/WALKER',
+            'SCHEDULED SUPPORT',
+            'REHAB/MODERNIZATION']
+
+def _parse_time(s):
+  """
+  Parse an ISO time string as a UTC datetime. Naive times are taken to be UTC.
+  """
+  dt = parser.parse(s)
+  if isNaive(dt):
+    return dt.replace(tzinfo = tzutc)
+  return dt.astimezone(tzutc)
+
+def load_snapshot(path):
+  """
+  Load a snapshot from a pickle file written by escalatorRequest.run, or from a
+  JSON file holding either a list of incidents, a WMATA ElevatorIncidents
+  response, or a dictionary written by save_snapshot.
+
+  Return (request_time, incidents). request_time is a UTC datetime, or None if
+  the snapshot does not record it.
+  """
+  if path.endswith('.pickle'):
+    with open(path, 'rb') as fin:
+      d = cPickle.load(fin)
+    request_time = datetime.utcfromtimestamp(time.mktime(d['requestTime'])).replace(tzinfo = tzutc)
+    return (request_time, d['incidents'])
+
+  with open(path) as fin:
+    d = json.load(fin)
+  if isinstance(d, list):
+    return (None, d)
+  incidents = d['incidents'] if 'incidents' in d else d['ElevatorIncidents']
+  request_time = d.get('requestTime')
+  if request_time is not None:
+    request_time = _parse_time(request_time)
+  return (request_time, incidents)
+
+def save_snapshot(path, incidents, request_time = None):
+  """
+  Write a snapshot as JSON, in the format read by load_snapshot.
+  """
+  d = {'incidents' : incidents}
+  if request_time is not None:
+    d['requestTime'] = request_time.isoformat()
+  with open(path, 'w') as fout:
+    json.dump(d, fout)
+
+def iter_snapshots(snapshot_dir):
+  """
+  Yield (request_time, incidents) for each snapshot file in the directory, in
+  order of file name. Snapshots are loaded one at a time, so that long replays
+  do not hold every snapshot in memory.
+  """
+  names = sorted(n for n in os.listdir(snapshot_dir) if n.endswith('.pickle') or n.endswith('.json'))
+  for n in names:
+    yield load_snapshot(os.path.join(snapshot_dir, n))
+
+class SyntheticIncidents(object):
+  """
+  Generate a sequence of snapshots for a fixed set of units.
+
+  In each snapshot, each operational unit goes out of service with probability
+  p_out, and each out of service unit returns to service with probability
+  p_fix, or otherwise changes symptom with probability p_change.
+
+  The units are spread over the stations in stations.py, with the same
+  proportion of escalators and elevators as the WMATA system.
+  """
+
+  def __init__(self, num_units = defs.NUM_ESCALATORS + defs.NUM_ELEVATORS, seed = 0,
+               p_out = 0.002, p_fix = 0.01, p_change = 0.005):
+    self.rand = random.Random(seed)
+    self.p_out = p_out
+    self.p_fix = p_fix
+    self.p_change = p_change
+
+    codes = sorted(stations.codeToName)
+    frac_escalators = float(defs.NUM_ESCALATORS)/(defs.NUM_ESCALATORS + defs.NUM_ELEVATORS)
+    self.units = []
+    for i in range(num_units):
+      code = codes[i % len(codes)]
+      num = i // len(codes) + 1
+      unit_type = 'ESCALATOR' if self.rand.random() < frac_escalators else 'ELEVATOR'
+      unit_name = '%s%s%02i'%(code, 'E' if unit_type == 'ESCALATOR' else 'L', num)
+      self.units.append((unit_name, unit_type, code))
+
+    # Unit name to (symptom, time of the last update) for the units out of service.
+    # The time is None until the first snapshot.
+    self.outages = {}
+
+    # Start with the number of outages expected in the steady state.
+    frac_out = p_out/(p_out + p_fix)
+    for unit in self.units:
+      if self.rand.random() < frac_out:
+        self.outages[unit[0]] = (self.rand.choice(SYMPTOMS), None)
+
+  def next_snapshot(self, request_time):
+    """
+    Advance the state of the units and return the incidents at request_time,
+    a UTC datetime, in the WMATA ElevatorIncidents format.
+    """
+    rand = self.rand
+    now = request_time.astimezone(tzutc).replace(tzinfo = None).isoformat()
+    for unit_name, unit_type, code in self.units:
+      outage = self.outages.get(unit_name)
+      r = rand.random()
+      if outage is None:
+        if r < self.p_out:
+          self.outages[unit_name] = (rand.choice(SYMPTOMS), now)
+      elif r < self.p_fix:
+        del self.outages[unit_name]
+      elif r < self.p_fix + self.p_change:
+        self.outages[unit_name] = (rand.choice(SYMPTOMS), now)
+      elif outage[1] is None:
+        self.outages[unit_name] = (outage[0], now)
+
+    # Snapshots in which no unit changed are identical, as they are from WMATA.
+    ret = []
+    for unit_name, unit_type, code in self.units:
+      outage = self.outages.get(unit_name)
+      if outage is None:
+        continue
+      symptom, updated = outage
+      ret.append({u'SymptomDescription' : symptom,
+                  u'LocationDescription' : u'Replay unit %s'%unit_name,
+                  u'UnitName' : unit_name,
+                  u'UnitType' : unit_type,
+                  u'SymptomCode' : None,
+                  u'TimeOutOfService' : u'0000',
+                  u'DateOutOfServ' : updated,
+                  u'StationName' : stations.codeToName[code],
+                  u'StationCode' : code,
+                  u'DateUpdated' : updated,
+                  u'UnitStatus' : None,
+                  u'DisplayOrder' : 0})
+    return ret
+
+class VirtualClock(object):
+  """
+  A clock which stands in for metroTimes.utcnow. It only moves when it is set
+  or advanced.
+  """
+
+  def __init__(self, start_time = None):
+    self.time = start_time or utcnow()
+
+  def __call__(self):
+    return self.time
+
+  def set(self, t):
+    self.time = t
+
+  def advance(self, seconds):
+    self.time += timedelta(seconds = seconds)
+
+class ReplayResponse(object):
+  """
+  Stand-in for the requests Response of a WMATA API call.
+  """
+
+  status_code = 200
+
+  def __init__(self, data):
+    self.data = data
+    self.content = json.dumps(data, sort_keys = True)
+    self.fingerprint = fingerprint(self.content)
+
+  def json(self):
+    return self.data
+
+class ReplayWMATAAPI(object):
+  """
+  Stand-in for WMATA_API which serves the incidents of the current snapshot.
+  """
+
+  def __init__(self, key = None):
+    self.incidents = []
+    self.num_calls = 0
+
+  def set_incidents(self, incidents):
+    self.incidents = incidents
+
+  def getEscalator(self, params = None):
+    self.num_calls += 1
+    return ReplayResponse({'ElevatorIncidents' : self.incidents})
+
+class ReplayTwitterAPI(object):
+  """
+  Stand-in for the python-twitter Api which records the tweets posted by the app.
+  """
+
+  def __init__(self):
+    self.posted = []
+
+  def PostUpdate(self, status, **kwargs):
+    self.posted.append(status)
+
+def memory_usage():
+  """
+  Return (resident set size in bytes, number of objects tracked by the garbage collector).
+  """
+  return (memory.rss(), len(gc.get_objects()))
+
+class ELESReplay(object):
+  """
+  Run ELESApp.tick against a ReplayWMATAAPI, a ReplayTwitterAPI and a VirtualClock.
+
+  db: pymongo database of the app, used to count database operations.
+    If None, only times and memory are recorded.
+  interval: seconds the virtual clock advances after each tick.
+  start_time: UTC datetime of the first tick. The current time by default.
+  """
+
+  SAMPLE_FIELDS = ['tick', 'time', 'incidents', 'seconds', 'db_ops', 'rss', 'objects']
+
+  def __init__(self, db = None, interval = SNAPSHOT_INTERVAL, start_time = None):
+    self.wmata = ReplayWMATAAPI()
+    self.twitter = ReplayTwitterAPI()
+    self.clock = VirtualClock(start_time)
+    self.interval = interval
+    self.op_counters = MongoOpCounters(db) if db is not None else None
+    self.recorder = PhaseRecorder(snapshot = self.op_counters)
+    self.samples = []
+    self.app = None
+    self._saved = None
+
+  def install(self):
+    """
+    Install the replay APIs, the virtual clock and the phase recorder, and
+    create the app.
+    """
+    import sys
+    from . import ELESApp
+
+    modules = [sys.modules[m] for m in CLOCK_MODULES if m in sys.modules]
+    self._saved = (ELESApp.W, ELESApp.WMATA_API_KEY,
+      [(m, m.utcnow) for m in modules], instrumentation.get_recorder())
+
+    ELESApp.W = self.wmata
+    ELESApp.WMATA_API_KEY = ELESApp.WMATA_API_KEY or 'replay'
+    for m in modules:
+      m.utcnow = self.clock
+    instrumentation.set_recorder(self.recorder)
+
+    self.app = ELESApp.ELESApp(LIVE = True)
+    self.app.escTwitter = self.twitter
+    self.app.eleTwitter = self.twitter
+
+  def uninstall(self):
+    if self._saved is None:
+      return
+    from . import ELESApp
+    ELESApp.W, ELESApp.WMATA_API_KEY, clocks, recorder = self._saved
+    for m, f in clocks:
+      m.utcnow = f
+    instrumentation.set_recorder(recorder)
+    self._saved = None
+
+  def _db_ops(self):
+    if self.op_counters is None:
+      return {}
+    return self.op_counters()
+
+  def run_tick(self, incidents, request_time = None):
+    """
+    Run a tick with the snapshot of incidents. If request_time is given, the
+    virtual clock is set to it first. Return the tick time in seconds.
+    """
+    if request_time is not None:
+      self.clock.set(request_time)
+    self.wmata.set_incidents(incidents)
+
+    ops_before = self._db_ops()
+    start = time.time()
+    self.app.tick()
+    elapsed = time.time() - start
+    ops_after = self._db_ops()
+
+    rss, objects = memory_usage()
+    self.samples.append({'tick' : len(self.samples),
+                         'time' : self.clock().isoformat(),
+                         'incidents' : len(incidents),
+                         'seconds' : elapsed,
+                         'db_ops' : sum(v - ops_before.get(k, 0) for k, v in ops_after.iteritems()),
+                         'rss' : rss,
+                         'objects' : objects})
+
+    self.clock.advance(self.interval)
+    return elapsed
+
+  def write_samples(self, path):
+    """
+    Write the per-tick samples as a tab separated file.
+    """
+    with open(path, 'w') as fout:
+      fout.write('\t'.join(self.SAMPLE_FIELDS) + '\n')
+      for s in self.samples:
+        fout.write('\t'.join(str(s[k]) for k in self.SAMPLE_FIELDS) + '\n')
+
+  def format_report(self):
+    lines = []
+    samples = self.samples
+    if samples:
+      n = len(samples)
+      times = sorted(s['seconds'] for s in samples)
+      lines.append('%i ticks: mean %.4f s, median %.4f s, 95th percentile %.4f s, max %.4f s'%\
+        (n, sum(times)/n, times[n//2], times[int(0.95*(n-1))], times[-1]))
+      if self.op_counters is not None:
+        ops = [s['db_ops'] for s in samples]
+        lines.append('Database operations per tick: mean %.1f, max %i'%(float(sum(ops))/n, max(ops)))
+      first, last = samples[0], samples[-1]
+      lines.append('Resident memory: %.1f MB after the first tick, %.1f MB after the last (%+.1f MB)'%\
+        (first['rss']/1e6, last['rss']/1e6, (last['rss'] - first['rss'])/1e6))
+      lines.append('Tracked objects: %i after the first tick, %i after the last (%+i)'%\
+        (first['objects'], last['objects'], last['objects'] - first['objects']))
+    lines.append('%i tweets posted'%len(self.twitter.posted))
+    lines.append('')
+    lines.append(self.recorder.format_report())
+    return '\n'.join(lines)
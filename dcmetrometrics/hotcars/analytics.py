@@ -0,0 +1,166 @@
+"""
+hotcars.analytics
+
+Summary statistics of the hot car reports, computed with pandas.
+
+The reports are loaded into a DataFrame with a single projected query, and
+all statistics are computed with vectorized operations on its columns.
+
+Example:
+
+  from dcmetrometrics.hotcars.analytics import summarize_reports
+  summary = summarize_reports()
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from pandas import DataFrame, Series, DatetimeIndex, to_datetime, date_range
+
+from .models import HotCarReport, HotCarTweet, Temperature
+from ..common.metroTimes import wdToOpenOffset
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+NUM_REPEAT_OFFENDERS = 25
+
+def load_reports_frame():
+  """
+  Load all hot car reports into a DataFrame with columns car_number, color,
+  time (naive UTC), user_id, and service_day (the local date of the Metro
+  service day of the report), sorted by time.
+  """
+  docs = list(HotCarReport.objects.only('car_number', 'color', 'time', 'tweet', 'user_id').as_pymongo())
+  columns = ['car_number', 'color', 'time', 'tweet_id', 'user_id']
+  df = DataFrame(docs, columns = columns)
+
+  # Reports which have not been denormalized: get the user id from the tweets.
+  missing = df['user_id'].isnull()
+  if missing.any():
+    tweets = HotCarTweet.objects(tweet_id__in = list(df['tweet_id'][missing]))\
+                .only('tweet_id', 'user').as_pymongo()
+    tweet_to_user = dict((t['_id'], t['user_id']) for t in tweets)
+    df.loc[missing, 'user_id'] = df['tweet_id'][missing].map(tweet_to_user)
+
+  df['time'] = to_datetime(df['time'])
+  df = df.sort('time').reset_index(drop = True)
+  df['service_day'] = service_days(df['time'])
+  return df
+
+def service_days(times):
+  """
+  Return the local date of the Metro service day of each time in the Series
+  of naive UTC times. A time after midnight but before Metro opens belongs
+  to the previous day.
+  """
+  if len(times) == 0:
+    return Series([], index = times.index, dtype = 'datetime64[ns]')
+  local = DatetimeIndex(times).tz_localize('UTC').tz_convert('America/New_York').tz_localize(None)
+  local = local.values
+  day = local.astype('datetime64[D]')
+  open_time = day + np.array(wdToOpenOffset)[weekdays(day)].astype('timedelta64[h]')
+  before_open = (local < open_time).astype('int64').astype('timedelta64[D]')
+  return Series(day - before_open, index = times.index)
+
+def weekdays(days):
+  """
+  Return the weekday (Monday is 0) of each date in an array of datetime64[D].
+  """
+  # 1970-01-01 was a Thursday.
+  return (days.view('int64') + 3) % 7
+
+def load_temperatures():
+  """
+  Return a Series of the daily maximum temperature, indexed by date.
+  """
+  docs = list(Temperature.objects.only('date', 'max_temp').as_pymongo())
+  if not docs:
+    return Series([], dtype = float)
+  return Series([float(d['maxTemp']) for d in docs],
+                index = DatetimeIndex([d['_id'] for d in docs])).sort_index()
+
+def daily_counts(df):
+  """
+  Return a Series with the number of reports on every service day from the
+  first report to the last report, including days without reports.
+  """
+  counts = df['service_day'].value_counts().sort_index()
+  days = date_range(counts.index[0], counts.index[-1], freq = 'D')
+  return counts.reindex(days, fill_value = 0)
+
+def temperature_correlation(counts, temps):
+  """
+  Return the Pearson correlation of the daily number of reports with the daily
+  maximum temperature, over the days with a temperature, or None.
+  """
+  joined = DataFrame({'count' : counts, 'temp' : temps}).dropna()
+  if len(joined) < 2:
+    return None
+  r = joined['count'].corr(joined['temp'])
+  return None if np.isnan(r) else float(r)
+
+def repeat_offenders(df, limit = NUM_REPEAT_OFFENDERS):
+  """
+  Return the cars with more than one report, in descending order of the number
+  of reports, as a list of dicts.
+  """
+  grouped = df.groupby('car_number')
+  reporters = df[['car_number', 'user_id']].dropna().drop_duplicates()
+  cars = DataFrame({'num_reports' : grouped.size(),
+                    'num_reporters' : reporters.groupby('car_number').size(),
+                    'last_report_time' : grouped['time'].max()})
+  cars['num_reporters'] = cars['num_reporters'].fillna(0)
+  cars = cars[cars['num_reports'] > 1]
+  cars = cars.sort(['num_reports', 'last_report_time'], ascending = False)[:limit]
+  return [{'car_number' : int(car_number),
+           'num_reports' : int(row['num_reports']),
+           'num_reporters' : int(row['num_reporters']),
+           'last_report_time' : row['last_report_time'].to_pydatetime()} \
+          for car_number, row in cars.iterrows()]
+
+def _counts_to_dict(counts):
+  return dict((str(k), int(v)) for k, v in counts.iteritems())
+
+def summarize_reports(df = None, temps = None):
+  """
+  Summarize the hot car reports. Return a dictionary which can be written as JSON.
+
+  df: frame of reports from load_reports_frame. All reports are loaded by default.
+  temps: Series of daily maximum temperatures from load_temperatures.
+  """
+  if df is None:
+    df = load_reports_frame()
+  if temps is None:
+    temps = load_temperatures()
+
+  num_reports = len(df)
+  if num_reports == 0:
+    return {'num_reports' : 0}
+
+  first_time = df['time'].iloc[0].to_pydatetime()
+  last_time = df['time'].iloc[-1].to_pydatetime()
+
+  # Average reports per day between the first and last report, and per weekday
+  # including the first and last day.
+  num_days = (last_time - first_time).total_seconds()/(24*3600.0)
+  num_weekdays = int(np.busday_count(first_time.date(), last_time.date() + timedelta(days = 1)))
+
+  counts = daily_counts(df)
+  weekday_counts = np.bincount(weekdays(df['service_day'].values.astype('datetime64[D]')), minlength = 7)
+  colors = df['color'].fillna('NONE')
+  series = (df['car_number'] // 1000).astype(str)
+
+  return {'num_reports' : num_reports,
+          'num_cars' : int(df['car_number'].nunique()),
+          'num_reporters' : int(df['user_id'].nunique()),
+          'first_report_time' : first_time,
+          'last_report_time' : last_time,
+          'reports_per_day' : num_reports/num_days if num_days > 0 else None,
+          'reports_per_weekday' : num_reports/float(num_weekdays) if num_weekdays > 0 else None,
+          'reports_by_weekday' : dict((WEEKDAYS[i], int(weekday_counts[i])) for i in range(7)),
+          'max_reports_in_day' : int(counts.max()),
+          'days_with_reports' : int((counts > 0).sum()),
+          'series_counts' : _counts_to_dict(series.value_counts()),
+          'color_counts' : _counts_to_dict(colors.value_counts()),
+          'repeat_offenders' : repeat_offenders(df),
+          'temperature_correlation' : temperature_correlation(counts, temps)}
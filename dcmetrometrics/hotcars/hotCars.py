@@ -7,26 +7,29 @@ Utility functions for the HotCars app
 import pymongo
 import sys
 import re
-import gc
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 from dateutil import tz
 from dateutil.tz import tzlocal
 import time
-from collections import defaultdict, Counter
-from operator import itemgetter
-from mongoengine import DoesNotExist, NotUniqueError
+from collections import defaultdict
+from mongoengine import DoesNotExist
 
-from . import models
 from .twitter_api import getTwitterAPI
+from .twitter_fetch import getTwitterFetcher
+from .weather import getTemperatureBackfill
 from .process_tweets import (preprocessText, getHotCarDataFromText,
-        uniqueTweets, tweetIsValidReport, isRetweet)
-from .models import (HotCarAppState, HotCarTweet, HotCarTweeter, HotCarReport, CarsForbiddenByMention, Temperature)
+        uniqueTweets, isRetweet, analyzeTweets, analyzeTexts)
+from .models import (HotCarAppState, HotCarTweet, HotCarTweeter, HotCarReport, HotCarSummary,
+    HotCarDailyCount, CarsForbiddenByMention)
 
 from twitter import TwitterError
 from ..common.globals import WWW_DIR
 from ..common import twitterUtils
 from ..common import dbGlobals
 from ..common.JSONifier import JSONWriter
+from ..common.memory import MemoryBudget
+from ..common import instrumentation
+from ..common.instrumentation import phase, app_tick
 from ..common.metroTimes import utcnow, toLocalTime, UTCToLocalTime, tzutc
 
 import logging
@@ -36,6 +39,9 @@ DEBUG = logger.debug
     
 ME = 'MetroHotCars'.upper()
 
+# Collect garbage only when the app is over its memory budget.
+memoryBudget = MemoryBudget(log = logger)
+
 # Words which are not allowed in hot car report tweets
 all_forbidden_words = set(w.upper() for w in ['cold', 'cool', 'freeze', 'freezing'])
 def hasForbiddenWord(t):
@@ -48,19 +54,10 @@ def getHotCarUrl(carNum):
     url = 'http://www.dcmetrometrics.com/hotcars/detail/{carNum}'.format(carNum=carNum)
     return url
 
-def getWundergroundAPI():
-    from .wundergroundAPI import WundergroundAPI
-    try:
-        # Import may fail if keys/keys.py has not been created.
-        from ..keys import WUNDERGROUND_API_KEY
-    except Exception as e:
-        # Import of keys/keys.py failed - set key to None.
-        WUNDERGROUND_API_KEY = None
-    return WundergroundAPI(WUNDERGROUND_API_KEY, callsPerMinute=10)
-
 
 
 #######################################
+@app_tick('hotcars')
 def tick(tweetLive = False):
 
     dbGlobals.connect()
@@ -69,25 +66,33 @@ def tick(tweetLive = False):
     logger.info('Running HotCar Tick. %s'%(str(curTimeLocal)))
     logger.info('Tweeting Live: %s'%str(tweetLive))
 
-    DEBUG("Running garbage collector at start of tick.")
-    count = gc.collect()
-    DEBUG("Garbage collect returned %i"%count)
-
             
     appState = HotCarAppState.get()
     lastTweetId = appState.lastTweetId if appState.lastTweetId else 0
 
+    with phase('rollups'):
+        # Build the per-car summaries and the daily counts from the existing
+        # reports before they are read or added to by new reports.
+        if not appState.summariesBuilt:
+            logger.info('Building hot car summaries.')
+            HotCarSummary.rebuild()
+        if not appState.dailyCountsBuilt:
+            logger.info('Building hot car daily counts.')
+            HotCarDailyCount.rebuild()
+
     T = getTwitterAPI()
+    fetcher = getTwitterFetcher()
 
     logger.info('last tweet id: %i'%lastTweetId)
 
-    # Generate reponse tweets for any tweets which have not yet been acknowledged
-    tweetResponses = []
-    unacknowledged = list(HotCarTweet.objects(acknowledged = False))
-    logger.info('Found %i unacknowledged tweets'%(len(unacknowledged)))
-    for tweet in unacknowledged:
-        response = genResponseTweet(tweet.handle, getHotCarDataFromText(tweet.text))
-        tweetResponses.append((tweet.tweet_id, response))
+    with phase('unacknowledged'):
+        # Generate reponse tweets for any tweets which have not yet been acknowledged
+        tweetResponses = []
+        unacknowledged = list(HotCarTweet.objects(acknowledged = False))
+        logger.info('Found %i unacknowledged tweets'%(len(unacknowledged)))
+        for tweet in unacknowledged:
+            response = genResponseTweet(tweet.handle, getHotCarDataFromText(tweet.text))
+            tweetResponses.append((tweet.tweet_id, response))
 
     # Remove any tweets returned by Twitter search which mention ME. These
     # will be collected by getMentions, which is careful
@@ -96,121 +101,168 @@ def tick(tweetLive = False):
         mentions = (u.screen_name.upper() for u in tweet.user_mentions)
         return ME in mentions
 
-    # Get the latest tweets about WMATA hotcars. Ignore tweets which
-    # mention MetroHotCars, as these will be processed by getMentions
-    queries = ['wmata hotcar', 'wmata hot car', 'wmata hotcars', 'wmata hot cars']
-    logger.info('Searching for hot car tweets...')
-    tweets = []
-    for q in queries:
-        queryResult = T.GetSearch(q, count=100, since_id = lastTweetId, result_type='recent', include_entities=True)
-        qtweets = (t for t in queryResult if not tweetMentionsMe(t))
-        tweets.extend(qtweets)
-    logger.info("Search return %i tweets", len(tweets))
-    for i, tweet in enumerate(tweets):
-        logger.info("\tTweet from %s: %s", tweet.user.screen_name, tweet.text)
-
-    # Find the max tweet id seen through twitter search
-    maxTweetId = max([t.id for t in tweets]) if tweets else 0
-    maxTweetId = max(maxTweetId, lastTweetId)
-
-    logger.info("Getting mentions from twitter.")
-    # Get tweets which mention MetroHotCars
-    tweets.extend(getMentions(curTime=curTime))
-    logger.info("Done getting mentions.")
-
-    # Make a set of unique tweets
-    tweets = uniqueTweets(tweets)
-    logger.info('Twitter search returned %i unique tweets'%len(tweets))
-
-    def filterSelfRetweets(t):
-        """ Only consider reports that are not retweets and
-        not tweets from MetroHotCars.
-        """
-        # Reject retweets
-        if isRetweet(t):
-            return False
-
-        # Ignore tweets from self
-        if t.user.screen_name.upper() == ME.upper():
-            return False
-
-        return True
-
-
-    filteredTweets = [t for t in tweets if filterSelfRetweets(t)]
-    tweetIds = set(t.id for t in filteredTweets)
-
-    # Make sure we have a set of unique tweets.
-    assert(len(tweetIds) == len(filteredTweets))
-
-    logger.info('Filtered to %i tweets after removing re-/self-tweets'%len(filteredTweets))
-
-    filteredTweets = [t for t in filteredTweets if not hasForbiddenWord(t)]
+    with phase('twitter'):
+        # Get tweets which mention MetroHotCars while the searches run.
+        logger.info("Getting mentions from twitter.")
+        mentionsJob = fetcher.spawn_task(getMentions, curTime=curTime)
+
+        # Get the latest tweets about WMATA hotcars. Ignore tweets which
+        # mention MetroHotCars, as these will be processed by getMentions
+        queries = ['wmata hotcar', 'wmata hot car', 'wmata hotcars', 'wmata hot cars']
+        logger.info('Searching for hot car tweets...')
+        tweets = []
+        try:
+            queryResults = fetcher.search(queries, count=100, since_id = lastTweetId, result_type='recent', include_entities=True)
+        except Exception:
+            # The tick is aborted. Do not leave the mentions running.
+            mentionsJob.kill()
+            raise
+        for queryResult in queryResults:
+            qtweets = (t for t in queryResult if not tweetMentionsMe(t))
+            tweets.extend(qtweets)
+        logger.info("Search return %i tweets", len(tweets))
+        for i, tweet in enumerate(tweets):
+            logger.info("\tTweet from %s: %s", tweet.user.screen_name, tweet.text)
+
+        # Find the max tweet id seen through twitter search
+        maxTweetId = max([t.id for t in tweets]) if tweets else 0
+        maxTweetId = max(maxTweetId, lastTweetId)
+
+        mentions, maxMentionsTweetId = mentionsJob.get()
+        tweets.extend(mentions)
+        logger.info("Done getting mentions.")
+
+    with phase('filter'):
+        # Make a set of unique tweets
+        tweets = uniqueTweets(tweets)
+        logger.info('Twitter search returned %i unique tweets'%len(tweets))
+
+        def filterSelfRetweets(t):
+            """ Only consider reports that are not retweets and
+            not tweets from MetroHotCars.
+            """
+            # Reject retweets
+            if isRetweet(t):
+                return False
+
+            # Ignore tweets from self
+            if t.user.screen_name.upper() == ME.upper():
+                return False
+
+            return True
+
+
+        filteredTweets = [t for t in tweets if filterSelfRetweets(t)]
+        tweetIds = set(t.id for t in filteredTweets)
+
+        # Make sure we have a set of unique tweets.
+        assert(len(tweetIds) == len(filteredTweets))
+
+        logger.info('Filtered to %i tweets after removing re-/self-tweets'%len(filteredTweets))
+
+        filteredTweets = [t for t in filteredTweets if not hasForbiddenWord(t)]
+
+        logger.info('Filtered to %i tweets after removing tweets with forbidden words'%len(filteredTweets))
+
+        tweetData = [(t, hcd) for t,hcd in analyzeTweets(filteredTweets) if hcd['valid']]
+        tweetData = filterDuplicateReports(tweetData)
+        tweetIds = set(t.id for t,hcd in tweetData)
+
+        logger.info('Filtered to %i tweets after removing invalid and duplicate reports'%len(tweetData))
+        logger.info('Have %i tweets about hot cars'%len(tweetData))
+        instrumentation.count('tweets', len(tweets))
+        instrumentation.count('reports', len(tweetData))
+
+    with phase('db_update'):
+        # Save the tweets and reports in one batch. The HTML embeddings
+        # of the new tweets are fetched concurrently.
+        newReportTweetIds = updateDBFromTweets(tweetData)
+        instrumentation.count('new_reports', len(newReportTweetIds))
+
+    with phase('responses'):
+        numNewReports = 0
+        for tweet, hotCarData in tweetData:
+
+            # If we updated the database with data on this tweet,
+            # generate a response tweet
+            if tweet.id in newReportTweetIds:
+                numNewReports += 1
+                user = tweet.user.screen_name
+                response = genResponseTweet(user, hotCarData)
+                tweetResponses.append((tweet.id, response))
+
+        # Update the app state. The mentions are only marked as seen
+        # once they have been turned into reports.
+        if maxMentionsTweetId is None:
+            HotCarAppState.update(lastRunTime = curTime, lastTweetId = maxTweetId)
+        else:
+            HotCarAppState.update(lastRunTime = curTime, lastTweetId = maxTweetId,
+                lastMentionsCheckTime = curTime, lastMentionsTweetId = maxMentionsTweetId)
+    
+        # Tweet Responses
+        for tweetId, response in tweetResponses:
 
-    logger.info('Filtered to %i tweets after removing tweets with forbidden words'%len(filteredTweets))
+            if response is None:
+                continue
 
-    tweetData = [(t, getHotCarDataFromText(t.text)) for t in filteredTweets]
-    tweetData = [(t, hcd) for t,hcd in tweetData if tweetIsValidReport(t, hcd)]
-    tweetData = filterDuplicateReports(tweetData)
-    tweetIds = set(t.id for t,hcd in tweetData)
+            logger.info('Response for Tweet %i: %s'%(tweetId, response))
 
-    logger.info('Filtered to %i tweets after removing invalid and duplicate reports'%len(tweetData))
-    logger.info('Have %i tweets about hot cars'%len(tweetData))
+            if tweetLive:
 
-    for tweet, hotCarData in tweetData:
-        validTweet = tweetIsValidReport(tweet, hotCarData)
-        if not validTweet:
-            continue
+                try:
 
-        updated = updateDBFromTweet(tweet, hotCarData)
+                    T.PostUpdate(response, in_reply_to_status_id = tweetId)
 
-        # If we updated the database with data on this tweet,
-        # generate a response tweet
-        if updated:
-            user = tweet.user.screen_name
-            response = genResponseTweet(user, hotCarData)
-            tweetResponses.append((tweet.id, response))
-
-    # Update the app state
-    HotCarAppState.update(lastRunTime = curTime, lastTweetId = maxTweetId)
-    
-    # Tweet Responses
-    for tweetId, response in tweetResponses:
-
-        if response is None:
-            continue
+                    # Update the acknowledgement status of the tweet
+                    tweet_doc = HotCarTweet.objects(tweet_id = tweetId).get()
+                    tweet_doc.acknowledged = True
+                    tweet_doc.save()
 
-        logger.info('Response for Tweet %i: %s'%(tweetId, response))
+                except TwitterError as e:
 
-        if tweetLive:
-
-            try:
+                    logger.error('Caught TwitterError when trying to acknowledge tweet %i!: %s'%(tweetId, str(e)))
+            
+                except DoesNotExist as e:
+                    logger.error('Caught DoesNotExist when trying to mark tweet %i as acknowledged!:\n%s'%(tweetId, str(e)))
+
+    with phase('json'):
+        # Write hotcar json file for website if data has changed
+        jwriter = JSONWriter(WWW_DIR)
+        if numNewReports:
+            logger.info('Writing json data.')
+            jwriter.write_hotcars()
+            jwriter.write_hotcar_analytics()
+
+    with phase('temperatures'):
+        # Update daily maximum temperatures if necessary. This runs in the
+        # background; the daily counts are written on a later tick when it finishes.
+        backfill = getTemperatureBackfill()
+        if backfill is not None:
+            logger.info("Updating latest temperatures")
+            backfill.start()
+        writeHotCarsByDay(jwriter)
+
+    with phase('memory'):
+        memoryBudget.check()
 
-                T.PostUpdate(response, in_reply_to_status_id = tweetId)
+##################################################
+# Write the hot cars by day json file, only if
+# a day's count or temperature has changed since
+# the file was last written.
+def writeHotCarsByDay(jwriter):
 
-                # Update the acknowledgement status of the tweet
-                tweet_doc = HotCarTweet.objects(tweet_id = tweetId).get()
-                tweet_doc.acknowledged = True
-                tweet_doc.save()
+    lastModified = HotCarDailyCount.last_modified()
+    if lastModified is None:
+        return
 
-            except TwitterError as e:
+    appState = HotCarAppState.get()
+    if appState.lastDailySeriesTime is not None and \
+       lastModified <= appState.lastDailySeriesTime:
+        return
 
-                logger.error('Caught TwitterError when trying to acknowledge tweet %i!: %s'%(tweetId, str(e)))
-            
-            except DoesNotExist as e:
-                logger.error('Caught DoesNotExist when trying to mark tweet %i as acknowledged!:\n%s'%(tweetId, str(e)))
-
-    # Write hotcar json file for website if data has changed
-    jwriter = JSONWriter(WWW_DIR)
-    if tweetResponses:
-        logger.info('Writing json data.')
-        jwriter.write_hotcars()
-
-    # Update daily maximum temperatures if necessary
-    logger.info("Updating latest temperatures")
-    wu = getWundergroundAPI()
-    Temperature.update_latest_temperatures(wu)
+    logger.info('Writing hot cars by day.')
     jwriter.write_hotcars_by_day()
+    HotCarAppState.update(lastDailySeriesTime = lastModified)
 
 ##################################################
 # Get the UTC time of the tweet, from sec since epoch
@@ -229,77 +281,97 @@ def updateDBFromTweet(tweet, hotCarData):
 
     tweet: The tweet (from python-twitter)
     hotCarData: The data extracted from the tweet.
-    """
 
-    #logger.info('hotcars_tweets has %i docs'%(db.hotcars_tweets.count()))
-    logger.info('Updating hotcar_tweets collection with tweet %i'%tweet.id)
-    tweetText = tweet.text.encode('utf-8', errors='ignore')
-
-    # Check if this is a duplicate, and abort if so.
-    try:
-        tweet = models.HotCarTweet.objects(pk = tweet.id).get()
-        logging.info('No update made. Tweet %i is a duplicate.'%tweet.id)
-        return False
-    except DoesNotExist:
-        pass
- 
-
-    # Get the HTML Embedding of the tweet. This may fail if the user
-    # immediately deleted the tweet.
-    T = getTwitterAPI()
-    embed_html = None
-    try:
-        embedding = T.GetStatusOembed(tweet.id, hide_thread=False, omit_script=True, align='left')
-        embed_html = embedding['html']
-    except TwitterError as e:
-        msg = 'Tweet Id: %i'%tweetId +\
-              '\nCaught Twitter error when trying to get Status Oembed: %s'%(str(e))
-        logger.error(msg)
-
-    # Save the tweet.
-    tweet_doc = HotCarTweet(tweet_id = tweet.id,
-                            acknowledged = False,
-                            embed_html = embed_html,
-                            text = tweetText,
-                            time = makeUTCDateTime(tweet.created_at_in_seconds),
-                            user_id = tweet.user.id,
-                            handle = tweet.user.screen_name)
-    try:
-        tweet_doc.save()
-    except NotUniqueError:
-        logging.info('No update made. Tweet %i is a duplicate.'%tweet.id)    
-        return False
-
-    # Update informatino about the twitter user who reported the car.
-    HotCarTweeter.update(tweet.user.id, tweet.user.screen_name)
-
-    # Update hotcars collection
-    carNums = hotCarData['cars']
-    colors = hotCarData['colors']
-    carNum = int(carNums[0])
-    color = colors[0] if colors and len(colors)==1 else None
+    Returns True if a new hot car report was created.
+    """
+    return tweet.id in updateDBFromTweets([(tweet, hotCarData)])
 
-    hot_car_report_doc = HotCarReport(car_number = carNum,
-                                      tweet = tweet_doc,
-                                      time = makeUTCDateTime(tweet.created_at_in_seconds),
-                                      color = color)
-    hot_car_report_doc.denormalize()
+def updateDBFromTweets(tweetData):
+    """
+    Create HotCarTweet, HotCarTweeter, and HotCarReport documents
+    for a batch of tweets, with one query to check for duplicates
+    and one batch insert each for the tweets and reports.
 
-    try:
-        hot_car_report_doc.save()
-        updated = True
+    tweetData: list of (tweet, hotCarData) tuples, where tweet
+      is from python-twitter and hotCarData is the data extracted from the tweet.
 
-    except NotUniqueError:
-        # A hot car report already exists for this tweet. Retrieve it and denormalize it.
-        logger.warning("Tried to save HotCarReport document for tweet %i, but a document for this car already exists."%tweet.id)
-        hot_car_report_doc = HotCarReport.objects(tweet = tweet_doc).get()
-        hot_car_report_doc.denormalize()
-        hot_car_Report_doc.save()
-        updated = False
+    Returns the set of ids of the tweets for which a new hot car
+    report was created.
+    """
 
-    return updated
+    # Check which tweets are duplicates, and skip them.
+    seen = set()
+    tweetData = [(t, hcd) for t, hcd in tweetData if not (t.id in seen or seen.add(t.id))]
+    existing = HotCarTweet.existing_ids(t.id for t, hcd in tweetData)
+    for tweetId in existing:
+        logger.info('No update made. Tweet %i is a duplicate.'%tweetId)
+    tweetData = [(t, hcd) for t, hcd in tweetData if t.id not in existing]
+
+    if not tweetData:
+        return set()
+
+    logger.info('Updating hotcar_tweets collection with tweets %s'%\
+        ', '.join(str(t.id) for t, hcd in tweetData))
+
+    # Get the HTML Embedding of the tweets. An embedding is missing if the user
+    # immediately deleted the tweet. Such tweets are not saved, as the
+    # embedding is required.
+    embeddings = getTwitterFetcher().prefetch_oembed([t.id for t, hcd in tweetData])
+    for t, hcd in tweetData:
+        if embeddings.get(t.id) is None:
+            logger.warning('Not saving tweet %i: could not get its HTML embedding.'%t.id)
+    tweetData = [(t, hcd) for t, hcd in tweetData if embeddings.get(t.id) is not None]
+    if not tweetData:
+        return set()
+
+    # Update information about the twitter users who reported cars.
+    HotCarTweeter.update_many(dict((t.user.id, t.user.screen_name) for t, hcd in tweetData))
+
+    tweetDocs = []
+    reportDocs = []
+    for tweet, hotCarData in tweetData:
 
+        tweetText = tweet.text.encode('utf-8', errors='ignore')
+        tweetTime = makeUTCDateTime(tweet.created_at_in_seconds)
 
+        tweet_doc = HotCarTweet(tweet_id = tweet.id,
+                                acknowledged = False,
+                                embed_html = embeddings.get(tweet.id),
+                                text = tweetText,
+                                time = tweetTime,
+                                user_id = tweet.user.id,
+                                handle = tweet.user.screen_name)
+        tweetDocs.append(tweet_doc)
+
+        carNums = hotCarData['cars']
+        colors = hotCarData['colors']
+        carNum = int(carNums[0])
+        color = colors[0] if colors and len(colors)==1 else None
+
+        # The report is denormalized with the tweet's text and user.
+        reportDocs.append(HotCarReport(car_number = carNum,
+                                       tweet = tweet_doc,
+                                       time = tweetTime,
+                                       color = color,
+                                       text = tweetText,
+                                       handle = tweet.user.screen_name,
+                                       user_id = tweet.user.id))
+
+    # Save the tweets and reports.
+    HotCarTweet.insert_many(tweetDocs)
+    inserted = HotCarReport.insert_many(reportDocs)
+
+    newReportTweetIds = set(doc.tweet.tweet_id for doc in inserted)
+    for doc in reportDocs:
+        if doc.tweet.tweet_id not in newReportTweetIds:
+            logger.warning("Tried to save HotCarReport document for tweet %i, but a document for this tweet already exists."%doc.tweet.tweet_id)
+
+    # Update the running summary for each car and the daily counts
+    for doc in inserted:
+        HotCarSummary.add_report(doc.car_number, doc.time)
+        HotCarDailyCount.add_report(doc.time)
+
+    return newReportTweetIds
 
 
 def filterDuplicateReports(tweetData):
@@ -318,19 +390,18 @@ def filterDuplicateReports(tweetData):
     """
  
     # Build a dictionary from car number to the reporting users/times.
-    # This includes all previous reports.
+    # This includes previous reports of the cars in this batch, made
+    # within 30 days of the earliest tweet in the batch.
     hotCarReportDict= defaultdict(list)
 
-    def doc_to_data(doc):
-        """Extract data from a HotCarReport document to be used locally"""
-        return { 'car_number': doc.car_number,
-                 'tweet_id': doc.tweet.tweet_id,
-                 'time' : doc.time,
-                 'user_id' : doc.tweet.user.user_id }
+    if not tweetData:
+        return []
 
-    # Collect some fields from exists hot car reports.
-    doc_data = (doc_to_data(doc) for doc in HotCarReport.iter_reports())
-    for dd in doc_data:
+    batchCarNumbers = set(hcd['cars'][0] for t, hcd in tweetData)
+    earliestTime = min(makeUTCDateTime(t.created_at_in_seconds) for t, hcd in tweetData)
+    windowStart = earliestTime - timedelta(days=30)
+
+    for dd in HotCarReport.recent_report_data(batchCarNumbers, windowStart):
         hotCarReportDict[dd['car_number']].append(dd)
 
 
@@ -397,7 +468,7 @@ def genResponseTweet(handle, hotCarData):
         msg = '@wmata @MetroRailInfo Car {car} is a #wmata #hotcar HT @{handle}'.format(car=car, handle=handle)
 
     # Add information about the number of reports for this hot car.
-    numReports = HotCarReport.num_reports_for_car(int(car))
+    numReports = HotCarSummary.num_reports_for_car(int(car))
     carUrl = getHotCarUrl(car)
 
     if numReports > 1:
@@ -426,12 +497,13 @@ def getForbiddenCarsByMention():
     appState = HotCarAppState.get()
     lastSelfTweetId = appState.lastSelfTweetId if appState.lastSelfTweetId else 0
 
-    # Clean up any old forbidden car numbers (older than two days)
-    CarsForbiddenByMention.remove_stale_docs()
+    # Old forbidden car numbers (older than two days) are
+    # removed by the TTL index on CarsForbiddenByMention.
 
     # Get any tweets by MetroHotCars since the lastSelfTweetId
-    T = getTwitterAPI()
-    selfTweets = T.GetUserTimeline(screen_name = ME, since_id = lastSelfTweetId, count = 200)
+    fetcher = getTwitterFetcher()
+    selfTweets = fetcher.call('user_timeline', fetcher.api.GetUserTimeline,
+                              screen_name = ME, since_id = lastSelfTweetId, count = 200)
     maxTweetId = max(t.id for t in selfTweets) if selfTweets else 0
     maxTweetId = max(lastSelfTweetId, maxTweetId)
 
@@ -460,7 +532,7 @@ def getForbiddenCarsByMention():
     # Update the app state
     HotCarAppState.update(lastSelfTweetId = maxTweetId)
 
-    # Return the list of tweetIds which are forbidden by mention
+    # Return the set of car numbers which are forbidden by mention
     return CarsForbiddenByMention.get_forbidden_cars()
 
 def getMentions(curTime):
@@ -474,6 +546,10 @@ def getMentions(curTime):
     For example, if MetroHotCars tweets "Car 1043 is a #wmata #hotcar. Car 1043 mentioned 5 times."
     a third user may say "WOW Car 1043 still isn't fixed! @MetroHotcars". This isn't a new report.
     This is why reporting cars with #wmata #hotcar without a mention is more reliable than by mention.
+
+    Return the mentions and the maximum mention tweet id, or ([], None) if
+    the mentions were not checked. The caller saves the id to the app state
+    once the mentions are processed.
     """
 
     appState = HotCarAppState.get()
@@ -488,74 +564,19 @@ def getMentions(curTime):
        doCheck = True
 
     if not doCheck:
-        return []
+        return [], None
     
-    T = getTwitterAPI() 
-    mentions = T.GetMentions(include_entities = True, since_id = lastMentionsTweetId)
+    fetcher = getTwitterFetcher()
+    mentions = fetcher.call('mentions', fetcher.api.GetMentions,
+                            include_entities = True, since_id = lastMentionsTweetId)
     maxMentionsTweetId = max(t.id for t in mentions) if mentions else 0
     maxMentionsTweetId = max(maxMentionsTweetId, lastMentionsTweetId)
 
     # Get car numbers which are forbidden to be submitted by mention
     forbiddenCarNumbers = getForbiddenCarsByMention()
 
-    def tweetIsForbidden(tweet):
-        carNums = getHotCarDataFromText(tweet.text)['cars']
-        return any(carNum in forbiddenCarNumbers for carNum in carNums)
-
-    mentions = [t for t in mentions if (not hasForbiddenWord(t)) and (not tweetIsForbidden(t))]
-
-    # Update the appstate
-    HotCarAppState.update(lastMentionsCheckTime = curTime,
-        lastMentionsTweetId = maxMentionsTweetId)
-
-    return mentions
-
-###################################################################
-# Code below is old and might be dead. TBD.
-# Count the number of weekdays betweet datetimes t1 and t2
-def countWeekdays(t1, t2):
-    d1 = date(t1.year, t1.month, t1.day)
-    d2 = date(t2.year, t2.month, t2.day)
-    dt = d2 - d1
-    numDays = (d2 - d1).days
-    dateGen = (d1 + timedelta(days=i) for i in xrange(numDays+1))
-    numWeekdays = sum(1 for d in dateGen if d.weekday() < 5)
-    return numWeekdays
-
-def summarizeReports(db, reports):
-    numReports = len(reports)
-    reports = sorted(reports, key = itemgetter('time'))
-    firstReport = reports[0]
-    firstReportTime = firstReport['time']
-    lastReport = reports[-1]
-    lastReportTime = lastReport['time']
-
-    # Count the number of unique reporters
-    tweetData = [db.hotcars_tweets.find_one({'_id' : r['tweet_id']}) for r in reports]
-    users = set(t['user_id'] for t in tweetData)
-
-    carNumbers = set(r['car_number'] for r in reports)
-    numCars = len(carNumbers)
-
-    # Color to Num Reports
-    colorToCount = Counter(r['color'] for r in reports)
-
-    # Series to Count
-    seriesToCount = Counter(str(r['car_number'])[0] for r in reports)
-
-    # Get the number of days between the first and last report
-    timeDelta = (lastReportTime - firstReportTime)
-    secondsPerDay = 3600.0*24
-    numDays = timeDelta.total_seconds()/secondsPerDay
-    numWeekDays = countWeekdays(firstReportTime, lastReportTime)
-    dayDelta = timeDelta.days
-    reportsPerDay = numReports/float(numDays)
-    reportsPerWeekday = numReports/float(numWeekDays)
-    res = {'numReports' : numReports,
-           'numCars' : numCars,
-           'reportsPerDay' : reportsPerDay,
-           'reportsPerWeekday' : reportsPerWeekday,
-           'numReporters' : len(users),
-           'colorToCount' : colorToCount,
-           'seriesToCount' : seriesToCount}
-    return res
+    mentions = [t for t in mentions if not hasForbiddenWord(t)]
+    mentionData = analyzeTexts([t.text for t in mentions])
+    mentions = [t for t, hcd in zip(mentions, mentionData) if forbiddenCarNumbers.isdisjoint(hcd['cars'])]
+
+    return mentions, maxMentionsTweetId
@@ -5,19 +5,37 @@ Models for HotCars app.
 from mongoengine import *
 from ..common.WebJSONMixin import WebJSONMixin
 from ..common.DataWriteable import DataWriteable
-from ..common.metroTimes import utcnow, tzutc
+from ..common.metroTimes import utcnow, tzutc, getServiceDate
 
 from datetime import timedelta, datetime, date
 from collections import defaultdict
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+def _insert_unordered(collection, docs):
+  """
+  Insert documents in a single batch, continuing past duplicate key errors.
+  Return True if every document was inserted.
+  """
+  if not docs:
+    return True
+  try:
+    collection.insert(docs, continue_on_error = True)
+  except DuplicateKeyError:
+    return False
+  return True
 
 class HotCarAppState(Document):
 
   id = IntField(required=True, default = 1, db_field = '_id', primary_key=True)
   lastMentionsCheckTime = DateTimeField()
   lastMentionsTweetId = LongField()
+  lastDailySeriesTime = DateTimeField() # Modification time of the daily counts last written to json
   lastRunTime = DateTimeField()
   lastSelfTweetId = LongField()
   lastTweetId = LongField()
+  summariesBuilt = BooleanField(default = False) # True once HotCarSummary.rebuild has run
+  dailyCountsBuilt = BooleanField(default = False) # True once HotCarDailyCount.rebuild has run
 
   meta = {'collection' : 'hotcars_appstate'}
 
@@ -74,6 +92,26 @@ class HotCarTweeter(WebJSONMixin, Document):
     doc.save()
     return doc
 
+  @classmethod
+  def update_many(cls, user_to_handle):
+    """
+    Set the handle of each user in the dictionary of user_id to handle,
+    creating the documents as necessary.
+    """
+    if not user_to_handle:
+      return
+
+    collection = cls._get_collection()
+    if hasattr(collection, 'initialize_unordered_bulk_op'):
+      bulk = collection.initialize_unordered_bulk_op()
+      for user_id, handle in user_to_handle.iteritems():
+        bulk.find({'_id' : user_id}).upsert().update({'$set' : {'handle' : handle}})
+      bulk.execute()
+    else:
+      # The bulk API requires pymongo 2.7.
+      for user_id, handle in user_to_handle.iteritems():
+        collection.update({'_id' : user_id}, {'$set' : {'handle' : handle}}, upsert = True)
+
 
 class HotCarTweet(WebJSONMixin, Document):
   """Stores a HotCar Tweet"""
@@ -97,6 +135,28 @@ class HotCarTweet(WebJSONMixin, Document):
       self.handle = user_doc.handle
     self.save()
 
+  @classmethod
+  def existing_ids(cls, tweet_ids):
+    """
+    Return the set of the given tweet ids which are already stored.
+    """
+    docs = cls.objects(tweet_id__in = list(tweet_ids)).only('tweet_id').as_pymongo()
+    return set(d['_id'] for d in docs)
+
+  @classmethod
+  def insert_many(cls, docs):
+    """
+    Insert new tweet documents in a single unordered batch. Tweets which were
+    stored since existing_ids was checked are skipped.
+    Return True if every tweet was inserted.
+
+    The documents are validated as save() would, and a ValidationError is
+    raised before any document is inserted if one is invalid.
+    """
+    for doc in docs:
+      doc.validate()
+    return _insert_unordered(cls._get_collection(), [d.to_mongo() for d in docs])
+
 class HotCarReport(WebJSONMixin, DataWriteable, Document):
   """Information on a hot car parsed from a tweet.
   The tweet is given by tweet_id.
@@ -140,7 +200,7 @@ class HotCarReport(WebJSONMixin, DataWriteable, Document):
 
   @classmethod
   def num_reports_for_car(cls, car_number):
-    return len(cls.objects(car_number = car_number))
+    return cls.objects(car_number = car_number).count()
 
   def denormalize(self):
     tweet = self.tweet
@@ -149,6 +209,57 @@ class HotCarReport(WebJSONMixin, DataWriteable, Document):
     self.handle = tweet.user.handle
     self.save()
 
+  @classmethod
+  def insert_many(cls, docs):
+    """
+    Insert new report documents in a single unordered batch.
+    Return the list of documents which were inserted. A document is not inserted
+    if a report for the same tweet already exists.
+    """
+    sons = []
+    for doc in docs:
+      doc.validate()
+      doc.id = ObjectId()
+      sons.append(doc.to_mongo())
+
+    if _insert_unordered(cls._get_collection(), sons):
+      return list(docs)
+
+    # Some reports were duplicates. A report was inserted by this batch
+    # if the stored report for its tweet has the id given to it here.
+    stored = cls._get_collection().find({'tweet_id' : {'$in' : [d.tweet.tweet_id for d in docs]}},
+                                        {'tweet_id' : 1})
+    tweet_to_id = dict((d['tweet_id'], d['_id']) for d in stored)
+    return [d for d in docs if tweet_to_id.get(d.tweet.tweet_id) == d.id]
+
+  @classmethod
+  def recent_report_data(cls, car_numbers, since):
+    """
+    Return data on reports for the given car numbers made since the given time,
+    as a list of dicts with keys car_number, tweet_id, time, and user_id.
+
+    This is a single indexed query on (car_number, time) that reads the
+    denormalized user_id, without dereferencing the tweet or its user.
+    """
+    docs = cls.objects(car_number__in = list(car_numbers), time__gt = since)\
+              .only('car_number', 'tweet', 'time', 'user_id').as_pymongo()
+
+    data = [{'car_number' : d['car_number'],
+             'tweet_id' : d['tweet_id'],
+             'time' : d['time'].replace(tzinfo = tzutc),
+             'user_id' : d.get('user_id')} for d in docs]
+
+    # Reports which have not been denormalized: get the user id from the tweets.
+    missing = [d for d in data if d['user_id'] is None]
+    if missing:
+      tweets = HotCarTweet.objects(tweet_id__in = [d['tweet_id'] for d in missing])\
+                  .only('tweet_id', 'user').as_pymongo()
+      tweet_to_user = dict((t['_id'], t['user_id']) for t in tweets)
+      for d in missing:
+        d['user_id'] = tweet_to_user.get(d['tweet_id'])
+
+    return data
+
   @classmethod
   def iter_reports(cls):
     """
@@ -170,46 +281,217 @@ class HotCarReport(WebJSONMixin, DataWriteable, Document):
 
 
 
+class HotCarSummary(Document):
+  """Running summary of the reports for a hot car.
+
+  The summary is updated with a single atomic upsert as each report is saved,
+  so that the number of reports for a car can be read without scanning
+  the car's reports.
+
+  The reports saved before the summaries existed are only counted once
+  rebuild has run, which sets HotCarAppState.summariesBuilt. The tick
+  rebuilds the summaries before it reads or adds to any of them.
+  """
+  car_number = IntField(primary_key = True, required = True, db_field = '_id')
+  num_reports = IntField(default = 0)
+  first_report_time = DateTimeField()
+  last_report_time = DateTimeField()
+
+  meta = {'collection' : 'hotcars_summaries'}
+
+  @classmethod
+  def add_report(cls, car_number, time):
+    """
+    Add a report to the summary for car_number, creating the summary if necessary.
+    This uses the $min and $max update operators, which require MongoDB 2.6.
+    """
+    update = {'$inc' : {'num_reports' : 1},
+              '$min' : {'first_report_time' : time},
+              '$max' : {'last_report_time' : time}}
+    cls._get_collection().update({'_id' : car_number}, update, upsert = True)
+
+  @classmethod
+  def num_reports_for_car(cls, car_number):
+    """
+    Return the number of reports for car_number.
+    """
+    doc = cls.objects(car_number = car_number).only('num_reports').first()
+    if doc is None:
+      # The summary has not been built for this car. Count the reports.
+      return HotCarReport.num_reports_for_car(car_number)
+    return doc.num_reports
+
+  @classmethod
+  def rebuild(cls):
+    """
+    Rebuild all summaries from the hot car reports, and mark them as built.
+
+    Each summary is replaced in place with an upsert, so the collection is
+    never empty while it is rebuilt. The summary of a car is overwritten,
+    so no report may be added while the summaries are rebuilt: the tick
+    rebuilds them before it saves its reports.
+    """
+    reports = HotCarReport.objects.only('car_number', 'time').as_pymongo()
+
+    car_to_summary = {}
+    for r in reports:
+      car_number = r['car_number']
+      summary = car_to_summary.get(car_number)
+      if summary is None:
+        summary = car_to_summary[car_number] = {'num_reports' : 0,
+          'first_report_time' : r['time'], 'last_report_time' : r['time']}
+      summary['num_reports'] += 1
+      summary['first_report_time'] = min(summary['first_report_time'], r['time'])
+      summary['last_report_time'] = max(summary['last_report_time'], r['time'])
+
+    collection = cls._get_collection()
+    for car_number, summary in car_to_summary.iteritems():
+      collection.update({'_id' : car_number}, {'$set' : summary}, upsert = True)
+
+    HotCarAppState.update(summariesBuilt = True)
+
+
+class HotCarDailyCount(WebJSONMixin, Document):
+  """Number of hot car reports and the maximum temperature for a
+  Metro service day.
+
+  Counts are incremented as each report is saved, and temperatures are
+  set as they are retrieved, so the daily time series can be written
+  without scanning all reports. The reports saved before the counts
+  existed are only counted once rebuild has run, which sets
+  HotCarAppState.dailyCountsBuilt.
+  """
+  day = DateTimeField(primary_key = True, required = True, db_field = '_id') # Local service date, at midnight
+  count = IntField(default = 0)
+  max_temp = FloatField()
+  modified = DateTimeField() # UTC time of the last change to this day
+
+  meta = {'collection' : 'hotcars_daily_counts'}
+
+  web_json_fields = ['day', 'count', 'max_temp']
+
+  @staticmethod
+  def _day_key(d):
+    return datetime(d.year, d.month, d.day)
+
+  @classmethod
+  def add_report(cls, time):
+    """
+    Increment the count for the service day of a report made at time.
+    """
+    day = cls._day_key(getServiceDate(time))
+    update = {'$inc' : {'count' : 1},
+              '$set' : {'modified' : datetime.utcnow()}}
+    cls._get_collection().update({'_id' : day}, update, upsert = True)
+
+  @classmethod
+  def set_temperature(cls, day, max_temp):
+    """
+    Set the maximum temperature for a day.
+    """
+    update = {'$set' : {'max_temp' : float(max_temp),
+                        'modified' : datetime.utcnow()}}
+    cls._get_collection().update({'_id' : cls._day_key(day)}, update, upsert = True)
+
+  @classmethod
+  def last_modified(cls):
+    """
+    Return the latest modification time of any day, or None.
+    """
+    doc = cls.objects.order_by('-modified').only('modified').first()
+    return doc.modified if doc else None
+
+  @classmethod
+  def rebuild(cls):
+    """
+    Rebuild the daily counts from all hot car reports and temperatures,
+    and mark them as built.
+
+    Each day is replaced in place with an upsert, so the collection is
+    never empty while it is rebuilt. The count of a day is overwritten,
+    so no report may be added while the counts are rebuilt: the tick
+    rebuilds them before it saves its reports.
+    """
+    now = datetime.utcnow()
+    day_to_doc = {}
+
+    def get_doc(day):
+      day = cls._day_key(day)
+      doc = day_to_doc.get(day)
+      if doc is None:
+        doc = day_to_doc[day] = {'count' : 0, 'modified' : now}
+      return doc
+
+    for r in HotCarReport.objects.only('time').as_pymongo():
+      get_doc(getServiceDate(r['time']))['count'] += 1
+
+    for t in Temperature.objects:
+      get_doc(t.date)['max_temp'] = float(t.max_temp)
+
+    collection = cls._get_collection()
+    for day, doc in day_to_doc.iteritems():
+      collection.update({'_id' : day}, {'$set' : doc}, upsert = True)
+
+    HotCarAppState.update(dailyCountsBuilt = True)
+
+  @classmethod
+  def get_daily_series(cls):
+    """
+    Return a list of {'day', 'count', 'temp'} dictionaries for every
+    day from the first day with a report to the last day with a report.
+    """
+    docs = cls.objects.order_by('day').as_pymongo()
+    day_to_doc = dict((d['_id'].date(), d) for d in docs)
+    report_days = [d for d, doc in day_to_doc.iteritems() if doc.get('count')]
+    if not report_days:
+      return []
+
+    first_day, last_day = min(report_days), max(report_days)
+    series = []
+    day = first_day
+    while day <= last_day:
+      doc = day_to_doc.get(day, {})
+      series.append({'day' : day,
+                     'count' : doc.get('count', 0),
+                     'temp' : doc.get('max_temp')})
+      day += timedelta(days = 1)
+    return series
+
+
 class CarsForbiddenByMention(Document):
   """Hot Cars which are temporarily forbidden to be submitted
   by tweets which mention MetroHotCars.
+
+  Documents expire FORBIDDEN_PERIOD after their time through a TTL index,
+  so stale documents are removed by the server.
   """
+  FORBIDDEN_PERIOD = timedelta(days = 2)
+
   car_number = IntField(required = True, primary_key = True, unique = True)
   time = DateTimeField(required = True)
 
-  @classmethod
-  def get_forbidden_cars(cls):
-    docs = cls.objects.select_related()
-    return [d.car_number for d in docs]
-
+  meta = {'indexes' : [{'fields' : ['time'],
+                        'expireAfterSeconds' : int(FORBIDDEN_PERIOD.total_seconds())}]}
 
   @classmethod
-  def remove_stale_docs(cls, time_delta = None):
-    if not time_delta:
-      time_delta = timedelta(days = 2)
-    cur_time = utcnow()
-    stale_docs = cls.objects(time__lt = cur_time - time_delta)
-    for r in stale_docs:
-      r.delete()
+  def get_forbidden_cars(cls):
+    """
+    Return the set of forbidden car numbers.
+    The TTL monitor only runs once a minute, so documents which are
+    past expiry but not yet removed are excluded by the query.
+    """
+    cutoff = utcnow() - cls.FORBIDDEN_PERIOD
+    docs = cls.objects(time__gte = cutoff).only('car_number').as_pymongo()
+    return set(d['_id'] for d in docs)
 
   @classmethod
   def add(cls, car_number, time):
     """
     Add a document or update existing one.
     """
+    cls._get_collection().update({'_id' : car_number}, {'$set' : {'time' : time}}, upsert = True)
 
-    try:
 
-      doc = cls.objects(car_number = car_number).get()
-
-    except DoesNotExist:
-
-      doc = cls(car_number = car_number, time = time)
-
-    doc.time = time
-    doc.save()
-
-    
 
 class Temperature(WebJSONMixin, Document):
   """Daily Temperature"""
@@ -219,23 +501,34 @@ class Temperature(WebJSONMixin, Document):
   meta = {'collection' : 'temperatures'}
   web_json_fields = ['date', 'max_temp']
 
+  BACKFILL_DAYS = 30 # Number of days to look back for missing temperatures
+
   @classmethod
-  def update_latest_temperatures(cls, wunderground_api):
-    ZIP_CODE = '20009'
-    temps = cls.objects.order_by('-date')
-    today = date.today()
-    yesterday = today - timedelta(days = 1)
-    if temps.count() == 0:
-      last_day = yesterday
-    else:
-      last_day = temps[0].date.date()
+  def missing_days(cls, today = None):
+    """
+    Return the days without a temperature, up to and including today.
+    This includes every day since the latest temperature, and any day
+    in the BACKFILL_DAYS before today which is missing.
+    """
+    today = today or date.today()
 
-    num_days = (today - last_day).days
-    for i in range(num_days):
-      day = last_day + timedelta(days = i + 1)
-      rec = wunderground_api.getHistory(day, ZIP_CODE, sleep=True)
-      max_temp = rec['dailysummary'][0]['maxtempi']
-      new_temp_record = cls(date = day, max_temp = max_temp)
-      new_temp_record.save()
+    first_doc = cls.objects.order_by('date').only('date').first()
+    last_doc = cls.objects.order_by('-date').only('date').first()
+    if last_doc is None:
+      return [today - timedelta(days = 1), today]
 
+    start = min(today - timedelta(days = cls.BACKFILL_DAYS), last_doc.date.date() + timedelta(days = 1))
+    start = max(start, first_doc.date.date())
+    have = set(d['_id'].date() for d in cls.objects(date__gte = start).only('date').as_pymongo())
+    num_days = (today - start).days + 1
+    days = (start + timedelta(days = i) for i in range(num_days))
+    return [d for d in days if d not in have]
 
+  @classmethod
+  def add(cls, day, max_temp):
+    """
+    Save the temperature for a day, and update the daily hot car counts.
+    """
+    new_temp_record = cls(date = day, max_temp = max_temp)
+    new_temp_record.save()
+    HotCarDailyCount.set_temperature(day, max_temp)
@@ -1,9 +1,44 @@
 """Utilities for processing tweets to generate hot car reports
+
+The regular expressions and lookup tables used to analyze tweet text
+are compiled once, when the module is imported. Use analyzeTweets or
+analyzeTexts to process a batch of tweets in a single call.
 """
 
 ##########################
 import re
 
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9\s]')
+_NUMBER_RE = re.compile(r'(\d+)')
+_SPACE_RE = re.compile(r'\s+')
+_SERIES_RE = re.compile(r'[1-6]000 SERIES')
+_DIGITS_RE = re.compile(r'\d+')
+
+# Words which refer to each line color
+COLOR_TO_WORDS = { 'RED' : ('RED', 'RD', 'RL', 'REDLINE'),
+                   'BLUE' : ('BLUE', 'BL', 'BLUELINE'),
+                   'GREEN' : ('GREEN', 'GR', 'GL', 'GREENLINE'),
+                   'YELLOW' : ('YELLOW', 'YL', 'YELLOWLINE'),
+                   'ORANGE' : ('ORANGE', 'OL', 'ORANGELINE')
+                 }
+WORD_TO_COLOR = dict((w, c) for c, words in COLOR_TO_WORDS.iteritems() for w in words)
+
+# Words which mean a tweet is not about WMATA
+EXCLUDED_WORDS = frozenset(['MBTA', 'BART'])
+
+# Users whose tweets are never reports
+FORBIDDEN_USERS = frozenset(['METROHOTCARS', 'ASBESTOSCAR'])
+
+# Car ranges are from Wikipedia, inclusive
+CAR_RANGES = { '1' : (1000, 1299),
+               '2' : (2000, 2075),
+               '3' : (3000, 3289),
+               '4' : (4000, 4099),
+               '5' : (5000, 5191),
+               '6' : (6000, 6183),
+               '7' : (7000, 7747)
+             }
+
 def preprocessText(tweetText):
   """
   Preprocess tweet text by padding 4 digit numbers with spaces,
@@ -19,16 +54,16 @@ def preprocessText(tweetText):
   tweetText = ' '.join(words)
 
   # Replace non-alphanumeric characters with spaces
-  tweetText = re.sub('[^a-zA-Z0-9\s]',' ', tweetText)
+  tweetText = _NON_ALNUM_RE.sub(' ', tweetText)
 
   # Separate numbers embedded in words
-  tweetText = re.sub('(\d+)', ' \\1 ', tweetText)
+  tweetText = _NUMBER_RE.sub(' \\1 ', tweetText)
 
   # Make consecutive white space a single space
-  tweetText = re.sub('\s+', ' ', tweetText)
+  tweetText = _SPACE_RE.sub(' ', tweetText)
 
   # Remove reference to 1000, 2000, ..., 6000 Series
-  tweetText = re.sub('[1-6]000 SERIES', '', tweetText)
+  tweetText = _SERIES_RE.sub('', tweetText)
 
   return tweetText
 
@@ -36,51 +71,47 @@ def getCarNums(text):
   """
   Get 4 digit car numbers
   """
-  nums = re.findall('\d+', text)
+  nums = _DIGITS_RE.findall(text)
   validNums = [int(n) for n in set(s for s in nums if len(s)==4)]
   return validNums
 
-
-#######################################
-# Get colors mentioned from a tweet
-# 
-def getColors(text):
-  """
-  Extract line colors from text
-  This assumes that the tweet text has already been preprocessed
-  by removing hashtags and making all text uppercase.
-  """
-
-  colorToWords = { 'RED' : ['RD', 'RL', 'REDLINE'],
-                   'BLUE' : ['BL', 'BLUELINE'],
-                   'GREEN' : ['GR', 'GL', 'GREENLINE'],
-                   'YELLOW' : ['YL', 'YELLOWLINE'],
-                   'ORANGE' : ['OL', 'ORANGELINE']
-                 }
-
-  for c, colorWordList in colorToWords.iteritems():
-      colorWordList.append(c) # Add the color itself to the word list
-      colorToWords[c] = colorWordList
-
-  wordToColor = dict((w,k) for k,wlist in colorToWords.iteritems() for w in wlist)
-  words = text.split()
-  colors = (wordToColor.get(w, None) for w in words)
-  colors = [c for c in colors if c is not None]
+def _getColorsFromWords(words):
+  colors = set(WORD_TO_COLOR[w] for w in words if w in WORD_TO_COLOR)
 
   # Special handling of the silver line.
   # Be wary of "Silver Spring". It's tough, because
   # Spring Hill is an actual Silver Line station, so we may miss some
   # silver line tags.
   if 'SV' in words:
-      colors.append('SILVER')
+      colors.add('SILVER')
   if ('SILVER' in words) and\
      ("SPRING" not in words) and\
      ("SPRNG" not in words):
-      colors.append('SILVER')
+      colors.add('SILVER')
 
-  colors = list(set(colors))
+  return list(colors)
 
-  return colors
+#######################################
+# Get colors mentioned from a tweet
+# 
+def getColors(text):
+  """
+  Extract line colors from text
+  This assumes that the tweet text has already been preprocessed
+  by removing hashtags and making all text uppercase.
+  """
+  return _getColorsFromWords(frozenset(text.split()))
+
+def isValidCarNumber(carNum):
+  """
+  Return True if carNum is in the range of a WMATA railcar series.
+  """
+  carNumStr = str(carNum)
+  carRange = CAR_RANGES.get(carNumStr[0])
+  if carRange is None:
+    return False
+  minNum, maxNum = carRange
+  return minNum <= int(carNum) <= maxNum
 
 def uniqueTweets(tweetList):    
   """
@@ -94,15 +125,46 @@ def isRetweet(tweet):
   txt = tweet.text
   return (tweet.retweeted_status or ('MT' in txt) or ('RT' in txt))
 
+def _analyzePreprocessed(pp):
+  words = pp.split()
+  wordSet = frozenset(words)
+  carNums = list(set(int(w) for w in words if len(w) == 4 and w.isdigit()))
+  return {'cars' : carNums,
+          'colors' : _getColorsFromWords(wordSet),
+          'excluded' : not EXCLUDED_WORDS.isdisjoint(wordSet)}
+
 def getHotCarDataFromText(text):
   """
-  Get hot car data from text. Extract car numbers and line colors
+  Get hot car data from text. Extract car numbers and line colors,
+  and whether the text has an excluded word (see EXCLUDED_WORDS).
   """
-  pp = preprocessText(text)
-  carNums = getCarNums(pp)
-  colors = getColors(pp)
-  return {'cars' : carNums,
-          'colors' : colors } 
+  return _analyzePreprocessed(preprocessText(text))
+
+def analyzeTexts(texts):
+  """
+  Get hot car data for a list of tweet texts, as returned by getHotCarDataFromText.
+  Repeated texts (such as retweets) are only analyzed once.
+  """
+  seen = {}
+  ret = []
+  for text in texts:
+    hcd = seen.get(text)
+    if hcd is None:
+      hcd = seen[text] = _analyzePreprocessed(preprocessText(text))
+    ret.append(dict(hcd))
+  return ret
+
+def analyzeTweets(tweets):
+  """
+  Get hot car data for a list of tweets. Return a list of (tweet, hotCarData)
+  tuples. In addition to the keys returned by getHotCarDataFromText,
+  hotCarData['valid'] is True if the tweet is a valid hot car report.
+  """
+  tweets = list(tweets)
+  hotCarData = analyzeTexts([t.text for t in tweets])
+  for t, hcd in zip(tweets, hotCarData):
+    hcd['valid'] = tweetIsValidReport(t, hcd)
+  return zip(tweets, hotCarData)
 
 ###########################################################
 # Return True if we should store hot car data on this tweet
@@ -118,8 +180,7 @@ def tweetIsValidReport(tweet, hotCarData):
     """
 
     # Ignore tweets from self or other forbidden users
-    forbidden_users = set(sn.upper() for sn in('MetroHotCars', 'AsbestosCar'))
-    if tweet.user.screen_name.upper() in forbidden_users:
+    if tweet.user.screen_name.upper() in FORBIDDEN_USERS:
         return False
 
     # Ignore retweets
@@ -132,39 +193,16 @@ def tweetIsValidReport(tweet, hotCarData):
     if len(carNums) != 1:
         return False
 
-    carNumStr = str(carNums[0])
-    carNumInt = int(carNums[0])
-    firstDigit = carNumStr[0]
-
-
-    # Car ranges are from Wikipedia, inclusive
-    carRanges = { '1' : (1000, 1299),
-                  '2' : (2000, 2075),
-                  '3' : (3000, 3289),
-                  '4' : (4000, 4099),
-                  '5' : (5000, 5191),
-                  '6' : (6000, 6183),
-                  '7' : (7000, 7747)
-                }
-
-    if firstDigit not in carRanges:
-        return False
-
     # Require the car to be a valid number
-    minNum, maxNum = carRanges[firstDigit]
-    carNumValid = carNumInt <= maxNum and carNumInt >= minNum
-    if not carNumValid:
+    if not isValidCarNumber(carNums[0]):
         return False
 
     # Check if the tweet has any forbidded words.
-    excludedWords = ['MBTA', 'BART']
-    excludedWords = [w.upper() for w in excludedWords]
-    excludedWords = set(excludedWords)
-    tweetText = preprocessText(tweet.text)
-    tweetWords = tweetText.split()
-    numExcluded = sum(1 for w in tweetWords if w in excludedWords)
-    if numExcluded > 0:
+    excluded = hotCarData.get('excluded')
+    if excluded is None:
+        excluded = getHotCarDataFromText(tweet.text)['excluded']
+    if excluded:
         return False
 
     # The tweet is good!
-    return True   
\ No newline at end of file
+    return True   
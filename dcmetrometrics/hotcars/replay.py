@@ -0,0 +1,243 @@
+"""
+hotcars.replay
+
+Replay recorded or synthetic tweets through hotCars.tick, without
+Twitter or Wunderground.
+
+ReplayTwitterAPI stands in for the python-twitter Api. It answers searches,
+mentions, timelines and oEmbed requests from a list of tweets in the
+Twitter JSON format, and records the tweets posted by the app.
+HotCarReplay installs it, together with a stub weather provider, in place of
+the real APIs and runs ticks against the configured database, recording
+the time and database operations of each phase of the tick.
+
+See utils/replay_hotcars.py to run a replay from the command line.
+"""
+
+import re
+import json
+import time
+import random
+import calendar
+from datetime import datetime
+
+import gevent
+from twitter import Status, TwitterError
+
+from . import twitter_api, twitter_fetch, weather
+from .process_tweets import CAR_RANGES, COLOR_TO_WORDS
+from ..common import instrumentation
+from ..common.instrumentation import PhaseRecorder, MongoOpCounters
+
+ME = 'MetroHotCars'
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+def _words(text):
+  return set(_WORD_RE.findall(text.lower()))
+
+def _created_at(t):
+  """
+  Format a naive UTC datetime as a Twitter created_at string.
+  """
+  return t.strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+def load_tweet_dicts(path):
+  """
+  Load tweets in the Twitter JSON format from a file holding a JSON list.
+  """
+  with open(path) as fin:
+    return json.load(fin)
+
+def make_status(d):
+  """
+  Make a python-twitter Status from a tweet in the Twitter JSON format.
+  """
+  d = dict(d)
+  entities = dict(d.get('entities') or {})
+  entities.setdefault('user_mentions', [])
+  entities.setdefault('hashtags', [])
+  entities.setdefault('urls', [])
+  d['entities'] = entities
+  return Status.NewFromJsonDict(d)
+
+class ReplayTwitterAPI(object):
+  """
+  Stand-in for the python-twitter Api which serves a list of tweets.
+
+  honor_count: If True, limit the number of tweets returned by each call to the
+    count argument, as Twitter does. If False, return every matching tweet, so
+    that large synthetic loads reach the tick.
+  latency: Seconds each call sleeps (cooperatively), to simulate the network.
+  """
+
+  def __init__(self, tweets = None, honor_count = False, latency = 0.0):
+    self.tweets = []
+    self.honor_count = honor_count
+    self.latency = latency
+    self.posted = []
+    self.calls = []
+    self._by_id = {}
+    if tweets:
+      self.add_tweets(tweets)
+
+  def add_tweets(self, tweets):
+    """
+    Add tweets, given as Status objects or Twitter JSON dictionaries.
+    """
+    for t in tweets:
+      if isinstance(t, dict):
+        t = make_status(t)
+      self.tweets.append(t)
+      self._by_id[t.id] = t
+    self.tweets.sort(key = lambda t: t.id, reverse = True)
+
+  def _call(self, name):
+    self.calls.append(name)
+    if self.latency:
+      gevent.sleep(self.latency)
+
+  def _select(self, match, since_id = None, count = None):
+    ret = [t for t in self.tweets if (not since_id or t.id > since_id) and match(t)]
+    if self.honor_count and count:
+      ret = ret[:count]
+    return ret
+
+  def GetSearch(self, term = None, count = 15, since_id = None, **kwargs):
+    self._call('search')
+    term_words = _words(term)
+    return self._select(lambda t: term_words <= _words(t.text), since_id, count)
+
+  def GetMentions(self, count = 20, since_id = None, **kwargs):
+    self._call('mentions')
+    me = ME.upper()
+    def mentionsMe(t):
+      return any(u.screen_name.upper() == me for u in (t.user_mentions or []))
+    return self._select(mentionsMe, since_id, count)
+
+  def GetUserTimeline(self, screen_name = None, since_id = None, count = 20, **kwargs):
+    self._call('user_timeline')
+    screen_name = screen_name.upper()
+    return self._select(lambda t: t.user.screen_name.upper() == screen_name, since_id, count)
+
+  def GetStatusOembed(self, id = None, **kwargs):
+    self._call('oembed')
+    t = self._by_id.get(id)
+    if t is None:
+      raise TwitterError('No status found with that ID.')
+    return {'html' : '<blockquote class="twitter-tweet"><p>%s</p>&mdash; @%s</blockquote>'%\
+            (t.text, t.user.screen_name)}
+
+  def PostUpdate(self, status, in_reply_to_status_id = None, **kwargs):
+    self._call('post')
+    self.posted.append((in_reply_to_status_id, status))
+
+def synthetic_tweet_dicts(n, start_id = 1, start_time = None, num_users = 500, seed = 0):
+  """
+  Generate n tweets in the Twitter JSON format, with a mix of valid hot car
+  reports, reports by mention, retweets, and invalid reports.
+  """
+  rand = random.Random(seed)
+  start_time = start_time or datetime.utcnow()
+  start_secs = calendar.timegm(start_time.utctimetuple())
+  ranges = sorted(CAR_RANGES.values())
+  colors = sorted(COLOR_TO_WORDS)
+
+  def car():
+    lo, hi = rand.choice(ranges)
+    return rand.randint(lo, hi)
+
+  ret = []
+  for i in range(n):
+    user_id = rand.randint(1, num_users)
+    mentions = []
+    r = rand.random()
+    if r < 0.70:
+      text = '#wmata #hotcar car %i on the %s line'%(car(), rand.choice(colors).lower())
+    elif r < 0.80:
+      text = '@%s car %i is a hot car'%(ME, car())
+      mentions = [{'id' : 1, 'screen_name' : ME}]
+    elif r < 0.90:
+      text = 'RT @rider%i: #wmata #hotcar car %i'%(rand.randint(1, num_users), car())
+    elif r < 0.95:
+      text = '#wmata #hotcar car %i'%rand.randint(8000, 9999)
+    else:
+      text = '#wmata #hotcar cars %i and %i'%(car(), car())
+
+    created = datetime.utcfromtimestamp(start_secs + i)
+    ret.append({'id' : start_id + i,
+                'text' : text,
+                'created_at' : _created_at(created),
+                'user' : {'id' : user_id, 'screen_name' : 'rider%i'%user_id},
+                'entities' : {'user_mentions' : mentions, 'hashtags' : [], 'urls' : []}})
+  return ret
+
+class HotCarReplay(object):
+  """
+  Run hotCars.tick against a ReplayTwitterAPI and a stub weather provider.
+
+  db: pymongo database of the app, used to count database operations.
+    If None, only times are recorded.
+  """
+
+  def __init__(self, api, db = None, max_temp = 85.0):
+    self.api = api
+    snapshot = MongoOpCounters(db) if db is not None else None
+    self.recorder = PhaseRecorder(snapshot = snapshot)
+    self.max_temp = max_temp
+    self.tick_times = []
+    self._saved = None
+
+  def install(self):
+    """
+    Install the replay API, the stub weather provider and the phase recorder.
+    """
+    self._saved = (twitter_api.T, twitter_fetch.F, weather.B,
+      instrumentation.get_recorder())
+    no_limits = dict((k, (10**9, 1)) for k in twitter_fetch.RATE_LIMITS)
+    twitter_api.T = self.api
+    twitter_fetch.F = twitter_fetch.TwitterFetcher(self.api, rate_limits = no_limits)
+    history = weather.WeatherHistory(weather.StubProvider(default = self.max_temp))
+    weather.B = weather.TemperatureBackfill(history)
+    instrumentation.set_recorder(self.recorder)
+
+  def uninstall(self):
+    if self._saved is None:
+      return
+    twitter_api.T, twitter_fetch.F, weather.B, recorder = self._saved
+    instrumentation.set_recorder(recorder)
+    self._saved = None
+
+  def run_tick(self, tweets = ()):
+    """
+    Add tweets to the replay API and run a tick. Return the tick time in seconds.
+    """
+    from . import hotCars
+    from .models import HotCarAppState
+
+    self.api.add_tweets(tweets)
+
+    # Check mentions on every tick, instead of every 90 seconds.
+    HotCarAppState.update(lastMentionsCheckTime = None)
+
+    start = time.time()
+    hotCars.tick(tweetLive = True)
+    elapsed = time.time() - start
+
+    # Let the temperature backfill finish outside of the tick time.
+    if weather.B.greenlet is not None:
+      weather.B.greenlet.join()
+
+    self.tick_times.append(elapsed)
+    return elapsed
+
+  def format_report(self):
+    times = sorted(self.tick_times)
+    lines = []
+    if times:
+      lines.append('%i ticks: mean %.4f s, median %.4f s, max %.4f s'%\
+        (len(times), sum(times)/len(times), times[len(times)//2], times[-1]))
+    lines.append('%i tweets posted'%len(self.api.posted))
+    lines.append('')
+    lines.append(self.recorder.format_report())
+    return '\n'.join(lines)
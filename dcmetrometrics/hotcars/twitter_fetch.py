@@ -0,0 +1,221 @@
+"""
+hotcars.twitter_fetch
+
+Concurrent fetching of Twitter API calls for the HotCar app.
+
+The Twitter calls made during a HotCar tick are network bound. TwitterFetcher
+runs them in a bounded gevent pool, so that the latency of a tick is that of the
+slowest call rather than the sum of all calls. Each endpoint has its own
+rate limiter, so concurrent calls never exceed Twitter's rate limits.
+
+The HTML embedding of a tweet never changes, so oEmbed responses
+are cached on disk.
+
+The fetcher takes the Twitter API object as an argument, so that a stand-in
+with the same methods (GetSearch, GetMentions, GetUserTimeline, GetStatusOembed)
+can be used for testing.
+"""
+
+import os
+import json
+import time
+from collections import deque
+
+import gevent
+from gevent.pool import Pool
+from gevent.lock import Semaphore
+from twitter import TwitterError
+
+from ..common.utils import mkdir_p
+
+import logging
+logger = logging.getLogger('HotCarApp')
+
+POOL_SIZE = 8
+
+# Maximum number of calls per window (in seconds) for each endpoint.
+# These are the Twitter API v1.1 user auth limits per 15 minute window.
+RATE_LIMITS = {
+  'search' : (180, 900),
+  'mentions' : (15, 900),
+  'user_timeline' : (180, 900),
+  'oembed' : (180, 900)
+}
+
+class RateLimiter(object):
+  """
+  Limit the number of calls made in a sliding time window.
+  Callers wait (cooperatively, with gevent.sleep) until a call can be made.
+  """
+
+  def __init__(self, max_calls, period, clock = time.time, sleep = gevent.sleep):
+    if max_calls <= 0:
+      raise ValueError('max_calls must be positive')
+    self.max_calls = max_calls
+    self.period = period
+    self.clock = clock
+    self.sleep = sleep
+    self.call_times = deque()
+    self._lock = Semaphore()
+
+  def wait(self):
+    """
+    Wait until a call can be made without exceeding the limit, and record the call.
+    """
+    with self._lock:
+      while True:
+        now = self.clock()
+        while self.call_times and self.call_times[0] <= now - self.period:
+          self.call_times.popleft()
+        if len(self.call_times) < self.max_calls:
+          self.call_times.append(now)
+          return
+        self.sleep(self.call_times[0] + self.period - now)
+
+class OembedCache(object):
+  """
+  On disk cache of oEmbed html, with one json file per tweet.
+  """
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    mkdir_p(cache_dir)
+
+  def _path(self, tweet_id):
+    return os.path.join(self.cache_dir, '%i.json'%tweet_id)
+
+  def get(self, tweet_id):
+    """
+    Return the cached html for tweet_id, or None.
+    """
+    try:
+      with open(self._path(tweet_id)) as fin:
+        return json.load(fin)['html']
+    except (IOError, ValueError, KeyError):
+      return None
+
+  def put(self, tweet_id, html):
+    path = self._path(tweet_id)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fout:
+      json.dump({'tweet_id' : tweet_id, 'html' : html}, fout)
+    os.rename(tmp_path, path)
+
+class TwitterFetcher(object):
+  """
+  Make Twitter API calls concurrently with a gevent pool.
+
+  api: a python-twitter Api, or a stand-in with the same methods.
+  cache_dir: directory for the oEmbed cache. If None, responses are only
+    cached in memory.
+  """
+
+  def __init__(self, api, pool_size = POOL_SIZE, cache_dir = None, rate_limits = None):
+    self.api = api
+    self.pool = Pool(pool_size)
+    limits = dict(RATE_LIMITS)
+    limits.update(rate_limits or {})
+    self.limiters = dict((endpoint, RateLimiter(*limit)) for endpoint, limit in limits.iteritems())
+    self.cache = OembedCache(cache_dir) if cache_dir else None
+    self._oembed_html = {}
+
+  def call(self, endpoint, func, *args, **kwargs):
+    """
+    Call func after waiting on the rate limiter for endpoint.
+    """
+    limiter = self.limiters.get(endpoint)
+    if limiter is not None:
+      limiter.wait()
+    return func(*args, **kwargs)
+
+  def spawn(self, endpoint, func, *args, **kwargs):
+    """
+    Spawn a rate limited call in the pool. Return the greenlet.
+    """
+    return self.pool.spawn(self.call, endpoint, func, *args, **kwargs)
+
+  def spawn_task(self, func, *args, **kwargs):
+    """
+    Spawn a function which makes its own calls through the fetcher.
+    The task does not take a slot in the pool, so the calls it makes
+    cannot be starved by it.
+    """
+    return gevent.spawn(func, *args, **kwargs)
+
+  def search(self, queries, **kwargs):
+    """
+    Run the search queries concurrently. Return a list
+    with the results of each query, in the order of the queries.
+    """
+    jobs = [self.spawn('search', self.api.GetSearch, q, **kwargs) for q in queries]
+    gevent.joinall(jobs, raise_error = True)
+    return [job.value for job in jobs]
+
+  def _fetch_oembed(self, tweet_id):
+    try:
+      embedding = self.call('oembed', self.api.GetStatusOembed, tweet_id,
+        hide_thread = False, omit_script = True, align = 'left')
+    except TwitterError as e:
+      # This may fail if the user immediately deleted the tweet.
+      logger.error('Tweet Id: %i\nCaught Twitter error when trying to get Status Oembed: %s'%(tweet_id, str(e)))
+      return None
+    html = embedding['html']
+    self._oembed_html[tweet_id] = html
+    if self.cache is not None:
+      self.cache.put(tweet_id, html)
+    return html
+
+  def _cached_oembed(self, tweet_id):
+    html = self._oembed_html.get(tweet_id)
+    if html is None and self.cache is not None:
+      html = self.cache.get(tweet_id)
+      if html is not None:
+        self._oembed_html[tweet_id] = html
+    return html
+
+  def prefetch_oembed(self, tweet_ids):
+    """
+    Fetch the oEmbed html for any of tweet_ids which are not cached, concurrently.
+    Return a dictionary of tweet id to html. Tweets whose html could not be
+    fetched are omitted.
+    """
+    ret = {}
+    missing = []
+    for tweet_id in set(tweet_ids):
+      html = self._cached_oembed(tweet_id)
+      if html is None:
+        missing.append(tweet_id)
+      else:
+        ret[tweet_id] = html
+
+    jobs = [(tweet_id, self.pool.spawn(self._fetch_oembed, tweet_id)) for tweet_id in missing]
+    gevent.joinall([job for tweet_id, job in jobs], raise_error = True)
+    for tweet_id, job in jobs:
+      if job.value is not None:
+        ret[tweet_id] = job.value
+
+    return ret
+
+  def get_oembed_html(self, tweet_id):
+    """
+    Return the oEmbed html for tweet_id, fetching it if it is not cached.
+    Return None if it cannot be fetched.
+    """
+    html = self._cached_oembed(tweet_id)
+    if html is None:
+      html = self._fetch_oembed(tweet_id)
+    return html
+
+
+F = None
+def getTwitterFetcher():
+  """
+  Return the TwitterFetcher for the HotCar Twitter API.
+  """
+  global F
+
+  if F is None:
+    from .twitter_api import getTwitterAPI
+    from ..common.globals import DATA_DIR
+    F = TwitterFetcher(getTwitterAPI(), cache_dir = os.path.join(DATA_DIR, 'oembed_cache'))
+  return F
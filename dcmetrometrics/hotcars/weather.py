@@ -0,0 +1,254 @@
+"""
+hotcars.weather
+
+Daily weather history for the HotCar app.
+
+Daily maximum temperatures come from a WeatherProvider. WundergroundProvider
+queries the Wunderground API, and StubProvider returns fixed temperatures
+for testing. WeatherHistory puts a persistent cache, keyed by (zip, date), and
+a token bucket rate limiter in front of the provider.
+
+TemperatureBackfill fetches the days missing from the temperatures collection
+in a background greenlet, so that a gap of several weeks does not block the
+HotCar tick.
+"""
+
+import os
+import json
+import time
+from datetime import date
+
+import gevent
+from gevent.pool import Pool
+from gevent.lock import Semaphore
+
+from ..common.utils import mkdir_p
+
+import logging
+logger = logging.getLogger('HotCarApp')
+
+ZIP_CODE = '20009'
+
+class TokenBucket(object):
+  """
+  Token bucket rate limiter. Tokens are added at rate per second, up to capacity.
+  Callers wait (cooperatively, with gevent.sleep) until a token is available.
+  """
+
+  def __init__(self, rate, capacity, clock = time.time, sleep = gevent.sleep):
+    if rate <= 0 or capacity < 1:
+      raise ValueError('rate must be positive and capacity must be at least 1')
+    self.rate = float(rate)
+    self.capacity = float(capacity)
+    self.clock = clock
+    self.sleep = sleep
+    self.tokens = self.capacity
+    self.last = clock()
+    self._lock = Semaphore()
+
+  def _refill(self):
+    now = self.clock()
+    self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+    self.last = now
+
+  def acquire(self, block = True):
+    """
+    Take a token. If block is False, return False instead of waiting
+    when no token is available.
+    """
+    with self._lock:
+      self._refill()
+      while self.tokens < 1.0:
+        if not block:
+          return False
+        self.sleep((1.0 - self.tokens)/self.rate)
+        self._refill()
+      self.tokens -= 1.0
+      return True
+
+class WeatherProvider(object):
+  """
+  Interface for a source of daily weather history.
+  """
+
+  def get_max_temp(self, day, zipcode):
+    """
+    Return the maximum temperature (F) on the date day for zipcode, or
+    None if it is not available.
+    """
+    raise NotImplementedError
+
+class WundergroundProvider(WeatherProvider):
+  """
+  Daily weather history from the Wunderground API.
+  """
+
+  def __init__(self, api):
+    self.api = api
+
+  def get_max_temp(self, day, zipcode):
+    rec = self.api.getHistory(day, zipcode)
+    if not rec:
+      # The API key has not been set.
+      return None
+    return float(rec['dailysummary'][0]['maxtempi'])
+
+class StubProvider(WeatherProvider):
+  """
+  Weather provider for testing, with temperatures from a dictionary
+  of (zipcode, date) to temperature. Missing days have temperature default.
+  """
+
+  def __init__(self, temps = None, default = None):
+    self.temps = dict(temps or {})
+    self.default = default
+    self.calls = []
+
+  def get_max_temp(self, day, zipcode):
+    self.calls.append((zipcode, day))
+    return self.temps.get((zipcode, day), self.default)
+
+class WeatherCache(object):
+  """
+  Persistent cache of daily maximum temperatures, keyed by (zipcode, date).
+  The temperatures for each zipcode are stored in a json file in cache_dir.
+  """
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    mkdir_p(cache_dir)
+    self._data = {}
+
+  def _path(self, zipcode):
+    return os.path.join(self.cache_dir, 'max_temps_%s.json'%zipcode)
+
+  def _load(self, zipcode):
+    data = self._data.get(zipcode)
+    if data is None:
+      try:
+        with open(self._path(zipcode)) as fin:
+          data = json.load(fin)
+      except (IOError, ValueError):
+        data = {}
+      self._data[zipcode] = data
+    return data
+
+  def get(self, zipcode, day):
+    return self._load(zipcode).get(day.isoformat())
+
+  def put(self, zipcode, day, max_temp):
+    data = self._load(zipcode)
+    data[day.isoformat()] = max_temp
+    path = self._path(zipcode)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fout:
+      json.dump(data, fout, indent = 0, sort_keys = True)
+    os.rename(tmp_path, path)
+
+class WeatherHistory(object):
+  """
+  Daily maximum temperatures from a provider, through a cache and a rate limiter.
+
+  provider: a WeatherProvider
+  cache: a WeatherCache, or None
+  limiter: a TokenBucket, or None
+  """
+
+  def __init__(self, provider, cache = None, limiter = None):
+    self.provider = provider
+    self.cache = cache
+    self.limiter = limiter
+
+  def get_max_temp(self, day, zipcode = ZIP_CODE, today = None):
+    """
+    Return the maximum temperature on day for zipcode, or None.
+    Temperatures for days before today are final, and are cached.
+    """
+    if self.cache is not None:
+      max_temp = self.cache.get(zipcode, day)
+      if max_temp is not None:
+        return max_temp
+
+    if self.limiter is not None:
+      self.limiter.acquire()
+
+    max_temp = self.provider.get_max_temp(day, zipcode)
+
+    today = today or date.today()
+    if max_temp is not None and self.cache is not None and day < today:
+      self.cache.put(zipcode, day, max_temp)
+
+    return max_temp
+
+class TemperatureBackfill(object):
+  """
+  Fetch the temperatures missing from the temperatures collection
+  and save them, in a background greenlet.
+  """
+
+  def __init__(self, history, zipcode = ZIP_CODE, concurrency = 4):
+    self.history = history
+    self.zipcode = zipcode
+    self.concurrency = concurrency
+    self.greenlet = None
+
+  def _fetch_and_save(self, day, today):
+    from .models import Temperature
+    try:
+      max_temp = self.history.get_max_temp(day, self.zipcode, today = today)
+    except Exception as e:
+      logger.error('Caught exception when getting the temperature for %s: %s'%(day, str(e)))
+      return
+    if max_temp is not None:
+      Temperature.add(day, max_temp)
+
+  def run(self, today = None):
+    """
+    Fetch and save the missing temperatures. Return the number of days fetched.
+    """
+    from .models import Temperature
+    today = today or date.today()
+    days = Temperature.missing_days(today)
+    if not days:
+      return 0
+    logger.info('Backfilling temperatures for %i days'%len(days))
+    pool = Pool(self.concurrency)
+    for day in days:
+      pool.spawn(self._fetch_and_save, day, today)
+    pool.join()
+    return len(days)
+
+  def start(self, today = None):
+    """
+    Start the backfill in a greenlet, unless one is already running.
+    Return the greenlet.
+    """
+    if self.greenlet is None or self.greenlet.ready():
+      self.greenlet = gevent.spawn(self.run, today)
+    return self.greenlet
+
+
+B = None
+def getTemperatureBackfill():
+  """
+  Return the TemperatureBackfill for the Wunderground API, or None if there
+  is no Wunderground API key.
+  """
+  global B
+
+  if B is None:
+    from .wundergroundAPI import WundergroundAPI
+    from ..common.globals import DATA_DIR
+    try:
+      # Import may fail if keys/keys.py has not been created.
+      from ..keys import WUNDERGROUND_API_KEY
+    except Exception:
+      WUNDERGROUND_API_KEY = None
+    if not WUNDERGROUND_API_KEY:
+      logger.debug('No Wunderground API key. Not fetching temperatures.')
+      return None
+    provider = WundergroundProvider(WundergroundAPI(WUNDERGROUND_API_KEY))
+    cache = WeatherCache(os.path.join(DATA_DIR, 'weather_cache'))
+    history = WeatherHistory(provider, cache, TokenBucket(rate = 10/60.0, capacity = 10))
+    B = TemperatureBackfill(history)
+  return B
@@ -25,6 +25,7 @@ from gevent import Greenlet
 # custom imports
 from dcmetrometrics.common.globals import DATA_DIR, REPO_DIR, DATA_DIR
 from dcmetrometrics.common.restartingGreenlet import RestartingGreenlet
+from dcmetrometrics.common.logging_utils import rotate_file
 from dcmetrometrics.eles.ElevatorApp import ElevatorApp as App
 
 OUTPUT_DIR = DATA_DIR
@@ -63,6 +64,9 @@ class ElevatorApp(RestartingGreenlet):
 
     def tick(self):
 
+        # The log file is written directly, so rotate it when it is too large.
+        rotate_file(self.logFileName)
+
         # Run MetroElevators twitter App
         with open(self.logFileName, 'a') as logFile:
 
@@ -22,6 +22,7 @@ import gevent
 from gevent import Greenlet
 
 from dcmetrometrics.common.restartingGreenlet import RestartingGreenlet
+from dcmetrometrics.common.logging_utils import rotate_file
 from dcmetrometrics.eles.EscalatorApp import EscalatorApp as App
 from dcmetrometrics.common.globals import DATA_DIR, REPO_DIR
 
@@ -61,6 +62,9 @@ class EscalatorApp(RestartingGreenlet):
 
     def tick(self):
 
+        # The log file is written directly, so rotate it when it is too large.
+        rotate_file(self.logFileName)
+
         # Run MetroEsclaators twitter App
         with open(self.logFileName, 'a') as logFile:
 
@@ -12,61 +12,36 @@ Tweet acknowledgements are posted to the @MetroHotCars twitter account.
 if __name__ == "__main__":
     import test.setup
 
-import gevent
 import os
-import sys
 from datetime import datetime
 
-from dcmetrometrics.common.restartingGreenlet import RestartingGreenlet
-from dcmetrometrics.common import dbGlobals
+from dcmetrometrics.common.restartingGreenlet import TickingGreenlet
+from dcmetrometrics.common import dbGlobals, logging_utils
 from dcmetrometrics.hotcars import hotCars
 from dcmetrometrics.common.globals import DATA_DIR, REPO_DIR, DATA_DIR
 
 OUTPUT_DIR = DATA_DIR
 
 ###############################################################
-# Log the HotCarApp App to a file.
-import logging
-
+# Log the HotCarApp App to a rotating file, through a queue.
 LOG_FILE_NAME = os.path.join(DATA_DIR, 'HotCarApp.log')
-fh = logging.FileHandler(LOG_FILE_NAME)
-sh = logging.StreamHandler(sys.stderr)
-
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-sh.setFormatter(formatter)
-
-logger = logging.getLogger('HotCarApp')
-logger.addHandler(fh)
-logger.addHandler(sh)
+logger = logging_utils.create_queued_logger('HotCarApp', LOG_FILE_NAME)
 #################################################################
 
-class HotCarApp(RestartingGreenlet):
+class HotCarApp(TickingGreenlet):
+
+    PERIOD = 40 # Run every 40 seconds
+    logger = logger
 
     def __init__(self, LIVE=False):
 
         dbGlobals.connect()
 
-        RestartingGreenlet.__init__(self, LIVE=LIVE)
-        self.SLEEP = 40 # Run every 10 seconds
+        TickingGreenlet.__init__(self, LIVE=LIVE)
         self.LIVE = LIVE
 
-    # Run forever
-    def _run(self):
-
-        while True:
-
-            try:
-
-                hotCars.tick(tweetLive = self.LIVE)
-
-            except Exception as e:
-
-                import traceback
-                tb = traceback.format_exc()
-                logger.error("HotCarApp Caught Error! %s\nTraceback:\n%s"%(str(e), tb))
-
-            gevent.sleep(self.SLEEP)
+    def tick(self):
+        hotCars.tick(tweetLive = self.LIVE)
 
         
 
@@ -0,0 +1,78 @@
+import unittest
+import setup
+
+from datetime import datetime
+
+from pandas import DataFrame, Series, DatetimeIndex, to_datetime
+
+from dcmetrometrics.hotcars.analytics import (service_days, daily_counts,
+  temperature_correlation, repeat_offenders, summarize_reports)
+
+# car_number, color, time (UTC), user_id
+REPORTS = [(1000, 'RED', datetime(2014, 7, 1, 16), 1),
+           (1000, 'RED', datetime(2014, 7, 1, 18), 2),
+           (5000, 'BLUE', datetime(2014, 7, 3, 17), 1),
+           (1000, None, datetime(2014, 7, 3, 19), 1),
+           (7000, 'GREEN', datetime(2014, 7, 3, 20), 2),
+           # 3 AM on Saturday in Washington, before Metro opens: Friday's service day.
+           (5000, 'ORANGE', datetime(2014, 7, 5, 7), 3)]
+
+def make_frame(reports):
+  df = DataFrame(reports, columns = ['car_number', 'color', 'time', 'user_id'])
+  df['time'] = to_datetime(df['time'])
+  df['service_day'] = service_days(df['time'])
+  return df
+
+class TestAnalytics(unittest.TestCase):
+
+  def setUp(self):
+    self.df = make_frame(REPORTS)
+    # The maximum temperature rises with the number of reports.
+    self.temps = Series([80.0, 70.0, 85.0, 75.0],
+                        index = DatetimeIndex(['2014-07-01', '2014-07-02', '2014-07-03', '2014-07-04']))
+
+  def test_daily_counts(self):
+    counts = daily_counts(self.df)
+    self.assertEqual([d.date() for d in counts.index],
+                     [datetime(2014, 7, d).date() for d in range(1, 5)])
+    self.assertEqual(list(counts), [2, 0, 3, 1])
+
+  def test_temperature_correlation(self):
+    counts = daily_counts(self.df)
+    self.assertAlmostEqual(temperature_correlation(counts, self.temps), 1.0)
+    self.assertIsNone(temperature_correlation(counts, self.temps[:1]))
+
+  def test_repeat_offenders(self):
+    self.assertEqual(repeat_offenders(self.df),
+      [{'car_number' : 1000, 'num_reports' : 3, 'num_reporters' : 2,
+        'last_report_time' : datetime(2014, 7, 3, 19)},
+       {'car_number' : 5000, 'num_reports' : 2, 'num_reporters' : 2,
+        'last_report_time' : datetime(2014, 7, 5, 7)}])
+    self.assertEqual(len(repeat_offenders(self.df, limit = 1)), 1)
+
+  def test_summarize_reports(self):
+    summary = summarize_reports(self.df, self.temps)
+    self.assertEqual(summary['num_reports'], 6)
+    self.assertEqual(summary['num_cars'], 3)
+    self.assertEqual(summary['num_reporters'], 3)
+    self.assertEqual(summary['first_report_time'], datetime(2014, 7, 1, 16))
+    self.assertEqual(summary['last_report_time'], datetime(2014, 7, 5, 7))
+    self.assertAlmostEqual(summary['reports_per_day'], 6/3.625)
+    self.assertAlmostEqual(summary['reports_per_weekday'], 1.5)
+    self.assertEqual(summary['reports_by_weekday'],
+                     {'Monday' : 0, 'Tuesday' : 2, 'Wednesday' : 0, 'Thursday' : 3,
+                      'Friday' : 1, 'Saturday' : 0, 'Sunday' : 0})
+    self.assertEqual(summary['max_reports_in_day'], 3)
+    self.assertEqual(summary['days_with_reports'], 3)
+    self.assertEqual(summary['series_counts'], {'1' : 3, '5' : 2, '7' : 1})
+    self.assertEqual(summary['color_counts'],
+                     {'RED' : 2, 'BLUE' : 1, 'GREEN' : 1, 'ORANGE' : 1, 'NONE' : 1})
+    self.assertEqual([c['car_number'] for c in summary['repeat_offenders']], [1000, 5000])
+    self.assertAlmostEqual(summary['temperature_correlation'], 1.0)
+
+  def test_summarize_no_reports(self):
+    self.assertEqual(summarize_reports(make_frame([]), self.temps), {'num_reports' : 0})
+
+
+if __name__ == '__main__':
+  unittest.main()
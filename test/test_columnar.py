@@ -0,0 +1,47 @@
+import unittest
+import setup
+
+import shutil
+import tempfile
+import os
+from datetime import datetime
+
+import numpy as np
+
+from dcmetrometrics.common.columnar import (ColumnarTableWriter, load_table, load_table_frame,
+  TIME, FLOAT, CATEGORY, MISSING_TIME)
+
+class TestColumnarTable(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'unit_statuses')
+
+    columns = [('unit_id', CATEGORY), ('time', TIME), ('end_time', TIME),
+               ('metro_open_time', FLOAT)]
+    writer = ColumnarTableWriter(columns)
+    writer.append({'unit_id' : 'A01E01ESCALATOR', 'time' : datetime(2015, 2, 16, 22),
+                   'end_time' : datetime(2015, 2, 17, 3), 'metro_open_time' : 7200.0})
+    writer.append({'unit_id' : 'A01E02ESCALATOR', 'time' : datetime(2015, 2, 17, 3)})
+    writer.append({'unit_id' : 'A01E01ESCALATOR', 'time' : datetime(2015, 2, 17, 3)})
+    writer.save(self.path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_load_table(self):
+    meta, arrays = load_table(self.path)
+    self.assertEqual(meta['num_rows'], 3)
+    self.assertEqual(list(arrays['unit_id']), [0, 1, 0])
+    self.assertEqual(arrays['time'][0], 1424124000)
+    self.assertEqual(arrays['end_time'][1], MISSING_TIME)
+    self.assertTrue(np.isnan(arrays['metro_open_time'][2]))
+
+  def test_load_table_frame(self):
+    df = load_table_frame(self.path)
+    self.assertEqual(list(df['unit_id']), ['A01E01ESCALATOR', 'A01E02ESCALATOR', 'A01E01ESCALATOR'])
+    self.assertEqual(df['end_time'].isnull().sum(), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import setup
+
+import os
+
+from dcmetrometrics.common import dbGlobals
+
+class TestDBGlobals(unittest.TestCase):
+
+  def test_shared_client(self):
+    from mongoengine.connection import get_db
+    dbGlobals.connect()
+    client = dbGlobals.getClient()
+    dbGlobals.connect()
+    self.assertTrue(dbGlobals.getClient() is client)
+    self.assertTrue(dbGlobals.getDB().connection is client)
+    self.assertTrue(get_db() is dbGlobals.getDB())
+
+  def test_forked_process_reconnects(self):
+    client = dbGlobals.getClient()
+    # Pretend the connection was inherited from a parent process.
+    dbGlobals._pid = os.getpid() + 1
+    self.assertFalse(dbGlobals.getClient() is client)
+    self.assertEqual(dbGlobals._pid, os.getpid())
+
+  def test_forked_process_resets_collections(self):
+    from dcmetrometrics.eles.models import EscalatorAppState
+    dbGlobals.connect()
+    collection = EscalatorAppState._get_collection()
+    self.assertTrue(collection.database.connection is dbGlobals.getClient())
+    dbGlobals._pid = os.getpid() + 1
+    dbGlobals.connect()
+    collection = EscalatorAppState._get_collection()
+    self.assertTrue(collection.database.connection is dbGlobals.getClient())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import setup
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from dcmetrometrics.common.metroTimes import tzutc
+from dcmetrometrics.eles.replay import (SyntheticIncidents, VirtualClock,
+  load_snapshot, save_snapshot, iter_snapshots)
+
+class TestSnapshots(unittest.TestCase):
+
+  def setUp(self):
+    self.snapshot_dir = tempfile.mkdtemp()
+    self.start = datetime(2015, 7, 10, 12, tzinfo = tzutc)
+
+  def tearDown(self):
+    shutil.rmtree(self.snapshot_dir)
+
+  def test_synthetic(self):
+    gen1 = SyntheticIncidents(num_units = 200, seed = 1, p_out = 0.05, p_fix = 0.1)
+    gen2 = SyntheticIncidents(num_units = 200, seed = 1, p_out = 0.05, p_fix = 0.1)
+    clock = VirtualClock(self.start)
+    for i in range(20):
+      s1 = gen1.next_snapshot(clock())
+      s2 = gen2.next_snapshot(clock())
+      self.assertEqual(s1, s2)
+      unit_names = [inc['UnitName'] for inc in s1]
+      self.assertEqual(len(unit_names), len(set(unit_names)))
+      clock.advance(30)
+    self.assertEqual(clock(), datetime(2015, 7, 10, 12, 10, tzinfo = tzutc))
+
+  def test_save_load(self):
+    gen = SyntheticIncidents(num_units = 50, seed = 2, p_out = 0.2, p_fix = 0.1)
+    saved = []
+    for i in range(3):
+      incidents = gen.next_snapshot(self.start)
+      saved.append((self.start, incidents))
+      save_snapshot(os.path.join(self.snapshot_dir, 'snapshot_%02i.json'%i), incidents, self.start)
+    self.assertEqual(list(iter_snapshots(self.snapshot_dir)), saved)
+
+    path = os.path.join(self.snapshot_dir, 'snapshot_00.json')
+    request_time, incidents = load_snapshot(path)
+    self.assertEqual(request_time, self.start)
+
+
+if __name__ == '__main__':
+  unittest.main()
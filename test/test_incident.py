@@ -0,0 +1,44 @@
+import unittest
+import setup
+
+from dcmetrometrics.common.metroTimes import parse_iso_time, parse_wmata_time
+from dcmetrometrics.eles.Incident import Incident
+
+DATA = {u'SymptomDescription' : u'MINOR REPAIR',
+        u'LocationDescription' : u'Escalator between street and mezzanine',
+        u'UnitName' : u'A03N04',
+        u'UnitType' : u'ESCALATOR',
+        u'SymptomCode' : None,
+        u'TimeOutOfService' : u'0959',
+        u'DateOutOfServ' : u'2014-08-10T09:59:55',
+        u'StationName' : u'Dupont Circle, North Entrance',
+        u'StationCode' : u'A03',
+        u'DateUpdated' : u'2014-08-10T11:02:13',
+        u'UnitStatus' : None,
+        u'DisplayOrder' : 0}
+
+class TestIncident(unittest.TestCase):
+
+  def test_parse_wmata_time(self):
+    for s in ['2014-08-10T09:59:55', '2014-08-10T09:59:55.250', '2014-08-10 09:59']:
+      self.assertEqual(parse_wmata_time(s), parse_iso_time(s))
+
+  def test_from_payload(self):
+    data2 = dict(DATA, UnitName = u'A03N05', DateUpdated = None)
+    incidents = Incident.from_payload([DATA, data2])
+    self.assertEqual(sorted(incidents), [u'A03N04ESCALATOR', u'A03N05ESCALATOR'])
+
+    inc = incidents[u'A03N04ESCALATOR']
+    self.assertEqual(inc.StationName, u'Dupont Circle')
+    self.assertEqual(inc.StationDesc, u'North Entrance')
+    self.assertEqual(inc.TimeOutOfService, u'0959')
+    self.assertEqual(inc.DateOutOfServ, parse_iso_time(DATA['DateOutOfServ']))
+    self.assertEqual(inc['DateUpdated'], parse_iso_time(DATA['DateUpdated']))
+    self.assertTrue(inc.isBroken())
+    self.assertRaises(AttributeError, getattr, inc, 'Missing')
+
+    self.assertIsNone(incidents[u'A03N05ESCALATOR'].DateUpdated)
+
+
+if __name__ == '__main__':
+  unittest.main()
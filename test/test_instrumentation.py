@@ -0,0 +1,68 @@
+import unittest
+import setup
+
+import struct
+
+from dcmetrometrics.common.instrumentation import (MetricsRegistry, REGISTRY, timer, counter,
+  app_tick, phase, count, parse_wire_message)
+
+def query_message(namespace, doc):
+  body = struct.pack('<i', 0) + namespace + '\x00' + struct.pack('<ii', 0, -1) + doc
+  return struct.pack('<iiii', 16 + len(body), 1, 0, 2004) + body
+
+def bson_string_doc(key, value):
+  elem = '\x02' + key + '\x00' + struct.pack('<i', len(value) + 1) + value + '\x00'
+  return struct.pack('<i', 4 + len(elem) + 1) + elem + '\x00'
+
+class TestInstrumentation(unittest.TestCase):
+
+  def setUp(self):
+    REGISTRY.reset()
+
+  def test_timers_and_counters(self):
+    registry = MetricsRegistry()
+
+    @timer('work', registry = registry, kind = 'a')
+    @counter('calls', registry = registry)
+    def work(fail = False):
+      if fail:
+        raise ValueError()
+
+    work()
+    self.assertRaises(ValueError, work, True)
+    with timer('work', registry = registry, kind = 'b'):
+      pass
+
+    snapshot = registry.snapshot()
+    self.assertEqual(snapshot['counters'], {'calls' : 2, 'calls_errors' : 1})
+    self.assertEqual(snapshot['timers']['work{kind=a}']['count'], 2)
+
+    text = registry.to_prometheus()
+    self.assertIn('# TYPE dcmetrometrics_calls_total counter\n', text)
+    self.assertIn('dcmetrometrics_work_seconds_count{kind="a"} 2\n', text)
+    self.assertIn('# TYPE dcmetrometrics_work_seconds_max gauge\n', text)
+
+  def test_app_tick(self):
+
+    @app_tick('eles')
+    def tick():
+      with phase('process'):
+        count('changed_units', 3)
+
+    tick()
+    tick()
+    snapshot = REGISTRY.snapshot()
+    self.assertEqual(snapshot['counters'], {'changed_units{app=eles}' : 6})
+    self.assertEqual(snapshot['timers']['tick{app=eles}']['count'], 2)
+    self.assertEqual(snapshot['timers']['phase{app=eles,phase=process}']['count'], 2)
+
+  def test_parse_wire_message(self):
+    self.assertEqual(parse_wire_message(query_message('MetroEscalators.units', bson_string_doc('unit_id', 'A'))),
+                     ('query', 'units'))
+    self.assertEqual(parse_wire_message(query_message('MetroEscalators.$cmd', bson_string_doc('count', 'units'))),
+                     ('command', 'units'))
+    self.assertEqual(parse_wire_message('bad'), ('unknown', ''))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import setup
+
+import os
+import gzip
+import shutil
+import logging
+import tempfile
+
+from dcmetrometrics.common.logging_utils import (RateLimitFilter, CompressingRotatingFileHandler,
+  create_queued_logger, rotate_file)
+
+def make_record(name, level, msg):
+  return logging.LogRecord(name, level, __file__, 0, msg, None, None)
+
+class TestLoggingUtils(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_rate_limit(self):
+    now = [0.0]
+    f = RateLimitFilter(rate = 1, burst = 2, clock = lambda: now[0])
+    passed = [f.filter(make_record('a', logging.INFO, 'm')) for i in range(4)]
+    self.assertEqual(passed, [True, True, False, False])
+
+    # Other loggers and warnings are not limited.
+    self.assertTrue(f.filter(make_record('b', logging.INFO, 'm')))
+    self.assertTrue(f.filter(make_record('a', logging.WARNING, 'm')))
+
+    now[0] = 1.0
+    record = make_record('a', logging.INFO, 'm')
+    self.assertTrue(f.filter(record))
+    self.assertEqual(record.getMessage(), 'm (2 messages dropped by the rate limit)')
+
+  def test_compressed_rotation(self):
+    fname = os.path.join(self.dir, 'app.log')
+    h = CompressingRotatingFileHandler(fname, maxBytes = 50, backupCount = 2)
+    h.setFormatter(logging.Formatter('%(message)s'))
+    for i in range(4):
+      h.emit(make_record('a', logging.INFO, str(i)*40))
+    h.close()
+    self.assertEqual(sorted(os.listdir(self.dir)), ['app.log', 'app.log.1.gz', 'app.log.2.gz'])
+    self.assertEqual(gzip.open(fname + '.1.gz').read(), '2'*40 + '\n')
+
+  def test_rotate_file(self):
+    fname = os.path.join(self.dir, 'plain.log')
+    with open(fname, 'w') as fout:
+      fout.write('x'*10)
+    self.assertFalse(rotate_file(fname, max_bytes = 20))
+    self.assertTrue(rotate_file(fname, max_bytes = 10))
+    self.assertEqual(os.listdir(self.dir), ['plain.log.1.gz'])
+    self.assertEqual(gzip.open(fname + '.1.gz').read(), 'x'*10)
+    self.assertFalse(rotate_file(fname, max_bytes = 10))
+
+  def test_queued_logger(self):
+    fname = os.path.join(self.dir, 'queued.log')
+    logger = create_queued_logger('test_queued', fname, stream = None)
+    logger.info('hello %s', 'world')
+    logger.handlers[0].listener.stop()
+    with open(fname) as fin:
+      self.assertTrue(fin.read().strip().endswith('INFO - hello world'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+import setup
+
+from dcmetrometrics.common.memory import MemoryBudget, type_growth, MB
+
+class TestMemoryBudget(unittest.TestCase):
+
+  def test_collects_only_over_budget(self):
+    sizes = [100*MB, 300*MB, 150*MB, 300*MB, 290*MB, 320*MB, 400*MB, 390*MB]
+    budget = MemoryBudget(budget = 200*MB, step = 64*MB, report_checks = 0,
+                          get_rss = lambda: sizes.pop(0))
+
+    self.assertEqual(budget.check(), None)
+    self.assertNotEqual(budget.check(), None)
+    self.assertEqual(budget.collections, 1)
+    self.assertEqual(budget.limit, 200*MB)
+
+    # The collection does not help, so the limit is raised above the current size.
+    budget.check()
+    self.assertEqual(budget.collections, 2)
+    self.assertEqual(budget.limit, 354*MB)
+    self.assertEqual(budget.check(), None)
+    budget.check()
+    self.assertEqual(budget.collections, 3)
+    self.assertEqual(budget.limit, 454*MB)
+
+  def test_type_growth(self):
+    before = {'dict' : 10, 'Unit' : 5, 'list' : 3}
+    after = {'dict' : 12, 'Unit' : 50, 'list' : 1, 'UnitStatus' : 4}
+    self.assertEqual(type_growth(before, after),
+                     [('Unit', 50, 45), ('UnitStatus', 4, 4), ('dict', 12, 2)])
+
+
+if __name__ == '__main__':
+  unittest.main()
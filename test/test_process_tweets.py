@@ -0,0 +1,47 @@
+import unittest
+import setup
+
+from dcmetrometrics.hotcars.process_tweets import (getHotCarDataFromText, analyzeTexts,
+  analyzeTweets, tweetIsValidReport)
+
+class FakeUser(object):
+  def __init__(self, screen_name):
+    self.screen_name = screen_name
+
+class FakeTweet(object):
+  def __init__(self, text, screen_name = 'rider'):
+    self.text = text
+    self.user = FakeUser(screen_name)
+    self.retweeted_status = None
+
+class TestProcessTweets(unittest.TestCase):
+
+  def test_hot_car_data(self):
+    hcd = getHotCarDataFromText(u'@wmata #hotcar car#1043 on the red line @rider5555')
+    self.assertEqual(hcd['cars'], [1043])
+    self.assertEqual(hcd['colors'], ['RED'])
+    self.assertFalse(hcd['excluded'])
+
+    hcd = getHotCarDataFromText(u'Silver Spring 6000 series car 6010 #hotcar bart')
+    self.assertEqual(hcd['cars'], [6010])
+    self.assertEqual(hcd['colors'], [])
+    self.assertTrue(hcd['excluded'])
+
+  def test_analyze_texts(self):
+    texts = [u'car 1043 RD', u'car 1043 RD', u'car 7001 SV']
+    self.assertEqual(analyzeTexts(texts), [getHotCarDataFromText(t) for t in texts])
+
+  def test_analyze_tweets(self):
+    tweets = [FakeTweet(u'wmata hotcar 1043'),
+              FakeTweet(u'wmata hotcar 1043 2000'),
+              FakeTweet(u'wmata hotcar 1300'),
+              FakeTweet(u'mbta hotcar 1043'),
+              FakeTweet(u'wmata hotcar 1043', screen_name = 'MetroHotCars')]
+    valid = [hcd['valid'] for t, hcd in analyzeTweets(tweets)]
+    self.assertEqual(valid, [True, False, False, False, False])
+    self.assertEqual(valid, [tweetIsValidReport(t, {'cars' : getHotCarDataFromText(t.text)['cars']}) \
+      for t in tweets])
+
+
+if __name__ == '__main__':
+  unittest.main()
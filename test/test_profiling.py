@@ -0,0 +1,50 @@
+import unittest
+import setup
+
+import os
+import shutil
+import tempfile
+
+from dcmetrometrics.common.profiling import (TickProfiler, write_collapsed, list_dumps,
+  rotate_dumps, summarize_collapsed)
+
+class TestProfiling(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_summarize_collapsed(self):
+    path = os.path.join(self.dir, 'App-1.collapsed')
+    write_collapsed({'a;b;c' : 3, 'a;b' : 1, 'a;d' : 4}, path)
+    rows, num_samples = summarize_collapsed([path])
+    self.assertEqual(num_samples, 8)
+    self.assertEqual(rows[0], ('a', 0, 8))
+    self.assertEqual(dict((f, (s, t)) for f, s, t in rows)['b'], (1, 4))
+
+  def test_rotate_dumps(self):
+    for i in range(5):
+      path = os.path.join(self.dir, 'App-%i.collapsed'%i)
+      write_collapsed({'a' : 1}, path)
+      os.utime(path, (i, i))
+    write_collapsed({'a' : 1}, os.path.join(self.dir, 'HotCarApp-0.collapsed'))
+    rotate_dumps(self.dir, 'App', 2)
+    self.assertEqual([os.path.basename(p) for p in list_dumps(self.dir, 'App')],
+                     ['App-3.collapsed', 'App-4.collapsed'])
+    self.assertEqual(len(list_dumps(self.dir)), 3)
+
+  def test_cprofile_threshold(self):
+    times = [0.0, 1.0, 10.0, 30.0]
+    profiler = TickProfiler('App', mode = 'cprofile', threshold = 15.0,
+                            dump_dir = self.dir, clock = lambda: times.pop(0))
+    self.assertEqual(profiler.run(sum, [1, 2]), 3)
+    self.assertEqual(list_dumps(self.dir), [])
+    profiler.run(sum, [1, 2])
+    self.assertEqual(list_dumps(self.dir), [profiler.lastDump])
+    self.assertTrue(profiler.lastDump.endswith('.pstats'))
+
+
+if __name__ == '__main__':
+  unittest.main()
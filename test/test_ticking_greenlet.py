@@ -0,0 +1,31 @@
+import unittest
+import setup
+
+from dcmetrometrics.common.restartingGreenlet import TickingGreenlet, restartBackoff, MAX_RESTART_BACKOFF
+
+class TestTickingGreenlet(unittest.TestCase):
+
+  def test_next_deadline(self):
+    g = TickingGreenlet()
+    g.PERIOD = 30.0
+
+    # A short tick keeps the fixed deadlines.
+    self.assertEqual(g.nextDeadline(0.0, 12.0), 30.0)
+    self.assertEqual(g.metrics.overruns, 0)
+
+    # An overrun skips the missed deadlines, and the next tick runs at once.
+    self.assertEqual(g.nextDeadline(30.0, 95.0), 90.0)
+    self.assertEqual(g.metrics.overruns, 1)
+    self.assertEqual(g.metrics.skipped, 1)
+    self.assertEqual(g.nextDeadline(90.0, 100.0), 120.0)
+
+    # The clock went back.
+    self.assertEqual(g.nextDeadline(120.0, 10.0), 40.0)
+
+  def test_restart_backoff(self):
+    self.assertEqual([restartBackoff(n) for n in range(1, 5)], [1.0, 2.0, 4.0, 8.0])
+    self.assertEqual(restartBackoff(100), MAX_RESTART_BACKOFF)
+
+
+if __name__ == '__main__':
+  unittest.main()
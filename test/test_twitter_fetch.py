@@ -0,0 +1,87 @@
+import unittest
+import setup
+
+import time
+import shutil
+import tempfile
+
+import gevent
+from twitter import TwitterError
+
+from dcmetrometrics.hotcars.twitter_fetch import TwitterFetcher, RateLimiter
+
+class FakeTwitterAPI(object):
+  """
+  Local stand-in for the python-twitter Api. Each call sleeps for delay seconds.
+  """
+
+  def __init__(self, delay = 0.1, deleted = ()):
+    self.delay = delay
+    self.deleted = set(deleted)
+    self.calls = []
+
+  def GetSearch(self, term, **kwargs):
+    self.calls.append(('search', term))
+    gevent.sleep(self.delay)
+    return [term]
+
+  def GetStatusOembed(self, id, **kwargs):
+    self.calls.append(('oembed', id))
+    gevent.sleep(self.delay)
+    if id in self.deleted:
+      raise TwitterError('No status found with that ID.')
+    return {'html' : '<blockquote>%i</blockquote>'%id}
+
+class TestTwitterFetcher(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.api = FakeTwitterAPI()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_search_is_concurrent(self):
+    fetcher = TwitterFetcher(self.api)
+    queries = ['wmata hotcar', 'wmata hot car', 'wmata hotcars', 'wmata hot cars']
+    start = time.time()
+    results = fetcher.search(queries, count = 100)
+    elapsed = time.time() - start
+    self.assertEqual(results, [[q] for q in queries])
+    self.assertTrue(elapsed < 2*self.api.delay)
+
+  def test_oembed_cache(self):
+    fetcher = TwitterFetcher(self.api, cache_dir = self.cache_dir)
+    html = fetcher.prefetch_oembed([1, 2, 3])
+    self.assertEqual(sorted(html.keys()), [1, 2, 3])
+    self.assertEqual(len(self.api.calls), 3)
+
+    # A new fetcher reads the responses from disk
+    fetcher = TwitterFetcher(self.api, cache_dir = self.cache_dir)
+    self.assertEqual(fetcher.get_oembed_html(2), html[2])
+    self.assertEqual(len(self.api.calls), 3)
+
+  def test_oembed_error(self):
+    self.api.deleted.add(4)
+    fetcher = TwitterFetcher(self.api, cache_dir = self.cache_dir)
+    self.assertEqual(fetcher.prefetch_oembed([4, 5]).keys(), [5])
+    self.assertIsNone(fetcher.get_oembed_html(4))
+
+class TestRateLimiter(unittest.TestCase):
+
+  def test_wait(self):
+    now = [0.0]
+    sleeps = []
+    def sleep(s):
+      sleeps.append(s)
+      now[0] += s
+    limiter = RateLimiter(2, 10.0, clock = lambda: now[0], sleep = sleep)
+    limiter.wait()
+    limiter.wait()
+    self.assertEqual(sleeps, [])
+    limiter.wait()
+    self.assertEqual(sleeps, [10.0])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import setup
+
+import shutil
+import tempfile
+from datetime import date
+
+from dcmetrometrics.hotcars.weather import (TokenBucket, StubProvider, WeatherCache,
+  WeatherHistory)
+
+class TestWeatherHistory(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.today = date(2015, 7, 10)
+    self.provider = StubProvider({('20009', date(2015, 7, 8)) : 91.0,
+                                  ('20009', self.today) : 85.0})
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_cache(self):
+    history = WeatherHistory(self.provider, WeatherCache(self.cache_dir))
+    self.assertEqual(history.get_max_temp(date(2015, 7, 8), today = self.today), 91.0)
+    self.assertEqual(history.get_max_temp(self.today, today = self.today), 85.0)
+    self.assertIsNone(history.get_max_temp(date(2015, 7, 9), today = self.today))
+
+    # Past days are read from the cache on disk. Today and missing days are not cached.
+    history = WeatherHistory(self.provider, WeatherCache(self.cache_dir))
+    for d in [date(2015, 7, 8), date(2015, 7, 9), self.today]:
+      history.get_max_temp(d, today = self.today)
+    self.assertEqual(self.provider.calls.count(('20009', date(2015, 7, 8))), 1)
+    self.assertEqual(self.provider.calls.count(('20009', date(2015, 7, 9))), 2)
+    self.assertEqual(self.provider.calls.count(('20009', self.today)), 2)
+
+class TestTokenBucket(unittest.TestCase):
+
+  def test_acquire(self):
+    now = [0.0]
+    sleeps = []
+    def sleep(s):
+      sleeps.append(s)
+      now[0] += s
+    bucket = TokenBucket(rate = 0.5, capacity = 2, clock = lambda: now[0], sleep = sleep)
+    self.assertTrue(bucket.acquire())
+    self.assertTrue(bucket.acquire())
+    self.assertFalse(bucket.acquire(block = False))
+    self.assertTrue(bucket.acquire())
+    self.assertEqual(sleeps, [2.0])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import setup
+
+import requests
+
+from dcmetrometrics.eles.WMATA_API import WMATA_API, WMATA_API_ERROR
+
+class FakeResponse(object):
+
+  def __init__(self, status_code, content = '', headers = None):
+    self.status_code = status_code
+    self.content = content
+    self.headers = headers or {}
+    self.url = 'http://api.wmata.com'
+
+class FakeSession(object):
+  """
+  Local stand-in for a requests Session, which returns or raises the given
+  results in order.
+  """
+
+  def __init__(self, results):
+    self.results = list(results)
+    self.requests = []
+
+  def get(self, url, params = None, timeout = None, headers = None):
+    self.requests.append(dict(headers or {}))
+    r = self.results.pop(0)
+    if isinstance(r, Exception):
+      raise r
+    return r
+
+class TestWMATA_API(unittest.TestCase):
+
+  def make_api(self, results):
+    self.sleeps = []
+    self.session = FakeSession(results)
+    return WMATA_API('key', session = self.session, max_retries = 2, sleep = self.sleeps.append)
+
+  def test_retry(self):
+    api = self.make_api([requests.ConnectionError(), FakeResponse(503), FakeResponse(200, '{}')])
+    r = api.getEscalator()
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(len(self.sleeps), 2)
+    self.assertTrue(0 <= self.sleeps[0] <= 0.5)
+    self.assertTrue(0 <= self.sleeps[1] <= 1.0)
+
+    api = self.make_api([FakeResponse(500)]*3)
+    self.assertRaises(WMATA_API_ERROR, api.getEscalator)
+
+    api = self.make_api([requests.Timeout()]*3)
+    self.assertRaises(requests.Timeout, api.getEscalator)
+
+  def test_conditional(self):
+    api = self.make_api([FakeResponse(200, '{"a": 1}', {'ETag' : '"1"'}),
+                         FakeResponse(304),
+                         FakeResponse(200, '{"a": 2}', {'ETag' : '"2"'}),
+                         FakeResponse(200, '{"a": 2}')])
+    r1 = api.getEscalator()
+    r2 = api.getEscalator()
+    self.assertIs(r1, r2)
+    self.assertEqual(self.session.requests[1]['If-None-Match'], '"1"')
+
+    # A changed body changes the fingerprint. An identical body does not.
+    r3 = api.getEscalator()
+    r4 = api.getEscalator()
+    self.assertNotEqual(r1.fingerprint, r3.fingerprint)
+    self.assertEqual(r3.fingerprint, r4.fingerprint)
+    self.assertNotIn('If-None-Match', self.session.requests[0])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import setup
+
+import os
+import tempfile
+import zipfile
+
+from dcmetrometrics.common.zip_utils import ZipEntryWriter, open_zip_for_writing
+
+class TestZipEntryWriter(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.path = tempfile.mkstemp(suffix = '.zip')
+    os.close(fd)
+
+  def tearDown(self):
+    os.unlink(self.path)
+
+  def test_stream_entries(self):
+    lines = ['%i,unit,%s\n'%(i, u'OPERATIONAL') for i in range(10000)]
+
+    zf = open_zip_for_writing(self.path)
+    with ZipEntryWriter(zf, 'dcmetrometrics/a.csv') as fout:
+      for l in lines:
+        fout.write(l)
+    with ZipEntryWriter(zf, 'dcmetrometrics/empty') as fout:
+      pass
+    zf.close()
+
+    zf = zipfile.ZipFile(self.path)
+    self.assertIsNone(zf.testzip())
+    self.assertEqual(zf.namelist(), ['dcmetrometrics/a.csv', 'dcmetrometrics/empty'])
+    self.assertEqual(zf.read('dcmetrometrics/a.csv'), ''.join(lines))
+    self.assertEqual(zf.read('dcmetrometrics/empty'), '')
+
+  def test_write_after_close(self):
+    zf = open_zip_for_writing(self.path)
+    fout = ZipEntryWriter(zf, 'a.csv')
+    fout.close()
+    self.assertRaises(ValueError, fout.write, 'data')
+    zf.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
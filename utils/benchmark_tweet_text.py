@@ -0,0 +1,130 @@
+"""
+Microbenchmark of the hot car tweet text pipeline.
+
+Time the analysis of the text of all stored HotCarTweets with the old
+pipeline, which compiled its patterns and tables on every call and
+preprocessed each text a second time to check for excluded words, and with
+the current pipeline, one tweet at a time with getHotCarDataFromText and as
+a batch with analyzeTexts.
+
+Usage:
+  python -m utils.benchmark_tweet_text [--repeat N] [--file texts.txt]
+"""
+
+from . import utils
+utils.fixSysPath()
+
+import re
+import sys
+import time
+import argparse
+
+from dcmetrometrics.hotcars.process_tweets import getHotCarDataFromText, analyzeTexts
+
+parser = argparse.ArgumentParser(description='Benchmark the hot car tweet text pipeline.')
+parser.add_argument('--repeat', type = int, default = 5,
+                   help='Number of times to repeat each benchmark. The best time is reported.')
+parser.add_argument('--file',
+                   help='Read tweet texts from a file with one text per line, instead of the database.')
+
+###########################################################
+# The pipeline before the patterns and tables were built at import,
+# kept here as the baseline of the benchmark.
+
+def old_preprocessText(tweetText):
+  tweetText = tweetText.encode('ascii', errors='ignore')
+  tweetText = tweetText.upper()
+  words = tweetText.split()
+  words = [w for w in words if (w[0] != '@') or (w == '@WMATA')]
+  tweetText = ' '.join(words)
+  tweetText = re.sub('[^a-zA-Z0-9\s]',' ', tweetText)
+  tweetText = re.sub('(\d+)', ' \\1 ', tweetText)
+  tweetText = re.sub('\s+', ' ', tweetText)
+  tweetText = re.sub('[1-6]000 SERIES', '', tweetText)
+  return tweetText
+
+def old_getCarNums(text):
+  nums = re.findall('\d+', text)
+  return [int(n) for n in set(s for s in nums if len(s)==4)]
+
+def old_getColors(text):
+  colorToWords = { 'RED' : ['RD', 'RL', 'REDLINE'],
+                   'BLUE' : ['BL', 'BLUELINE'],
+                   'GREEN' : ['GR', 'GL', 'GREENLINE'],
+                   'YELLOW' : ['YL', 'YELLOWLINE'],
+                   'ORANGE' : ['OL', 'ORANGELINE']
+                 }
+  for c, colorWordList in colorToWords.iteritems():
+      colorWordList.append(c)
+      colorToWords[c] = colorWordList
+  wordToColor = dict((w,k) for k,wlist in colorToWords.iteritems() for w in wlist)
+  words = text.split()
+  colors = (wordToColor.get(w, None) for w in words)
+  colors = [c for c in colors if c is not None]
+  if 'SV' in words:
+      colors.append('SILVER')
+  if ('SILVER' in words) and ("SPRING" not in words) and ("SPRNG" not in words):
+      colors.append('SILVER')
+  return list(set(colors))
+
+def old_isExcluded(text):
+  # tweetIsValidReport preprocessed the text again to look for excluded words.
+  excludedWords = set(w.upper() for w in ['MBTA', 'BART'])
+  return any(w in excludedWords for w in old_preprocessText(text).split())
+
+def old_getHotCarDataFromText(text):
+  pp = old_preprocessText(text)
+  return {'cars' : old_getCarNums(pp),
+          'colors' : old_getColors(pp),
+          'excluded' : old_isExcluded(text)}
+
+###########################################################
+
+def load_texts(fname = None):
+  if fname is not None:
+    with open(fname) as fin:
+      return [line.decode('utf-8').rstrip('\n') for line in fin]
+
+  from dcmetrometrics.common import dbGlobals
+  from dcmetrometrics.hotcars.models import HotCarTweet
+  dbGlobals.connect()
+  return [d['text'] for d in HotCarTweet.objects.only('text').as_pymongo() if d.get('text')]
+
+def best_time(func, repeat):
+  times = []
+  for i in range(repeat):
+    start = time.time()
+    func()
+    times.append(time.time() - start)
+  return min(times)
+
+def run(repeat = 5, fname = None):
+
+  texts = load_texts(fname)
+  if not texts:
+    sys.stderr.write('No tweet texts found.\n')
+    return
+
+  def old():
+    return [old_getHotCarDataFromText(t) for t in texts]
+
+  def per_tweet():
+    return [getHotCarDataFromText(t) for t in texts]
+
+  def batch():
+    return analyzeTexts(texts)
+
+  # The methods must agree.
+  for a, b, c in zip(old(), per_tweet(), batch()):
+    assert sorted(a['cars']) == sorted(b['cars']) == sorted(c['cars'])
+    assert sorted(a['colors']) == sorted(b['colors']) == sorted(c['colors'])
+    assert a['excluded'] == b['excluded'] == c['excluded']
+
+  print('%i tweets, best of %i:'%(len(texts), repeat))
+  for name, func in [('old', old), ('per tweet', per_tweet), ('batch', batch)]:
+    t = best_time(func, repeat)
+    print('  %-10s %8.3f s  %10.0f tweets/s'%(name, t, len(texts)/t if t > 0 else float('inf')))
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  run(repeat = args.repeat, fname = args.file)
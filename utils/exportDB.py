@@ -4,9 +4,28 @@ Dump MongoDB collections as json files.
 Create a DCMetroMetricsData.zip file.
 The zip file is available for download via URL:
 http://www.dcmetrometrics.com/data/DCMetroMetricsData.zip
+
+Collections are read through pymongo by a pool of worker threads. Each
+collection is written as newline-delimited json (one document per line,
+as mongoexport does) and compressed into a per-collection spool file
+in the dump cache. The spool files are then copied into the zip file
+without being recompressed.
+
+A collection is only dumped again if its document count or maximum _id
+has changed since the previous dump. Collections whose documents are
+updated in place are always dumped. Use --force to dump every collection.
 """
-import os, sys, subprocess, shutil
+import os, sys, subprocess, shutil, json
+import argparse
 from glob import glob
+from multiprocessing.pool import ThreadPool
+from bson import json_util
+
+import utils
+utils.fixSysPath()
+
+from dcmetrometrics.common import dbGlobals
+from dcmetrometrics.common.zip_utils import DeflateSpool, add_spool, open_zip_for_writing
 
 def p(msg):
     sys.stdout.write(msg + '\n')
@@ -19,8 +38,13 @@ DATA_DIR = os.environ['DATA_DIR']
 OUTPUT_DIR_BASE = os.path.join(DATA_DIR, 'mongoexport')
 JSON_DIR_NAME = 'DCMetroMetricsData'
 JSON_DIR = os.path.join(OUTPUT_DIR_BASE, JSON_DIR_NAME)
+CACHE_DIR = os.path.join(OUTPUT_DIR_BASE, 'cache')
+STATE_FILE = os.path.join(CACHE_DIR, 'state.json')
 SHARED_DATA_DIR = os.path.join(DATA_DIR, 'shared')
 
+WORKERS = 4 # Number of collections to dump concurrently
+BATCH_SIZE = 1000 # Number of documents to fetch per round trip
+
 # Making output directories if they do not exist
 def makeDir(path):
     if not os.path.exists(path):
@@ -28,6 +52,7 @@ def makeDir(path):
 
 makeDir(OUTPUT_DIR_BASE)
 makeDir(JSON_DIR)
+makeDir(CACHE_DIR)
 makeDir(SHARED_DATA_DIR)
 
 def dump(collection):
@@ -67,8 +92,114 @@ collections = [
 'temperatures',
 ]
 
+# Collections with documents that are modified in place. A change to these
+# collections is not reflected in the document count or maximum _id, so
+# they are always dumped. They are all small.
+always_dump = set([
+'elevator_appstate',
+'escalator_appstate',
+'escalators',
+'hotcars_appstate',
+'hotcars_forbidden_by_mention',
+'hotcars_tweeters',
+'hotcars_tweets',
+'symptom_codes',
+'webpages',
+])
+
+def spoolPath(collection):
+    return os.path.join(CACHE_DIR, '%s.json.deflate'%collection)
 
-def run():
+def loadState():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as fin:
+        return json.load(fin)
+
+def saveState(state):
+    tmpFile = STATE_FILE + '.tmp'
+    with open(tmpFile, 'w') as fout:
+        json.dump(state, fout, indent=2, sort_keys=True)
+    os.rename(tmpFile, STATE_FILE)
+
+def fingerprint(db, collection):
+    """
+    Return the document count and maximum _id of a collection.
+    """
+    coll = db[collection]
+    last = list(coll.find({}, ['_id']).sort('_id', -1).limit(1))
+    maxId = json_util.dumps(last[0]['_id']) if last else None
+    return {'count' : coll.count(), 'max_id' : maxId}
+
+def dumpCollection(db, collection, state, force=False):
+    """
+    Dump a collection as newline-delimited json into its spool file in the cache.
+    Skip the collection if it has not changed since the previous dump.
+
+    Return a dictionary with the collection's fingerprint and
+    the CRC and sizes of the spool file.
+    """
+    fp = fingerprint(db, collection)
+    prev = state.get(collection)
+
+    if not force and \
+       collection not in always_dump and \
+       prev and prev['fingerprint'] == fp and \
+       os.path.exists(spoolPath(collection)):
+        p('Skipping unchanged collection %s.'%collection)
+        return prev
+
+    p('Exporting collection %s...'%collection)
+    outFile = spoolPath(collection)
+    tmpFile = outFile + '.tmp'
+    with open(tmpFile, 'wb') as fout:
+        spool = DeflateSpool(fout)
+        cursor = db[collection].find(timeout=False).batch_size(BATCH_SIZE)
+        for doc in cursor:
+            spool.write(json_util.dumps(doc) + '\n')
+        cursor.close()
+        spool.close()
+    os.rename(tmpFile, outFile)
+    p('Exported collection %s: %i documents.'%(collection, fp['count']))
+
+    info = spool.info()
+    info['fingerprint'] = fp
+    return info
+
+def run(workers=WORKERS, force=False):
+
+    db = dbGlobals.getDB()
+    state = loadState()
+
+    # Dump collections concurrently
+    pool = ThreadPool(workers)
+    infos = pool.map(lambda c: dumpCollection(db, c, state, force), collections)
+    pool.close()
+    pool.join()
+
+    # Build the zip file from the spool files
+    outputZipFile = os.path.join(OUTPUT_DIR_BASE, '%s.zip'%JSON_DIR_NAME)
+    tmpZipFile = outputZipFile + '.tmp'
+    zf = open_zip_for_writing(tmpZipFile)
+    for c, info in zip(collections, infos):
+        with open(spoolPath(c), 'rb') as fin:
+            add_spool(zf, '%s/%s.json'%(JSON_DIR_NAME, c), fin, info)
+    zf.close()
+    os.rename(tmpZipFile, outputZipFile)
+
+    saveState(dict(zip(collections, infos)))
+
+    # Copy the zip file into the public data directory
+    # By placing in that directory, it is accessible thru:
+    # http://www.dcmetrometrics.com/data/<outputZipFile>
+    sharedZipFile = os.path.join(SHARED_DATA_DIR, os.path.basename(outputZipFile))
+    shutil.copy(outputZipFile, sharedZipFile + '.tmp')
+    os.rename(sharedZipFile + '.tmp', sharedZipFile)
+
+def runMongoexport():
+    """
+    Dump all collections with mongoexport, one at a time.
+    """
 
     # Remove old json and zip files
     os.chdir(OUTPUT_DIR_BASE)
@@ -98,4 +229,15 @@ def run():
     shutil.copy(outputZipFile, SHARED_DATA_DIR)
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description='Dump MongoDB collections as json.')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='Number of collections to dump concurrently.')
+    parser.add_argument('--force', action='store_true',
+                        help='Dump every collection, even if unchanged since the last dump.')
+    parser.add_argument('--mongoexport', action='store_true',
+                        help='Dump collections one at a time with mongoexport.')
+    args = parser.parse_args()
+    if args.mongoexport:
+        runMongoexport()
+    else:
+        run(args.workers, args.force)
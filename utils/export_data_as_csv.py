@@ -14,12 +14,18 @@ import shutil
 
 from dcmetrometrics.eles.models import Unit, SymptomCode, UnitStatus, SystemServiceReport
 from dcmetrometrics.common.globals import (WWW_DIR, REPO_DIR)
-from dcmetrometrics.common.DataWriter import DataWriter
+from dcmetrometrics.common.DataWriter import DataWriter, ZipDataWriter
 
 import argparse
 parser = argparse.ArgumentParser(description='Export CSV data.')
 parser.add_argument('--no-write', action = 'store_true',
                    help='Do not write database .csv files - use existing instead.')
+parser.add_argument('--incremental', action = 'store_true',
+                   help='Only regenerate the monthly partitions of unit statuses and daily unit reports that have changed.')
+parser.add_argument('--columnar', action = 'store_true',
+                   help='Also write the unit status history as a columnar table for analysis.')
+parser.add_argument('--stream', action = 'store_true',
+                   help='Stream the .csv files directly into the zip archive, without writing them to disk.')
 
 
 ##########################################
@@ -35,36 +41,71 @@ logger_eles = logging_utils.create_logger("ELESApp")
 #########################################
 
 
-def run(no_write = False):
+def write_all(dwriter, incremental = False):
+  """
+  Write all data files with the given DataWriter.
 
-  dwriter = DataWriter(WWW_DIR)
-  OUT_DIR = dwriter.outdir
-
-  if not no_write:
-
-    logger.info("Writing units...")
-    dwriter.write_units()
-    logger.info("done.")
+  If incremental is True, the unit statuses and daily unit reports
+  are assembled from monthly partitions, and only the partitions
+  which have changed since the last export are regenerated.
+  """
+  logger.info("Writing units...")
+  dwriter.write_units()
+  logger.info("done.")
 
-    logger.info("Writing unit statuses...")
+  logger.info("Writing unit statuses...")
+  if incremental:
+    dwriter.write_unit_statuses_incremental()
+  else:
     dwriter.write_unit_statuses()
-    logger.info("done.")
+  logger.info("done.")
 
-    logger.info("Writing hotcars...")
-    dwriter.write_hot_cars()
-    logger.info("done.")
+  logger.info("Writing hotcars...")
+  dwriter.write_hot_cars()
+  logger.info("done.")
 
-    logger.info("Writing stations...")
-    dwriter.write_stations()
-    logger.info("done")
+  logger.info("Writing stations...")
+  dwriter.write_stations()
+  logger.info("done")
 
-    logger.info("Writing daily system report...")
-    dwriter.write_system_daily_service_report()
-    logger.info("done")
+  logger.info("Writing daily system report...")
+  dwriter.write_system_daily_service_report()
+  logger.info("done")
 
-    logger.info("Writing daily unit report...")
+  logger.info("Writing daily unit report...")
+  if incremental:
+    dwriter.write_unit_daily_service_report_incremental()
+  else:
     dwriter.write_unit_daily_service_report()
-    logger.info("done")
+  logger.info("done")
+
+def run_stream(incremental = False):
+  """
+  Write the zip archive in a single pass. Each csv file is compressed into
+  the archive as rows come off the database cursor, and the finished
+  archive replaces the published one with an atomic rename.
+  """
+
+  with ZipDataWriter(WWW_DIR) as dwriter:
+
+    write_all(dwriter, incremental)
+
+    # Write a timestamp
+    dwriter.write_timestamp()
+
+    # Add the readme and the license
+    dwriter.add_file(os.path.join(REPO_DIR, 'data', 'data_readme.md'), 'README.md')
+    dwriter.add_file(os.path.join(REPO_DIR, 'data', 'odbl-10.txt'), 'LICENSE')
+
+    logger.info('writing to %s', dwriter.zip_path)
+
+def run(no_write = False, incremental = False):
+
+  dwriter = DataWriter(WWW_DIR)
+  OUT_DIR = dwriter.outdir
+
+  if not no_write:
+    write_all(dwriter, incremental)
 
   # Write a timestamp
   dwriter.write_timestamp()
@@ -88,7 +129,7 @@ def run(no_write = False):
   logger.info("copying output directory...")
   tree_to_zip = os.path.join(OUT_DIR, 'dcmetrometrics')
   shutil.rmtree(tree_to_zip, ignore_errors = True)
-  shutil.copytree(OUT_DIR, tree_to_zip)
+  shutil.copytree(OUT_DIR, tree_to_zip, ignore = shutil.ignore_patterns('partitions', 'columnar*', '*.tmp'))
 
   # zip the copied tree
   logger.info("making archive...")
@@ -108,7 +149,15 @@ if __name__ == '__main__':
   args = parser.parse_args()
 
   start_time = datetime.now()
-  run(args.no_write)
+  if args.columnar:
+    logger.info("Writing columnar unit statuses...")
+    DataWriter(WWW_DIR).write_unit_statuses_columnar()
+    logger.info("done")
+
+  if args.stream:
+    run_stream(args.incremental)
+  else:
+    run(args.no_write, args.incremental)
   end_time = datetime.now()
 
   run_time = (end_time - start_time).total_seconds()
@@ -11,9 +11,7 @@ utils.fixSysPath()
 
 import sys
 from datetime import datetime, date, timedelta
-import gc
 from operator import attrgetter
-# gc.set_debug(gc.DEBUG_STATS)
 
 
 from dcmetrometrics.common.dbGlobals import G
@@ -21,6 +19,7 @@ from dcmetrometrics.eles import dbUtils
 from dcmetrometrics.eles.models import Unit, SymptomCode, UnitStatus, SystemServiceReport
 from datetime import timedelta
 from dcmetrometrics.common.globals import WWW_DIR
+from dcmetrometrics.common.memory import MemoryBudget
 from dcmetrometrics.common.utils import gen_days
 
 ##########################################
@@ -98,16 +97,13 @@ def fix_all_end_times_and_merge_consecutive():
   num_units = Unit.objects.no_cache().count()
   sys.stderr.write("Have %i units\n"%num_units)
 
-  GARBAGE_COLLECT_INTERVAL = 20
+  memoryBudget = MemoryBudget(log = logger)
 
   for i, unit in enumerate(Unit.objects.no_cache()):
 
     INFO('Processing unit %s\n (%i of %i)'%(unit.unit_id, i, num_units))
 
-    if i%GARBAGE_COLLECT_INTERVAL == 0:
-      DEBUG("Running garbage collector after iteration over units.")
-      count = gc.collect()
-      DEBUG("Garbage collect returned %i"%count)
+    memoryBudget.check()
 
     unit_statuses = [s for s in UnitStatus.objects(unit = unit)]
 
@@ -152,16 +148,13 @@ def compute_daily_service_reports(start_day = None, end_day = None):
   num_units = Unit.objects.no_cache().count()
   sys.stderr.write("Have %i units\n"%num_units)
 
-  GARBAGE_COLLECT_INTERVAL = 20
+  memoryBudget = MemoryBudget(log = logger)
 
   for i, unit in enumerate(Unit.objects.no_cache()):
 
     INFO('Computing daily service report unit %s\n (%i of %i)'%(unit.unit_id, i, num_units))
 
-    if i%GARBAGE_COLLECT_INTERVAL == 0:
-      DEBUG("Running garbage collector after iteration over units.")
-      count = gc.collect()
-      DEBUG("Garbage collect returned %i"%count)
+    memoryBudget.check()
 
     unit_statuses = unit.get_statuses()
     unit.compute_daily_service_reports(start_day = start_day, last_day = end_day,
@@ -362,16 +355,13 @@ def recompute_performance_summaries():
   units = Unit.objects.no_cache()
   start = datetime.now()
   n =  units.count()
-  GARBAGE_COLLECT_INTERVAL = 10
+  memoryBudget = MemoryBudget(log = logger)
   for i, unit in enumerate(units):
 
     INFO("Computing performance summary for unit %s: %i of %i (%.2f%%)"%(unit.unit_id, i, n, 100.0*i/n))
     unit.compute_performance_summary(save = True)
 
-    if i%GARBAGE_COLLECT_INTERVAL == 0:
-      DEBUG("Running garbage collector after iteration over units.")
-      count = gc.collect()
-      DEBUG("Garbage collect returned %i"%count)
+    memoryBudget.check()
     
   elapsed = (datetime.now() - start).total_seconds()
   print "%.2f seconds elapsed"%elapsed
@@ -14,7 +14,7 @@ from datetime import datetime
 
 from dcmetrometrics.common.dbGlobals import G
 from dcmetrometrics.hotcars.models import (HotCarAppState, HotCarTweeter, HotCarTweet,
-  HotCarReport, CarsForbiddenByMention, Temperature)
+  HotCarReport, HotCarSummary, HotCarDailyCount, CarsForbiddenByMention, Temperature)
 from dcmetrometrics.hotcars.twitter_api import TwitterError, getTwitterAPI
 from datetime import timedelta
 import logging
@@ -73,7 +73,20 @@ def denormalize_reports():
   for doc in HotCarReport.iter_reports():
     doc.denormalize()
 
+def build_summaries():
+  """
+  Build the hotcars_summaries collection from all hot car reports.
+  """
+  HotCarSummary.rebuild()
+
+def build_daily_counts():
+  """
+  Build the hotcars_daily_counts collection from all hot car reports and temperatures.
+  """
+  HotCarDailyCount.rebuild()
+
 def write_json():
   jwriter = JSONWriter(WWW_DIR)
   jwriter.write_hotcars()
+  jwriter.write_hotcar_analytics()
   jwriter.write_hotcars_by_day()
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+Summarize the hot spots of the slow tick profiles in DATA_DIR/profiles.
+
+The profiles are written by apps run with PROFILE_TICKS set. See
+dcmetrometrics/common/profiling.py.
+
+Examples:
+
+  # Top frames of the last 5 sampled profiles of the ELES app
+  python -m utils.profile_summary --app App --last 5
+
+  # Top functions of the given cProfile dumps, by internal time
+  python -m utils.profile_summary --sort tottime data/profiles/HotCarApp-*.pstats
+"""
+
+from . import utils
+utils.fixSysPath()
+
+import sys
+import argparse
+
+parser = argparse.ArgumentParser(description='Summarize the hot spots of slow tick profiles.')
+parser.add_argument('paths', nargs = '*',
+                   help='Profile dumps to summarize. Defaults to the recent dumps in the profile directory.')
+parser.add_argument('--dir',
+                   help='Profile directory. Defaults to DATA_DIR/profiles.')
+parser.add_argument('--app',
+                   help='Only summarize the dumps of this app, the class name of its greenlet.')
+parser.add_argument('--last', type = int, default = 10,
+                   help='Number of most recent dumps to summarize.')
+parser.add_argument('--top', type = int, default = 25,
+                   help='Number of frames or functions to print.')
+parser.add_argument('--sort', default = None,
+                   help='Sort order: total or self for sampled stacks (default total), '
+                        'a pstats sort key for cProfile dumps (default cumulative).')
+
+def run(args):
+  from dcmetrometrics.common import profiling
+
+  paths = args.paths
+  if not paths:
+    paths = profiling.list_dumps(args.dir or profiling.PROFILE_DIR, args.app)[-args.last:]
+  if not paths:
+    sys.stderr.write('No profile dumps found.\n')
+    sys.exit(1)
+
+  collapsed = [p for p in paths if p.endswith('.collapsed')]
+  pstats_paths = [p for p in paths if p.endswith('.pstats')]
+  if collapsed:
+    print(profiling.format_collapsed_summary(collapsed, top = args.top, sort = args.sort or 'total'))
+  if pstats_paths:
+    if collapsed:
+      print('')
+    print(profiling.format_pstats_summary(pstats_paths, top = args.top, sort = args.sort or 'cumulative'))
+
+if __name__ == '__main__':
+  run(parser.parse_args())
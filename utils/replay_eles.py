@@ -0,0 +1,143 @@
+"""
+Replay recorded or synthetic WMATA incident snapshots through the ELES app
+tick, and report the tick latency, database operations and memory use.
+
+The replay uses a local MongoDB database which it drops and fills with the
+station documents at the start, MetroEscalatorsReplay by default, and
+temporary data and www directories. It refuses to run against the
+MetroEscalators database.
+
+Examples:
+
+  # Replay a directory of snapshots pickled by eles/escalatorRequest.py
+  python -m utils.replay_eles --snapshots /path/to/snapshots
+
+  # 5000 ticks of synthetic snapshots, writing per-tick samples
+  python -m utils.replay_eles --synthetic 5000 --samples samples.tsv
+
+  # Save 1000 synthetic snapshots to replay later
+  python -m utils.replay_eles --synthetic 1000 --save-snapshots /tmp/snapshots --no-replay
+"""
+
+import os
+import sys
+import tempfile
+import logging
+
+from . import utils
+utils.fixSysPath()
+
+# Set up the environment before importing dcmetrometrics.
+os.environ.setdefault('MONGODB_DATABASE', 'MetroEscalatorsReplay')
+os.environ.setdefault('MONGODB_HOST', 'localhost')
+os.environ.setdefault('MONGODB_PORT', '27017')
+os.environ.setdefault('REPO_DIR', utils.ROOT_DIR)
+os.environ.setdefault('PYTHON_DIR', '')
+os.environ.setdefault('INTERNAL_SERVE_IP', '127.0.0.1')
+os.environ.setdefault('INTERNAL_SERVE_PORT', '8000')
+for k in ['DATA_DIR', 'WWW_DIR']:
+  if k not in os.environ:
+    os.environ[k] = tempfile.mkdtemp(prefix = 'replay_eles_')
+
+import argparse
+parser = argparse.ArgumentParser(description='Replay WMATA incident snapshots through the ELES app tick.')
+parser.add_argument('--snapshots',
+                   help='Directory of snapshots (.pickle files from escalatorRequest.py, or .json files).')
+parser.add_argument('--synthetic', type = int, default = 0,
+                   help='Number of synthetic snapshots to replay after the recorded snapshots.')
+parser.add_argument('--units', type = int, default = None,
+                   help='Number of units in the synthetic snapshots. Defaults to the size of the WMATA system.')
+parser.add_argument('--seed', type = int, default = 0,
+                   help='Random seed for the synthetic snapshots.')
+parser.add_argument('--interval', type = float, default = 30.0,
+                   help='Seconds of virtual time between snapshots which do not record their time.')
+parser.add_argument('--save-snapshots',
+                   help='Directory to save the synthetic snapshots to, as JSON.')
+parser.add_argument('--no-replay', action = 'store_true',
+                   help='Only generate and save the synthetic snapshots.')
+parser.add_argument('--samples',
+                   help='File to write the per-tick samples to, tab separated.')
+parser.add_argument('--report-every', type = int, default = 100,
+                   help='Print progress every this many ticks.')
+parser.add_argument('--keep', action = 'store_true',
+                   help='Do not drop the replay database before starting.')
+parser.add_argument('--verbose', action = 'store_true',
+                   help='Show the log of the app.')
+
+def snapshots(args, clock):
+  """
+  Yield (request_time, incidents), for the recorded and then the synthetic snapshots.
+  """
+  from dcmetrometrics.eles.replay import iter_snapshots, save_snapshot, SyntheticIncidents
+
+  if args.snapshots:
+    for snapshot in iter_snapshots(args.snapshots):
+      yield snapshot
+
+  if args.synthetic:
+    kwargs = {'seed' : args.seed}
+    if args.units is not None:
+      kwargs['num_units'] = args.units
+    gen = SyntheticIncidents(**kwargs)
+    for i in range(args.synthetic):
+      request_time = clock()
+      incidents = gen.next_snapshot(request_time)
+      if args.save_snapshots:
+        save_snapshot(os.path.join(args.save_snapshots, 'snapshot_%06i.json'%i), incidents, request_time)
+      yield (request_time, incidents)
+      if args.no_replay:
+        clock.advance(args.interval)
+
+def run(args):
+
+  if args.save_snapshots and not os.path.isdir(args.save_snapshots):
+    os.makedirs(args.save_snapshots)
+
+  if args.no_replay:
+    from dcmetrometrics.eles.replay import VirtualClock
+    clock = VirtualClock()
+    n = sum(1 for s in snapshots(args, clock))
+    print('Saved %i snapshots'%n)
+    return
+
+  if not args.verbose:
+    logging.getLogger('ELESApp').addHandler(logging.NullHandler())
+    logging.getLogger('ELESApp').propagate = False
+
+  from dcmetrometrics.common import dbGlobals
+  from dcmetrometrics.common.globals import MONGODB_DATABASE
+  from dcmetrometrics.eles.replay import ELESReplay
+
+  if MONGODB_DATABASE == 'MetroEscalators':
+    sys.stderr.write('Refusing to replay against the MetroEscalators database. Set MONGODB_DATABASE.\n')
+    sys.exit(1)
+
+  dbGlobals.connect()
+  db = dbGlobals.getDB()
+  if not args.keep:
+    for name in db.collection_names():
+      if not name.startswith('system.'):
+        db.drop_collection(name)
+    from .migrations_eles import add_station_docs
+    add_station_docs()
+
+  replay = ELESReplay(db = db, interval = args.interval)
+  replay.install()
+  try:
+    for i, (request_time, incidents) in enumerate(snapshots(args, replay.clock)):
+      replay.run_tick(incidents, request_time)
+      if args.report_every and (i + 1) % args.report_every == 0:
+        s = replay.samples[-1]
+        print('Tick %i: %i incidents, %.4f s, %i db ops, %.1f MB, %i objects'%\
+          (i, s['incidents'], s['seconds'], s['db_ops'], s['rss']/1e6, s['objects']))
+  finally:
+    replay.uninstall()
+
+  if args.samples:
+    replay.write_samples(args.samples)
+
+  print('')
+  print(replay.format_report())
+
+if __name__ == '__main__':
+  run(parser.parse_args())
@@ -0,0 +1,94 @@
+"""
+Replay recorded or synthetic tweets through the HotCar tick and report
+the time and database operations of each phase.
+
+The replay uses a local MongoDB database which it drops at the start,
+MetroEscalatorsReplay by default, and temporary data and www directories.
+It refuses to run against the MetroEscalators database.
+
+Examples:
+
+  # Replay the recorded tweets in the test fixtures
+  python -m utils.replay_hotcars --fixtures test/fixtures/hotcar_tweets.json
+
+  # Ten ticks of 10000 synthetic tweets each
+  python -m utils.replay_hotcars --synthetic 10000 --ticks 10
+"""
+
+import os
+import sys
+import tempfile
+
+from . import utils
+utils.fixSysPath()
+
+# Set up the environment before importing dcmetrometrics.
+os.environ.setdefault('MONGODB_DATABASE', 'MetroEscalatorsReplay')
+os.environ.setdefault('MONGODB_HOST', 'localhost')
+os.environ.setdefault('MONGODB_PORT', '27017')
+os.environ.setdefault('REPO_DIR', utils.ROOT_DIR)
+os.environ.setdefault('PYTHON_DIR', '')
+os.environ.setdefault('INTERNAL_SERVE_IP', '127.0.0.1')
+os.environ.setdefault('INTERNAL_SERVE_PORT', '8000')
+for k in ['DATA_DIR', 'WWW_DIR']:
+  if k not in os.environ:
+    os.environ[k] = tempfile.mkdtemp(prefix = 'replay_hotcars_')
+
+import argparse
+parser = argparse.ArgumentParser(description='Replay tweets through the HotCar tick.')
+parser.add_argument('--fixtures',
+                   help='JSON file with a list of tweets in the Twitter JSON format, replayed in the first tick.')
+parser.add_argument('--synthetic', type = int, default = 0,
+                   help='Number of synthetic tweets to add in each tick.')
+parser.add_argument('--ticks', type = int, default = 1,
+                   help='Number of ticks to run.')
+parser.add_argument('--latency', type = float, default = 0.0,
+                   help='Simulated latency of each Twitter call, in seconds.')
+parser.add_argument('--honor-count', action = 'store_true',
+                   help='Limit the tweets returned by each Twitter call to its count argument, as Twitter does.')
+parser.add_argument('--seed', type = int, default = 0,
+                   help='Random seed for the synthetic tweets.')
+parser.add_argument('--keep', action = 'store_true',
+                   help='Do not drop the replay database before starting.')
+
+def run(args):
+
+  from dcmetrometrics.common import dbGlobals
+  from dcmetrometrics.common.globals import MONGODB_DATABASE
+  from dcmetrometrics.hotcars.replay import (ReplayTwitterAPI, HotCarReplay,
+    load_tweet_dicts, synthetic_tweet_dicts)
+
+  if MONGODB_DATABASE == 'MetroEscalators':
+    sys.stderr.write('Refusing to replay against the MetroEscalators database. Set MONGODB_DATABASE.\n')
+    sys.exit(1)
+
+  dbGlobals.connect()
+  db = dbGlobals.getDB()
+  if not args.keep:
+    for name in db.collection_names():
+      if not name.startswith('system.'):
+        db.drop_collection(name)
+
+  api = ReplayTwitterAPI(honor_count = args.honor_count, latency = args.latency)
+  replay = HotCarReplay(api, db = db)
+  replay.install()
+
+  next_id = 10**15
+  try:
+    for i in range(args.ticks):
+      tweets = []
+      if i == 0 and args.fixtures:
+        tweets.extend(load_tweet_dicts(args.fixtures))
+      if args.synthetic:
+        tweets.extend(synthetic_tweet_dicts(args.synthetic, start_id = next_id, seed = args.seed + i))
+        next_id += args.synthetic
+      elapsed = replay.run_tick(tweets)
+      print('Tick %i: %i tweets, %.4f s'%(i, len(tweets), elapsed))
+  finally:
+    replay.uninstall()
+
+  print('')
+  print(replay.format_report())
+
+if __name__ == '__main__':
+  run(parser.parse_args())
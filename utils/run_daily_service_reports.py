@@ -9,15 +9,14 @@ dbGlobals.connect()
 
 import sys, os
 from datetime import datetime, date, timedelta
-import gc
 from operator import attrgetter
-# gc.set_debug(gc.DEBUG_STATS)
 
 from dcmetrometrics.common.dbGlobals import G
 from dcmetrometrics.eles import dbUtils
 from dcmetrometrics.common.metroTimes import getLastOpenTime
 from dcmetrometrics.eles.models import Unit, SymptomCode, UnitStatus, SystemServiceReport
 from dcmetrometrics.common.globals import WWW_DIR
+from dcmetrometrics.common.memory import MemoryBudget
 from dcmetrometrics.common.utils import gen_days
 from dcmetrometrics.common.JSONifier import JSONWriter
 
@@ -105,16 +104,13 @@ def fix_all_end_times_and_merge_consecutive():
   num_units = Unit.objects.no_cache().count()
   sys.stderr.write("Have %i units\n"%num_units)
 
-  GARBAGE_COLLECT_INTERVAL = 20
+  memoryBudget = MemoryBudget(log = logger)
 
   for i, unit in enumerate(Unit.objects.no_cache()):
 
     INFO('Processing unit %s\n (%i of %i)'%(unit.unit_id, i, num_units))
 
-    if i%GARBAGE_COLLECT_INTERVAL == 0:
-      DEBUG("Running garbage collector after iteration over units.")
-      count = gc.collect()
-      DEBUG("Garbage collect returned %i"%count)
+    memoryBudget.check()
 
     unit_statuses = [s for s in UnitStatus.objects(unit = unit)]
 
@@ -164,7 +160,7 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
   num_units = Unit.objects.no_cache().count()
   sys.stderr.write("Have %i units\n"%num_units)
 
-  GARBAGE_COLLECT_INTERVAL = 20
+  memoryBudget = MemoryBudget(log = logger)
 
   min_start_day = force_min_start_day if force_min_start_day else start_day
 
@@ -177,10 +173,7 @@ def compute_daily_service_reports(start_day = None, end_day = None, force_min_st
 
     INFO('Computing daily service report unit %s\n (%i of %i)'%(unit.unit_id, i, num_units))
 
-    if i%GARBAGE_COLLECT_INTERVAL == 0:
-      DEBUG("Running garbage collector after iteration over units.")
-      count = gc.collect()
-      DEBUG("Garbage collect returned %i"%count)
+    memoryBudget.check()
 
     unit_statuses = sorted(unit.get_statuses(), key = attrgetter('time'), reverse = True)
 